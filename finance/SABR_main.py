@@ -5,7 +5,7 @@ import pandas as pd
 from scipy import interpolate
 from scipy.optimize import minimize
 
-from financial_module.SABR import haganLogNormalApprox
+from financial_module.SABR import haganLogNormalApprox, haganLogNormalApproxVec, calibrateSABR
 
 mklist = ['deeppink', 'darkviolet', 'slategrey', 'moccasin', 'olivedrab', 'goldenrod',
           'dodgerblue', 'coral', 'yellowgreen', 'skyblue', 'crimson']
@@ -76,24 +76,16 @@ delta_K = swaption_df.ix[:, 2:11].columns.astype(np.float).values / 100.
 
 
 def obj_func1(x, beta, swaption_df, delta_K):
-    vol_array = []
-    for i in range(len(swaption_df)):
-        vol_seq = [haganLogNormalApprox(swaption_df.ix[i, :]['ATM'] * 100 + j, swaption_df.ix[i, :]['Expiry'],
-                                        swaption_df.ix[i, :]['ATM'] * 100, x[i, 0], beta, x[i, 1], x[i, 2])
-                   for j in delta_K]
-        vol_array.append(vol_seq)
-    return np.array(vol_array) * 100.
+    x = np.asarray(x)
+    F_0 = swaption_df['ATM'].values[:, np.newaxis] * 100.
+    expiry = swaption_df['Expiry'].values[:, np.newaxis]
+    vol_array = haganLogNormalApproxVec(F_0 + delta_K, expiry, F_0, x[:, 0:1], beta, x[:, 1:2], x[:, 2:3])
+    return vol_array * 100.
 
 
 def obj_func2(x, beta, swaption_df, delta_K):
     # x : array-like [[alpha_1,nu_1,rho_1],[alpha_2,nu_2,rho_2],...[alpha_N,nu_N,rho_N]]
-    vol_array = []
-    for i in range(len(swaption_df)):
-        vol_seq = [haganLogNormalApprox(swaption_df.ix[i, :]['ATM'] * 100 + j, swaption_df.ix[i, :]['Expiry'],
-                                        swaption_df.ix[i, :]['ATM'] * 100, x[i, 0], beta, x[i, 1], x[i, 2])
-                   for j in delta_K]
-        vol_array.append(vol_seq)
-    ret = np.array(vol_array) * 100. - market_vol.values
+    ret = obj_func1(x, beta, swaption_df, delta_K) - market_vol.values
     return (ret * ret).sum()
 
 
@@ -162,6 +154,13 @@ opt = minimize(obj_func3_0, initial_anr, args=(initial_beta, swaption_df, delta_
                bounds=[[0, 1], [0, 1], [-1, 1]], options={'disp': True, 'ftol': 1e-8}, callback=optimized_x_to_vol)
 
 
+# batched calibration of all expiry/tenor buckets with analytic Jacobian
+F_0_all = swaption_df['ATM'].values * 100.
+x_all, opt_all = calibrateSABR(F_0_all[:, np.newaxis] + delta_K, swaption_df['Expiry'].values, F_0_all,
+                               market_vol.values / 100., initial_beta, x0=initial_x)
+print(x_all)
+
+
 def update_plot(i, ax, optimized_iter_vol):
     ax.clear()
     ax.set_xlim([-2.5, 2.5])
@@ -19,11 +19,7 @@ isCall = True
 
 
 def pricer(F_0, strike, expiry, vol, isCall):
-	ret = np.zeros(strike.shape)
-	for i in range(ret.shape[0]):
-		for j in range(ret.shape[1]):
-			ret[i, j] = black.black(F_0, strike[i, j], expiry[i, j], vol, isCall)
-	return ret
+	return black.black(F_0, strike, expiry, vol, isCall)
 
 
 def update_plot(i, fig, ax, im, vol):
@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 
 def haganLogNormalApprox(K, expiry, F_0, alpha_0, beta, nu, rho):
     """
@@ -39,3 +41,101 @@ def haganLogNormalApprox(K, expiry, F_0, alpha_0, beta, nu, rho):
                                      (0.25 * rho * beta * nu * alpha_0 / f_beta) +
                                      (2. - 3. * rho * rho) / 24. * nu * nu) * expiry)
     return sigma
+
+
+def haganLogNormalApproxVec(K, expiry, F_0, alpha_0, beta, nu, rho, jacobian=False):
+    """
+   NumPy version of haganLogNormalApprox: all arguments may be arrays
+   which are broadcast against each other (e.g. strikes of shape (N, n_K)
+   with expiries, forwards and parameters of shape (N, 1)).
+   :param K:option strike
+   :param expiry:option expiry
+   :param F_0:forward rate (e.g. forward interest rate, forward swaption rate)
+   :param alpha_0:SABR alpha at t=0
+   :param beta: SABR beta
+   :param nu: SABR Nu
+   :param rho: SABR Rho
+   :param jacobian: if True, also return the analytic derivatives
+   :return: Black implied volatility (and d sigma / d (alpha, nu, rho))
+   """
+    K, expiry, F_0, alpha_0, beta, nu, rho = np.broadcast_arrays(
+        *[np.asarray(a, dtype=float) for a in (K, expiry, F_0, alpha_0, beta, nu, rho)])
+    one_beta = 1. - beta
+    one_betasqr = one_beta * one_beta
+    fK_beta = np.power(F_0 * K, one_beta / 2.)
+    log_fK = np.log(F_0 / K)
+    # ATM or (numerically) close to ATM: z / x -> 1
+    atm = np.abs(log_fK) < 1e-8
+    D = 1. + one_betasqr / 24. * log_fK * log_fK + np.power(one_beta * log_fK, 4) / 1920.
+    z = nu / alpha_0 * fK_beta * log_fK
+    z_ = np.where(atm, 1., z)
+    s = np.sqrt(1. - 2. * rho * z_ + z_ * z_)
+    x = np.log((s + z_ - rho) / (1 - rho))
+    sigma_l = np.where(atm, alpha_0 / fK_beta, nu * log_fK / (D * np.where(atm, 1., x)))
+    sigma_exp = one_betasqr / 24. * alpha_0 * alpha_0 / fK_beta / fK_beta + \
+                0.25 * rho * beta * nu * alpha_0 / fK_beta + (2. - 3. * rho * rho) / 24. * nu * nu
+    sigma = sigma_l * (1. + sigma_exp * expiry)
+    if not jacobian:
+        return sigma[()]
+    # derivatives of sigma_l (dz/dalpha = -z/alpha, dz/dnu = z/nu, dx/dz = 1/s)
+    x_rho = (-z_ / s - 1.) / (s + z_ - rho) + 1. / (1. - rho)
+    dl_dalpha = np.where(atm, 1. / fK_beta, sigma_l * z_ / (x * s * alpha_0))
+    dl_dnu = np.where(atm, 0., sigma_l / nu * (1. - z_ / (x * s)))
+    dl_drho = np.where(atm, 0., -sigma_l / x * x_rho)
+    # derivatives of sigma_exp
+    de_dalpha = one_betasqr / 12. * alpha_0 / fK_beta / fK_beta + 0.25 * rho * beta * nu / fK_beta
+    de_dnu = 0.25 * rho * beta * alpha_0 / fK_beta + (2. - 3. * rho * rho) / 12. * nu
+    de_drho = 0.25 * beta * nu * alpha_0 / fK_beta - 0.25 * rho * nu * nu
+    factor = 1. + sigma_exp * expiry
+    d_alpha = dl_dalpha * factor + sigma_l * expiry * de_dalpha
+    d_nu = dl_dnu * factor + sigma_l * expiry * de_dnu
+    d_rho = dl_drho * factor + sigma_l * expiry * de_drho
+    return sigma[()], (d_alpha[()], d_nu[()], d_rho[()])
+
+
+def calibrateSABR(K, expiry, F_0, market_vol, beta, x0=None, bounds=None):
+    """
+   Calibrates (alpha, nu, rho) of all expiry/tenor buckets at once
+   by a single least-squares run with the analytic (block diagonal)
+   Jacobian of haganLogNormalApproxVec.
+   :param K: strikes, array (N, n_K)
+   :param expiry: option expiries, array (N,)
+   :param F_0: forward rates, array (N,)
+   :param market_vol: market Black volatilities, array (N, n_K)
+   :param beta: SABR beta (common for all buckets)
+   :param x0: initial [[alpha_1,nu_1,rho_1],...,[alpha_N,nu_N,rho_N]]
+   :param bounds: (lower, upper) for (alpha, nu, rho)
+   :return: calibrated parameters, array (N, 3), and the optimization result
+   """
+    from scipy.optimize import least_squares
+    from scipy.sparse import csr_matrix
+    K = np.asarray(K, dtype=float)
+    market_vol = np.asarray(market_vol, dtype=float)
+    N, n_K = K.shape
+    expiry = np.asarray(expiry, dtype=float).reshape(N, 1)
+    F_0 = np.asarray(F_0, dtype=float).reshape(N, 1)
+    if x0 is None:
+        x0 = np.tile([0.3, 0.4, 0.], (N, 1))
+    if bounds is None:
+        bounds = ([1e-8, 0., -0.9999], [np.inf, np.inf, 0.9999])
+    lower = np.tile(bounds[0], N)
+    upper = np.tile(bounds[1], N)
+    # sparsity pattern: residuals of bucket i only depend on its 3 parameters
+    rows = np.repeat(np.arange(N * n_K), 3)
+    cols = (np.repeat(np.arange(N), n_K * 3) * 3 + np.tile(np.arange(3), N * n_K))
+
+    def residuals(x):
+        x = x.reshape(N, 3)
+        return (haganLogNormalApproxVec(K, expiry, F_0, x[:, 0:1], beta, x[:, 1:2], x[:, 2:3])
+                - market_vol).ravel()
+
+    def jacobian(x):
+        x = x.reshape(N, 3)
+        jac = haganLogNormalApproxVec(K, expiry, F_0, x[:, 0:1], beta, x[:, 1:2], x[:, 2:3],
+                                      jacobian=True)[1]
+        data = np.dstack([d.ravel() for d in jac]).ravel()
+        return csr_matrix((data, (rows, cols)), shape=(N * n_K, N * 3))
+
+    opt = least_squares(residuals, np.asarray(x0, dtype=float).ravel(), jac=jacobian,
+                        bounds=(lower, upper), method='trf', tr_solver='lsmr')
+    return opt.x.reshape(N, 3), opt
@@ -1,11 +1,13 @@
 import math
 
-from scipy.stats import norm
+import numpy as np
+from scipy.special import ndtr
 
 
 def black(F_0, y, expiry, vol, isCall):
     """
-    Black formula
+    Black formula (array-native: all arguments may be NumPy arrays
+    which are broadcast against each other)
     :param F_0: forward rate at time 0
     :param y: strike price
     :param expiry: option expiry
@@ -13,23 +15,24 @@ def black(F_0, y, expiry, vol, isCall):
     :param isCall: True or False
     :return:
     """
+    F_0, y, expiry, vol, isCall = np.broadcast_arrays(
+        np.asarray(F_0, dtype=float), np.asarray(y, dtype=float),
+        np.asarray(expiry, dtype=float), np.asarray(vol, dtype=float),
+        np.asarray(isCall, dtype=bool))
 
-    option_value = 0
+    # zero expiry or volatility: intrinsic value
+    intrinsic = np.where(isCall, np.maximum(F_0 - y, 0.), np.maximum(y - F_0, 0.))
+    degenerate = expiry * vol == 0.
+    expiry = np.where(degenerate, 1., expiry)
+    vol = np.where(degenerate, 1., vol)
 
-    if expiry * vol == 0.:
-        if isCall:
-            option_value = max(F_0 - y, 0.)
-        else:
-            option_value = max(y - F_0, 0.)
-    else:
-        d1 = dPlusBlack(F_0, y, expiry, vol)
-        d2 = dMinusBlack(F_0, y, expiry, vol)
-        if isCall:
-            option_value = F_0 * norm.cdf(d1) - y * norm.cdf(d2)
-        else:
-            option_value = -F_0 * norm.cdf(-d1) + y * norm.cdf(d2)
+    d1 = dPlusBlack(F_0, y, expiry, vol)
+    d2 = d1 - vol * np.sqrt(expiry)
+    call_value = F_0 * ndtr(d1) - y * ndtr(d2)
+    put_value = y * ndtr(-d2) - F_0 * ndtr(-d1)
+    option_value = np.where(degenerate, intrinsic, np.where(isCall, call_value, put_value))
 
-    return option_value
+    return option_value[()]
 
 
 def dPlusBlack(F_0, y, expiry, vol):
@@ -41,7 +44,7 @@ def dPlusBlack(F_0, y, expiry, vol):
     :param vol: Black implied volatility
     :return: d+ term
     """
-    d_plus = (math.log(F_0 / y) + 0.5 * vol * vol * expiry) / vol / math.sqrt(expiry)
+    d_plus = (np.log(F_0 / y) + 0.5 * vol * vol * expiry) / vol / np.sqrt(expiry)
     return d_plus
 
 
@@ -54,6 +57,68 @@ def dMinusBlack(F_0, y, expiry, vol):
     :param vol: Black implied volatility
     :return: d- term
     """
-    d_minus = dPlusBlack(F_0, y, expiry, vol) - vol * math.sqrt(expiry)
+    d_minus = dPlusBlack(F_0, y, expiry, vol) - vol * np.sqrt(expiry)
 
     return d_minus
+
+
+def vegaBlack(F_0, y, expiry, vol):
+    """
+    Vega of the Black formula (same for calls and puts)
+    :param F_0: forward rate at time 0
+    :param y: strike price
+    :param expiry: option expiry
+    :param vol: Black implied volatility
+    :return: d price / d vol
+    """
+    d_plus = dPlusBlack(F_0, y, expiry, vol)
+    return F_0 * np.exp(-0.5 * d_plus * d_plus) / math.sqrt(2. * math.pi) * np.sqrt(expiry)
+
+
+def impliedVolBlack(price, F_0, y, expiry, isCall, tol=1e-10, maxiter=20):
+    """
+    Implied Black volatilities for a whole quote array in one call:
+    rational initial guess (Corrado-Miller) refined by vectorized
+    Halley iterations using vega and volga.
+    :param price: (undiscounted) option prices
+    :param F_0: forward rate at time 0
+    :param y: strike price
+    :param expiry: option expiry
+    :param isCall: True or False
+    :param tol: tolerance for the price difference
+    :param maxiter: maximum number of Halley iterations
+    :return: implied volatilities (NaN for prices outside the no-arbitrage bounds)
+    """
+    price, F_0, y, expiry, isCall = np.broadcast_arrays(
+        np.asarray(price, dtype=float), np.asarray(F_0, dtype=float),
+        np.asarray(y, dtype=float), np.asarray(expiry, dtype=float),
+        np.asarray(isCall, dtype=bool))
+
+    # put prices to call prices by put-call parity
+    call = np.where(isCall, price, price + F_0 - y)
+    valid = (call > np.maximum(F_0 - y, 0.)) & (call < F_0) & (expiry > 0.)
+
+    # Corrado-Miller initial guess for vol * sqrt(expiry)
+    half = call - 0.5 * (F_0 - y)
+    root = np.sqrt(np.maximum(half * half - (F_0 - y) ** 2 / math.pi, 0.))
+    total_vol = math.sqrt(2. * math.pi) / (F_0 + y) * (half + root)
+    sqrt_expiry = np.sqrt(np.where(valid, expiry, 1.))
+    vol = np.where(valid & (total_vol > 0.), total_vol / sqrt_expiry, 0.2)
+
+    active = valid.copy()
+    for _ in range(maxiter):
+        if not active.any():
+            break
+        d1 = dPlusBlack(F_0, y, sqrt_expiry ** 2, vol)
+        d2 = d1 - vol * sqrt_expiry
+        diff = F_0 * ndtr(d1) - y * ndtr(d2) - call
+        vega = F_0 * np.exp(-0.5 * d1 * d1) / math.sqrt(2. * math.pi) * sqrt_expiry
+        volga = vega * d1 * d2 / vol
+        step = diff / vega
+        step = step / (1. - 0.5 * step * volga / vega)
+        new_vol = np.where(active, vol - step, vol)
+        # keep the iterates positive
+        vol = np.where(new_vol > 0., new_vol, 0.5 * vol)
+        active = active & (np.abs(diff) > tol)
+
+    return np.where(valid, vol, np.nan)[()]
@@ -29,6 +29,7 @@ from scipy.integrate import quad
 from scipy import stats
 from scipy.optimize import fsolve
 from dx_frame import market_environment
+from black import impliedVolBlack
 
 
 #
@@ -134,23 +135,17 @@ class BSM_european_option(object):
 		return vega
 
 	def imp_vol(self, price, otype='call', volatility_est=0.2):
-		''' Return implied volatility given option price. '''
-		me = market_environment('iv', self.pricing_date)
-		me.add_environment(self.mar_env)
-		me.add_constant('volatility', volatility_est)
-		option = BSM_european_option('ivc', me)
-		option.update_ttm()
-
-		def difference(volatility_est):
-			option.volatility = volatility_est
-			if otype == 'call':
-				return option.call_value() - price
-			if otype == 'put':
-				return (option.put_value() - price) ** 2
-			else:
-				raise ValueError('No valid option type.')
-
-		iv = fsolve(difference, volatility_est)[0]
+		''' Return implied volatility given option price
+		(price may also be an array of quotes). '''
+		self.update_ttm()
+		if otype not in ('call', 'put'):
+			raise ValueError('No valid option type.')
+		# forward and undiscounted price for the Black inverter
+		forward = self.initial_value * exp((self.short_rate
+		                                    - self.dividend_yield) * self.ttm)
+		undiscounted = np.asarray(price) * exp(self.short_rate * self.ttm)
+		iv = impliedVolBlack(undiscounted, forward, self.strike, self.ttm,
+		                     otype == 'call')
 		return iv
 
 
@@ -475,3 +470,154 @@ def B96_char_func(u, T, r, kappa_v, theta_v, sigma_v, rho, v0,
 	BCC1 = H93_char_func(u, T, r, kappa_v, theta_v, sigma_v, rho, v0)
 	BCC2 = M76_char_func(u, T, lamb, mu, delta)
 	return BCC1 * BCC2
+
+
+#
+# Batch Valuation for Strike and Maturity Grids
+#
+
+laguerre_nodes = {}
+
+
+def get_laguerre_nodes(nodes):
+	''' Returns the (cached) Gauss-Laguerre nodes and the weights
+	multiplied by exp(nodes) for integrals over (0, inf). '''
+	if nodes not in laguerre_nodes:
+		u, w = np.polynomial.laguerre.laggauss(nodes)
+		laguerre_nodes[nodes] = (u, w * np.exp(u))
+	return laguerre_nodes[nodes]
+
+
+def get_times_to_maturity(mar_env, maturities):
+	''' Returns array of times-to-maturity in years given maturities as
+	datetime objects or as year fractions. '''
+	ttms = []
+	for maturity in maturities:
+		if isinstance(maturity, (int, float, np.number)):
+			ttms.append(float(maturity))
+		else:
+			ttms.append((maturity - mar_env.pricing_date).days / 365.)
+	return np.array(ttms)
+
+
+def batch_call_values(char_func, S0, strikes, ttms, r, nodes=100):
+	''' Valuation of European call options for a grid of strikes and
+	maturities via Lewis (2001) with fixed Gauss-Laguerre nodes; the
+	characteristic function is evaluated once for all nodes and
+	maturities, the integrals for all strikes follow from a single
+	matrix product.
+
+	Parameters
+	==========
+	char_func : function
+		characteristic function char_func(u, T), vectorized in u and T
+	S0 : float
+		initial stock/index level
+	strikes : array
+		strike prices (n_K,)
+	ttms : array
+		times-to-maturity in years (n_T,)
+	r : float
+		constant risk-free short rate
+	nodes : int
+		number of Gauss-Laguerre nodes
+
+	Returns
+	=======
+	call_values: array (n_T, n_K)
+		present values of European call options
+	'''
+	strikes = np.asarray(strikes, dtype=float)
+	ttms = np.asarray(ttms, dtype=float)
+	u, w = get_laguerre_nodes(nodes)
+	# (n_T, n_u): characteristic function times weights of the integral
+	char_func_values = char_func(u[np.newaxis, :] - 0.5 * 1j,
+	                             ttms[:, np.newaxis])
+	char_func_values = char_func_values * (w / (u ** 2 + 0.25))
+	# (n_K, n_u): strike-dependent part of the integrand
+	moneyness = np.exp(1j * np.log(S0 / strikes)[:, np.newaxis]
+	                   * u[np.newaxis, :])
+	int_values = np.dot(char_func_values, moneyness.T).real
+	call_values = (S0 - np.exp(-r * ttms)[:, np.newaxis]
+	               * np.sqrt(S0 * strikes)[np.newaxis, :] / np.pi * int_values)
+	return np.maximum(0, call_values)
+
+
+def M76_call_values(mar_env, strikes, maturities, nodes=100):
+	''' Batch valuation of European call options in M76 model for arrays
+	of strikes and maturities (datetime objects or year fractions).
+
+	Returns
+	=======
+	call_values: array (len(maturities), len(strikes))
+		present values of European call options
+	'''
+	try:
+		S0 = mar_env.get_constant('initial_value')
+		r = mar_env.get_curve('discount_curve').short_rate
+		lamb = mar_env.get_constant('lambda')
+		mu = mar_env.get_constant('mu')
+		delta = mar_env.get_constant('delta')
+		volatility = mar_env.get_constant('volatility')
+	except:
+		print "Error parsing market environment."
+
+	ttms = get_times_to_maturity(mar_env, maturities)
+	char_func = lambda u, T: M76_char_func_sa(u, T, r, volatility,
+	                                          lamb, mu, delta)
+	return batch_call_values(char_func, S0, strikes, ttms, r, nodes)
+
+
+def H93_call_values(mar_env, strikes, maturities, nodes=100):
+	''' Batch valuation of European call options in H93 model for arrays
+	of strikes and maturities (datetime objects or year fractions).
+
+	Returns
+	=======
+	call_values: array (len(maturities), len(strikes))
+		present values of European call options
+	'''
+	try:
+		S0 = mar_env.get_constant('initial_value')
+		r = mar_env.get_curve('discount_curve').short_rate
+		kappa_v = mar_env.get_constant('kappa')
+		theta_v = mar_env.get_constant('theta')
+		sigma_v = mar_env.get_constant('vol_vol')
+		rho = mar_env.get_constant('rho')
+		v0 = mar_env.get_constant('volatility') ** 2
+	except:
+		print "Error parsing market environment."
+
+	ttms = get_times_to_maturity(mar_env, maturities)
+	char_func = lambda u, T: H93_char_func(u, T, r, kappa_v, theta_v,
+	                                       sigma_v, rho, v0)
+	return batch_call_values(char_func, S0, strikes, ttms, r, nodes)
+
+
+def B96_call_values(mar_env, strikes, maturities, nodes=100):
+	''' Batch valuation of European call options in B96 model for arrays
+	of strikes and maturities (datetime objects or year fractions).
+
+	Returns
+	=======
+	call_values: array (len(maturities), len(strikes))
+		present values of European call options
+	'''
+	try:
+		S0 = mar_env.get_constant('initial_value')
+		r = mar_env.get_curve('discount_curve').short_rate
+		kappa_v = mar_env.get_constant('kappa')
+		theta_v = mar_env.get_constant('theta')
+		sigma_v = mar_env.get_constant('vol_vol')
+		rho = mar_env.get_constant('rho')
+		v0 = mar_env.get_constant('volatility') ** 2
+		lamb = mar_env.get_constant('lambda')
+		mu = mar_env.get_constant('mu')
+		delta = mar_env.get_constant('delta')
+	except:
+		print "Error parsing market environment."
+
+	ttms = get_times_to_maturity(mar_env, maturities)
+	char_func = lambda u, T: B96_char_func(u, T, r, kappa_v, theta_v,
+	                                       sigma_v, rho, v0, lamb, mu, delta)
+	return batch_call_values(char_func, S0, strikes, ttms, r, nodes)
@@ -25,11 +25,18 @@
 #
 
 import math
+import warnings
 import numpy as np
 import pandas as pd
 import datetime as dt
 import scipy.interpolate as sci
 import scipy.optimize as sco
+from scipy.special import ndtr, ndtri
+try:
+    from scipy.stats import qmc
+except ImportError:
+    # scipy < 1.7: Sobol sequences not available, Halton is built in
+    qmc = None
 
 # Helper functions
 
@@ -40,7 +47,7 @@ def get_year_deltas(time_list, day_count=365.):
     Parameters
     ==========
     time_list : list or array
-        collection of datetime objects
+        collection of datetime objects (or date_grid object)
     day_count : float
         number of days for a year
         (to account for different conventions)
@@ -51,6 +58,9 @@ def get_year_deltas(time_list, day_count=365.):
         year fractions
     '''
 
+    if isinstance(time_list, date_grid):
+        # precomputed day offsets, no datetime arithmetic
+        return time_list.get_year_deltas(day_count)
     delta_list = []
     start = time_list[0]
     for time in time_list:
@@ -60,7 +70,8 @@ def get_year_deltas(time_list, day_count=365.):
 
 
 def sn_random_numbers(shape, antithetic=True, moment_matching=True,
-                      fixed_seed=False):
+                      fixed_seed=False, method='pseudo', brownian_bridge=True,
+                      stream=0, seed=None, skip=None, random_state=None):
     ''' Return an array of shape "shape" with (pseudo-) random numbers
     which are standard normally distributed.
     
@@ -74,18 +85,40 @@ def sn_random_numbers(shape, antithetic=True, moment_matching=True,
         matching of first and second moments
     fixed_seed : boolean
         flag to fix the seed
+    method : string
+        'pseudo' (default), or 'sobol'/'halton' for scrambled
+        quasi-random numbers (see qmc_random_numbers; antithetic
+        variates and moment matching are not applied to these)
+    brownian_bridge : boolean
+        Brownian bridge ordering of the time dimension (quasi-random only)
+    stream : int
+        index of an independently scrambled sequence (quasi-random only)
+    seed, skip : int
+        scrambling seed and number of points to skip for drawing
+        consecutive blocks of one sequence (quasi-random only)
+    random_state : np.random.RandomState
+        generator to draw from instead of the (seeded) global
+        generator (pseudo-random only)
     
     Results
     =======
     ran : (o, n, m) array of (pseudo-)random numbers
     '''
-    if fixed_seed is True:
-        np.random.seed(1000)
+    if method != 'pseudo':
+        return qmc_random_numbers(shape, method=method,
+                                  brownian_bridge=brownian_bridge,
+                                  fixed_seed=fixed_seed, stream=stream,
+                                  seed=seed, skip=skip)
+    if random_state is None:
+        if fixed_seed is True:
+            np.random.seed(1000)
+        random_state = np.random
     if antithetic is True:
-        ran = np.random.standard_normal((shape[0], shape[1], shape[2] / 2))
+        ran = random_state.standard_normal((shape[0], shape[1],
+                                            shape[2] / 2))
         ran = np.concatenate((ran, -ran), axis=2)
     else:
-        ran = np.random.standard_normal(shape)
+        ran = random_state.standard_normal(shape)
     if moment_matching is True:
         ran = ran - np.mean(ran)
         ran = ran / np.std(ran)
@@ -94,6 +127,293 @@ def sn_random_numbers(shape, antithetic=True, moment_matching=True,
     else:
         return ran
 
+
+def get_primes(d):
+    ''' Return the first d prime numbers. '''
+    primes = []
+    candidate = 2
+    while len(primes) < d:
+        if all(candidate % p != 0 for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton_points(n, d, seed=None, skip=0):
+    ''' Return n points of the d-dimensional Halton sequence, scrambled
+    by random digit permutations (one permutation per base and digit).
+    
+    Parameters
+    ==========
+    n : int
+        number of points
+    d : int
+        dimension
+    seed : int or None
+        seed of the scrambling
+    skip : int
+        number of points of the sequence to skip
+    
+    Results
+    =======
+    points : (n, d) array of quasi-random numbers in (0, 1)
+    '''
+    rng = np.random.RandomState(seed)
+    index = np.arange(skip + 1, skip + n + 1)
+    points = np.zeros((n, d))
+    for j, base in enumerate(get_primes(d)):
+        # enough digits for double precision
+        digits = int(math.ceil(53 * math.log(2) / math.log(base)))
+        rest = index.copy()
+        factor = 1. / base
+        for k in range(digits):
+            perm = rng.permutation(base)
+            points[:, j] += perm[rest % base] * factor
+            rest //= base
+            factor /= base
+    return points
+
+
+def brownian_bridge_increments(ran):
+    ''' Return standard normal increments of Brownian motions built by
+    a Brownian bridge from the numbers ran along axis 1: the first
+    number fixes the terminal value, the following ones the midpoints
+    of ever finer intervals. Most of the variance of a path is thus
+    carried by the first (best distributed) quasi-random dimensions.
+    
+    Parameters
+    ==========
+    ran : (o, n, m) array
+        independent standard normal numbers, in bridge order
+    
+    Results
+    =======
+    increments : (o, n, m) array
+        independent standard normal increments, in time order
+    '''
+    n = ran.shape[1]
+    W = np.zeros((ran.shape[0], n + 1, ran.shape[2]))
+    W[:, n] = math.sqrt(n) * ran[:, 0]
+    intervals = [(0, n)]
+    k = 1
+    while intervals:
+        left, right = intervals.pop(0)
+        if right - left < 2:
+            continue
+        mid = (left + right) // 2
+        W[:, mid] = (((right - mid) * W[:, left] + (mid - left) * W[:, right])
+                     / float(right - left)
+                     + math.sqrt((mid - left) * (right - mid)
+                                 / float(right - left)) * ran[:, k])
+        k += 1
+        intervals.extend([(left, mid), (mid, right)])
+    return np.diff(W, axis=1)
+
+
+def qmc_random_numbers(shape, method='sobol', brownian_bridge=True,
+                       fixed_seed=False, stream=0, seed=None, skip=None):
+    ''' Return an array of shape "shape" with scrambled quasi-random
+    numbers transformed to standard normals by the inverse normal cdf.
+    Every path (last axis) is one point of a low-discrepancy sequence
+    whose dimensions cover all risk factors and time steps 1, ..., n - 1
+    (the first time slice is not used by the models and set to zero).
+    
+    Parameters
+    ==========
+    shape : tuple (o, n, m)
+        generation of array with shape (o, n, m)
+    method : string
+        'sobol' (requires scipy.stats.qmc) or 'halton'
+    brownian_bridge : boolean
+        Brownian bridge ordering of the time dimension
+    fixed_seed : boolean
+        flag to fix the scrambling
+    stream : int
+        index of an independently scrambled sequence
+    seed : int
+        scrambling seed of the stream (overrides fixed_seed); blocks
+        drawn with the same seed are parts of one sequence
+    skip : int
+        number of points of the sequence to skip, i.e. the first path
+        of the block (None: a single draw from the start)
+    
+    Results
+    =======
+    ran : (o, n, m) array of quasi-random numbers
+    '''
+    o, M, I = shape
+    steps = max(M - 1, 1)
+    d = o * steps
+    if seed is not None:
+        seed = seed + stream
+    elif fixed_seed is True:
+        seed = 1000 + stream
+    if method == 'sobol':
+        if qmc is None:
+            raise ValueError('Sobol sequences require scipy.stats.qmc.')
+        engine = qmc.Sobol(d, scramble=True, seed=seed)
+        if skip is None:
+            u = engine.random(I)
+        else:
+            if skip > 0:
+                engine.fast_forward(skip)
+            with warnings.catch_warnings():
+                # balance holds for the whole sequence, not single blocks
+                warnings.simplefilter('ignore')
+                u = engine.random(I)
+    elif method == 'halton':
+        u = halton_points(I, d, seed=seed, skip=skip or 0)
+    else:
+        raise ValueError('Random source %s not known.' % method)
+    u = np.clip(u, 1e-12, 1 - 1e-12)
+    # dimension k drives risk factor k % o at (bridge) step k // o,
+    # i.e. the first dimensions go to the first step of every factor
+    z = ndtri(u).reshape(I, steps, o).transpose(2, 1, 0)
+    if brownian_bridge is True:
+        z = brownian_bridge_increments(z)
+    if M > 1:
+        ran = np.zeros((o, M, I))
+        ran[:, 1:] = z
+    else:
+        ran = z
+    if o == 1:
+        return ran[0]
+    else:
+        return ran
+
+
+def correlate_random_numbers(cholesky_matrix, random_numbers):
+    ''' Return the random numbers correlated by the Cholesky matrix for
+    all risk factors and time steps by a single matrix product.
+
+    Parameters
+    ==========
+    cholesky_matrix : (o, o) array
+        lower triangular Cholesky matrix of the correlation matrix
+    random_numbers : (o, n, m) array
+        independent standard normally distributed random numbers
+
+    Results
+    =======
+    ran : read-only (o, n, m) array of correlated random numbers
+    '''
+    o = cholesky_matrix.shape[0]
+    shape = (o,) + random_numbers.shape[-2:]
+    ran = np.dot(cholesky_matrix, random_numbers.reshape((o, -1)))
+    ran = ran.reshape(shape)
+    ran.flags.writeable = False
+    return ran
+
+# Time grid
+
+class date_grid(object):
+    ''' Class for a simulation time grid stored as integer day offsets
+    from its first date; shared by models, valuation classes and
+    discount curves (all of which also accept the plain datetime array).
+
+    Attributes
+    ==========
+    dates : array
+        datetime objects of the grid (sorted, no duplicates)
+    days : array
+        int32 day offsets from the first date
+    day_count : float
+        number of days for a year
+    dt : array
+        M - 1 year fractions between consecutive dates
+    index : dict
+        date -> position in the grid
+    key : tuple
+        hashable representation of the grid (the dates themselves,
+        e.g. for caches)
+
+    Methods
+    =======
+    get_index :
+        returns the position of a date in the grid
+    get_year_deltas :
+        returns the year fractions from the first date
+    get_time_deltas :
+        returns the year fractions between consecutive dates
+    get_sub_grid :
+        returns the date_grid for a slice of the grid
+    '''
+
+    def __init__(self, dates, day_count=365., days=None):
+        self.dates = np.asarray(dates)
+        if days is None:
+            # the only datetime arithmetic, once per grid
+            start = self.dates[0]
+            days = [(d - start).days for d in self.dates]
+        self.days = np.asarray(days, dtype=np.int32)
+        self.day_count = day_count
+        self.dt = np.diff(self.days) / day_count
+        self.dt.flags.writeable = False
+        self.index = dict((d, i) for i, d in enumerate(self.dates))
+        # dates may differ by time of day only
+        self.key = tuple(self.dates)
+
+    def __len__(self):
+        return len(self.days)
+
+    def get_index(self, date):
+        ''' Returns the position of date in the grid (KeyError if the
+        date is not part of the grid). '''
+        return self.index[date]
+
+    def get_year_deltas(self, day_count=365.):
+        return self.days / day_count
+
+    def get_time_deltas(self, day_count=365.):
+        if day_count == self.day_count:
+            return self.dt
+        return np.diff(self.days) / day_count
+
+    def get_sub_grid(self, start, stop):
+        ''' Returns the date_grid for the dates start, ..., stop - 1. '''
+        days = self.days[start:stop]
+        return date_grid(self.dates[start:stop], self.day_count,
+                         days - days[0])
+
+
+def generate_date_grid(start, end, frequency, special_dates=()):
+    ''' Return date_grid object from start to end with pandas frequency
+    (e.g. 'B' for Business Day, 'W' for Weekly, 'M' for Monthly),
+    enhanced by start, end and all special dates later than start.
+
+    Parameters
+    ==========
+    start, end : datetime objects
+        first and last (regular) date of the grid
+    frequency : string
+        pandas frequency string
+    special_dates : list
+        additional dates, e.g. maturities
+
+    Results
+    =======
+    grid : date_grid
+        sorted grid without duplicate dates; dates on the same day
+        with different times of day (e.g. a maturity at 12:00) are
+        kept as separate grid points
+    '''
+    dates = [start]
+    dates.extend(pd.date_range(start=start, end=end,
+                               freq=frequency).to_pydatetime())
+    dates.append(end)
+    dates.extend([d for d in special_dates if d > start])
+    # sort and delete duplicates on the datetime objects
+    dates = sorted(set(dates))
+    return date_grid(dates)
+
+
+def get_dates(time_list):
+    ''' Return datetime objects of a date_grid or of a list/array. '''
+    if isinstance(time_list, date_grid):
+        return time_list.dates
+    return time_list
+
+
 # Discounting classes
 
 class constant_short_rate(object):
@@ -180,7 +500,7 @@ class deterministic_short_rate(object):
         yield_spline = sci.splrep(dlist, self.yield_list[:, 1], k=k)
         yield_curve = sci.splev(tlist, yield_spline, der=0)
         yield_deriv = sci.splev(tlist, yield_spline, der=1)
-        return np.array([time_list, yield_curve, yield_deriv]).T
+        return np.array([get_dates(time_list), yield_curve, yield_deriv]).T
 
     def get_forward_rates(self, time_list, paths=None, dtobjects=True):
         yield_curve = self.get_interpolated_yields(time_list, dtobjects)
@@ -24,6 +24,7 @@
 #
 
 from dx_frame import *
+from SABR import haganLogNormalApproxVec
 
 
 class simulation_class(object):
@@ -42,10 +43,31 @@ class simulation_class(object):
     =======
     generate_time_grid :
         returns time grid for simulation
+    get_grid :
+        returns the date_grid object of the time grid
+    get_time_index :
+        returns the position of a date in the time grid
+    get_time_deltas :
+        returns year fractions between consecutive dates of the time grid
+    get_random_numbers :
+        returns standard normal numbers from the random source of the
+        market environment (pseudo-random, Sobol or Halton)
+    get_correlated_random_numbers :
+        returns the correlated random numbers for a single time step
+    get_random_slices :
+        returns the (correlated) random numbers for all time steps
     get_instrument_values:
         returns the current instrument values (array)
+    get_instrument_value_blocks:
+        yields the instrument values in blocks of paths
+    get_bumped_values :
+        returns instrument values for bumped parameters without
+        new simulation (common random numbers)
     '''
 
+    # True if the simulated paths are proportional to initial_value
+    scale_invariant = False
+
     def __init__(self, name, mar_env, corr):
         try:
             self.name = name
@@ -63,46 +85,148 @@ class simulation_class(object):
                 self.time_grid = mar_env.get_list('time_grid')
             except:
                 self.time_grid = None
+            try:
+                # date_grid shared with other objects (portfolio valuation)
+                self.grid = mar_env.get_list('date_grid')
+            except:
+                self.grid = None
             try:
                 # if there are special dates, then add these
                 self.special_dates = mar_env.get_list('special_dates')
             except:
                 self.special_dates = []
+            try:
+                # simulation engine: 'loop' (default) or 'vectorized'
+                self.engine = mar_env.get_constant('engine')
+            except:
+                self.engine = 'loop'
+            try:
+                # floating point type for vectorized engine
+                self.dtype = np.dtype(mar_env.get_constant('dtype'))
+            except:
+                self.dtype = np.dtype(np.float64)
+            try:
+                # number of paths per block for streaming valuation
+                self.block_size = mar_env.get_constant('block_size')
+            except:
+                self.block_size = None
+            try:
+                # random source: 'pseudo' (default), 'sobol' or 'halton'
+                self.random_source = mar_env.get_constant('random_source')
+            except:
+                self.random_source = 'pseudo'
+            try:
+                # Brownian bridge ordering of the time dimension (QMC only)
+                self.brownian_bridge = mar_env.get_constant(
+                                                    'brownian_bridge')
+            except:
+                self.brownian_bridge = True
+            try:
+                # discretization: 'euler' (full truncation, default),
+                # 'exact' (square-root/mean-reverting diffusions) or
+                # 'qe' (stochastic volatility models)
+                self.scheme = mar_env.get_constant('scheme')
+            except:
+                self.scheme = 'euler'
             self.instrument_values = None
+            # (seed, first path) of the current quasi-random block
+            self.qmc_block = None
+            # RandomState of the current block stream (None: global one)
+            self.random_state = None
             self.correlated = corr
+            self.precorrelated = False
             if corr is True:
                 # only needed in a portfolio context when
                 # risk factors are correlated
                 self.cholesky_matrix = mar_env.get_list('cholesky_matrix')
                 self.rn_set = mar_env.get_list('rn_set')[self.name]
                 self.random_numbers = mar_env.get_list('random_numbers')
+                try:
+                    # random numbers already correlated once for
+                    # all risk factors (e.g. by the portfolio)
+                    self.precorrelated = mar_env.get_constant(
+                                            'random_numbers_correlated')
+                except:
+                    self.precorrelated = False
         except:
             print "Error parsing market environment."
 
     def generate_time_grid(self):
-        start = self.pricing_date
-        end = self.final_date
-        # pandas date_range function
         # freq = e.g. 'B' for Business Day,
-        # 'W' for Weekly, 'M' for Monthly
-        time_grid = pd.date_range(start=start, end=end,
-                                  freq=self.frequency).to_pydatetime()
-        time_grid = list(time_grid)
-        # enhance time_grid by start, end and special_dates
-        if start not in time_grid:
-            time_grid.insert(0, start)
-            # insert start date if not in list
-        if end not in time_grid:
-            time_grid.append(end)
-            # insert end date if not in list
-        if len(self.special_dates) > 0:
-            # add all special dates later than self.pricing_date
-            add_dates = [d for d in self.special_dates
-                            if d > self.pricing_date]
-            time_grid.extend(add_dates)
-            # delete duplicates and sort
-            time_grid = sorted(set(time_grid))
-        self.time_grid = np.array(time_grid)
+        # 'W' for Weekly, 'M' for Monthly;
+        # enhanced by start, end and special_dates
+        self.grid = generate_date_grid(self.pricing_date, self.final_date,
+                                       self.frequency, self.special_dates)
+        self.time_grid = self.grid.dates
+
+    def get_grid(self):
+        ''' Returns the date_grid object (day offsets, year fractions,
+        date-to-index map) of the time grid; built once per time grid.
+        '''
+        if self.time_grid is None:
+            self.generate_time_grid()
+        if self.grid is None or self.grid.dates is not self.time_grid:
+            self.grid = date_grid(self.time_grid)
+        return self.grid
+
+    def get_time_index(self, date):
+        ''' Returns the position of date in the time grid. '''
+        return self.get_grid().get_index(date)
+
+    def get_time_deltas(self, day_count=365.):
+        ''' Returns the M - 1 year fractions between consecutive dates
+        of the time grid (computed once instead of once per time step).
+        '''
+        return self.get_grid().get_time_deltas(day_count)
+
+    def get_random_numbers(self, M, I, fixed_seed=False, stream=0):
+        ''' Returns an (M, I) array of standard normal numbers from the
+        random source of the market environment. Different streams
+        (e.g. for the jump or volatility component) use independently
+        scrambled quasi-random sequences; for pseudo-random numbers the
+        stream is ignored. Within get_instrument_value_blocks the
+        quasi-random numbers of a block continue the sequence of the
+        previous block (same scrambling, points skipped).
+        '''
+        if self.qmc_block is not None:
+            seed, skip = self.qmc_block
+            return sn_random_numbers((1, M, I), method=self.random_source,
+                                     brownian_bridge=self.brownian_bridge,
+                                     stream=stream, seed=seed, skip=skip)
+        return sn_random_numbers((1, M, I), fixed_seed=fixed_seed,
+                                 method=self.random_source,
+                                 brownian_bridge=self.brownian_bridge,
+                                 stream=stream,
+                                 random_state=self.random_state)
+
+    def get_random_state(self):
+        ''' Returns the RandomState of the current block stream or,
+        outside get_instrument_value_blocks, the global generator. '''
+        if self.random_state is None:
+            return np.random
+        return self.random_state
+
+    def get_correlated_random_numbers(self, rand, t):
+        ''' Returns the correlated random numbers of the risk factor
+        for time step t given the (F, M, I) random number array.
+        '''
+        if self.precorrelated is True:
+            return rand[self.rn_set, t]
+        # only the row of the Cholesky matrix for this risk factor
+        return np.dot(self.cholesky_matrix[self.rn_set], rand[:, t, :])
+
+    def get_random_slices(self, rand):
+        ''' Returns the random numbers for time steps 1, ..., M - 1
+        as (M - 1, I) array; in the correlated case the Cholesky
+        row of the risk factor is applied to all time steps at once.
+        '''
+        if self.correlated is False:
+            return rand[1:]
+        elif self.precorrelated is True:
+            return rand[self.rn_set, 1:]
+        else:
+            return np.tensordot(self.cholesky_matrix[self.rn_set],
+                                rand[:, 1:, :], axes=1)
 
     def get_instrument_values(self, fixed_seed=True):
         if self.instrument_values is None:
@@ -113,6 +237,70 @@ class simulation_class(object):
             self.generate_paths(fixed_seed=fixed_seed, day_count=365.)
         return self.instrument_values
 
+    def get_instrument_value_blocks(self, block_size, fixed_seed=True):
+        ''' Generator yielding the instrument values in blocks of
+        (at most) block_size paths, i.e. arrays of shape (M, block_size).
+        Only one block is held in memory at a time. block_size should be
+        even when antithetic variates are used; moment matching is
+        applied per block. With fixed_seed the pseudo-random numbers
+        of the stream come from a local RandomState; the global generator
+        is not reseeded. Random numbers drawn by a stochastic_short_rate
+        discount curve are not part of the stream, so for such curves
+        streamed values agree with a single draw in distribution only.
+        '''
+        if self.time_grid is None:
+            self.generate_time_grid()
+        total_paths = self.paths
+        if self.correlated is True:
+            random_numbers = self.random_numbers
+        if fixed_seed is True:
+            # seeded once for the whole stream, not once per block
+            random_state = np.random.RandomState(1000)
+        else:
+            random_state = None
+        if self.random_source != 'pseudo':
+            # one scrambled sequence per stream for all blocks; with the
+            # fixed seed the blocks make up the sequence of a single draw
+            if fixed_seed is True:
+                qmc_seed = 1000
+            else:
+                qmc_seed = np.random.randint(0, 2 ** 30)
+        try:
+            for start in range(0, total_paths, block_size):
+                stop = min(start + block_size, total_paths)
+                self.paths = stop - start
+                self.random_state = random_state
+                if self.random_source != 'pseudo':
+                    self.qmc_block = (qmc_seed, start)
+                if self.correlated is True:
+                    self.random_numbers = random_numbers[:, :, start:stop]
+                self.generate_paths(fixed_seed=False, day_count=365.)
+                yield self.instrument_values
+        finally:
+            self.paths = total_paths
+            self.qmc_block = None
+            self.random_state = None
+            if self.correlated is True:
+                self.random_numbers = random_numbers
+            # a single block is not a valid full simulation
+            self.instrument_values = None
+
+    def get_bumped_values(self, initial_value=None, volatility=None,
+                          short_rate_shift=None):
+        ''' Returns the instrument values for a bumped initial value
+        derived from the stored instrument values (same random numbers,
+        no new simulation). Returns None if the bump can not be derived
+        from the stored paths for the model.
+        '''
+        if volatility is not None or short_rate_shift is not None:
+            return None
+        if self.scale_invariant is False:
+            return None
+        paths = self.get_instrument_values(fixed_seed=True)
+        if initial_value is None:
+            return paths
+        return paths * (initial_value / float(self.initial_value))
+
 
 class geometric_brownian_motion(simulation_class):
     ''' Class to generate simulated paths based on
@@ -133,8 +321,18 @@ class geometric_brownian_motion(simulation_class):
         updates parameters
     generate_paths :
         returns Monte Carlo paths given the market environment
+    generate_paths_vectorized :
+        returns Monte Carlo paths by a single cumulative sum over
+        the log increments (engine 'vectorized')
+    get_brownian_values :
+        returns the Brownian motion values implied by the paths
+    get_bumped_values :
+        returns instrument values for bumped initial value, volatility
+        and/or short rate without new simulation
     '''
 
+    scale_invariant = True
+
     def __init__(self, name, mar_env, corr=False):
         super(geometric_brownian_motion, self).__init__(name, mar_env, corr)
 
@@ -155,6 +353,9 @@ class geometric_brownian_motion(simulation_class):
 
     def generate_paths(self, fixed_seed=False, day_count=365.):
         ''' Generates Monte Carlo paths for the model. '''
+        if self.engine == 'vectorized':
+            return self.generate_paths_vectorized(fixed_seed=fixed_seed,
+                                                  day_count=day_count)
         if self.time_grid is None:
             self.generate_time_grid()
             # method from generic model simulation class
@@ -168,8 +369,7 @@ class geometric_brownian_motion(simulation_class):
         paths[0] = self.initial_value
         if self.correlated is False:
             # if not correlated generate random numbers
-            rand = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            rand = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             # if correlated use random number object as provided
             # in market environment
@@ -177,7 +377,9 @@ class geometric_brownian_motion(simulation_class):
 
         # forward rates for drift of process
         forward_rates = self.discount_curve.get_forward_rates(
-            self.time_grid, self.paths, dtobjects=True)[1]
+            self.get_grid(), self.paths, dtobjects=True)[1]
+        # differences between two dates as year fractions
+        delta_t = self.get_time_deltas(day_count)
 
         for t in range(1, len(self.time_grid)):
             # select the right time slice from the relevant
@@ -185,10 +387,8 @@ class geometric_brownian_motion(simulation_class):
             if self.correlated is False:
                 ran = rand[t]
             else:
-                ran = np.dot(self.cholesky_matrix, rand[:, t, :])
-                ran = ran[self.rn_set]
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
-              # difference between two dates as year fraction
+                ran = self.get_correlated_random_numbers(rand, t)
+            dt = delta_t[t - 1]
             rt = (forward_rates[t - 1] + forward_rates[t]) / 2
             paths[t] = paths[t - 1] * np.exp((rt - 0.5
                                               * self.volatility ** 2) * dt
@@ -196,6 +396,87 @@ class geometric_brownian_motion(simulation_class):
               # generate simulated values for the respective date
         self.instrument_values = paths
 
+    def generate_paths_vectorized(self, fixed_seed=False, day_count=365.):
+        ''' Generates Monte Carlo paths for the model without a Python
+        loop over the time grid: all log increments are computed in one
+        pass and accumulated by a cumulative sum. Uses the same random
+        numbers as generate_paths, i.e. the results coincide for a
+        fixed seed (up to floating point precision).
+        '''
+        if self.time_grid is None:
+            self.generate_time_grid()
+        M = len(self.time_grid)
+        I = self.paths
+        if self.correlated is False:
+            rand = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
+        else:
+            rand = self.random_numbers
+        ran = self.get_random_slices(rand)
+
+        forward_rates = self.discount_curve.get_forward_rates(
+            self.get_grid(), self.paths, dtobjects=True)[1]
+        forward_rates = np.asarray(forward_rates, dtype=np.float64)
+
+        # year fractions and drift/diffusion terms, computed once
+        dt = self.get_time_deltas(day_count)[:, np.newaxis]
+        rt = (forward_rates[:-1] + forward_rates[1:]) / 2
+        if rt.ndim == 1:
+            rt = rt[:, np.newaxis]
+        drift = ((rt - 0.5 * self.volatility ** 2) * dt).astype(self.dtype)
+        diffusion = (self.volatility * np.sqrt(dt)).astype(self.dtype)
+
+        # log increments written directly into the paths array
+        paths = np.empty((M, I), dtype=self.dtype)
+        paths[0] = 0.0
+        paths[1:] = ran
+        paths[1:] *= diffusion
+        paths[1:] += drift
+        np.cumsum(paths, axis=0, out=paths)
+        np.exp(paths, out=paths)
+        paths *= self.initial_value
+        self.instrument_values = paths
+
+    def get_brownian_values(self, day_count=365.):
+        ''' Returns the year fractions t (M, 1), the integrated forward
+        rates R (M, 1) and the Brownian motion values W (M, I) implied
+        by the stored paths, i.e. S_t = S_0 exp(R_t - sigma^2 t / 2
+        + sigma W_t). Returns None for stochastic forward rates.
+        '''
+        paths = self.get_instrument_values(fixed_seed=True)
+        forward_rates = np.asarray(self.discount_curve.get_forward_rates(
+            self.get_grid(), self.paths, dtobjects=True)[1], dtype=np.float64)
+        if forward_rates.ndim > 1:
+            return None
+        dt = self.get_time_deltas(day_count)
+        t = np.concatenate(([0.], np.cumsum(dt)))[:, np.newaxis]
+        R = np.concatenate(([0.], np.cumsum((forward_rates[:-1]
+                            + forward_rates[1:]) / 2 * dt)))[:, np.newaxis]
+        W = ((np.log(paths / float(self.initial_value)) - R
+              + 0.5 * self.volatility ** 2 * t) / self.volatility)
+        return t, R, W
+
+    def get_bumped_values(self, initial_value=None, volatility=None,
+                          short_rate_shift=None):
+        ''' Returns the instrument values for bumped initial value,
+        volatility and/or parallel short rate shift rebuilt from the
+        Brownian motion values implied by the stored paths. '''
+        if volatility is None and short_rate_shift is None:
+            return super(geometric_brownian_motion,
+                         self).get_bumped_values(initial_value=initial_value)
+        brownian_values = self.get_brownian_values()
+        if brownian_values is None:
+            return None
+        t, R, W = brownian_values
+        if initial_value is None:
+            initial_value = self.initial_value
+        if volatility is None:
+            volatility = self.volatility
+        if short_rate_shift is None:
+            short_rate_shift = 0.0
+        return initial_value * np.exp(R + short_rate_shift * t
+                                      - 0.5 * volatility ** 2 * t
+                                      + volatility * W)
+
 
 class jump_diffusion(simulation_class):
     ''' Class to generate simulated paths based on
@@ -218,6 +499,8 @@ class jump_diffusion(simulation_class):
         returns Monte Carlo paths given the market environment
     '''
 
+    scale_invariant = True
+
     def __init__(self, name, mar_env, corr=False):
         super(jump_diffusion, self).__init__(name, mar_env, corr)
         try:
@@ -262,8 +545,7 @@ class jump_diffusion(simulation_class):
         paths[0] = self.initial_value
         if self.correlated is False:
             # if not correlated generate random numbers
-            sn1 = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            sn1 = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             # if correlated use random number object as provided
             # in market environment
@@ -271,13 +553,14 @@ class jump_diffusion(simulation_class):
 
         # Standard normally distributed seudo-random numbers
         # for the jump component
-        sn2 = sn_random_numbers((1, M, I),
-                                fixed_seed=fixed_seed)
+        sn2 = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=1)
 
         forward_rates = self.discount_curve.get_forward_rates(
-            self.time_grid, self.paths, dtobjects=True)[1]
+            self.get_grid(), self.paths, dtobjects=True)[1]
 
         rj = self.lamb * (np.exp(self.mu + 0.5 * self.delt ** 2) - 1)
+        # differences between two dates as year fractions
+        delta_t = self.get_time_deltas(day_count)
         for t in range(1, len(self.time_grid)):
                         # select the right time slice from the relevant
             # random number set
@@ -285,11 +568,9 @@ class jump_diffusion(simulation_class):
                 ran = sn1[t]
             else:
                 # only with correlation in portfolio context
-                ran = np.dot(self.cholesky_matrix, sn1[:, t, :])
-                ran = ran[self.rn_set]
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
-              # difference between two dates as year fraction
-            poi = np.random.poisson(self.lamb * dt, I)
+                ran = self.get_correlated_random_numbers(sn1, t)
+            dt = delta_t[t - 1]
+            poi = self.get_random_state().poisson(self.lamb * dt, I)
               # Poisson distributed pseudo-random numbers for jump component
             rt = (forward_rates[t - 1] + forward_rates[t]) / 2
             paths[t] = paths[t - 1] * (np.exp((rt - rj-
@@ -300,6 +581,71 @@ class jump_diffusion(simulation_class):
         self.instrument_values = paths
 
 
+def heston_qe_step(v, dt, kappa, theta, vol_vol, rho, z_v, z, psi_c=1.5):
+    ''' Quadratic-exponential (QE) step of Andersen (2008) for the
+    Heston variance together with the martingale corrected log price
+    increment (central discretization, gamma_1 = gamma_2 = 0.5).
+
+    Parameters
+    ==========
+    v : array
+        variance values at the start of the step
+    dt : float
+        length of the time step (year fraction)
+    kappa, theta, vol_vol, rho : float
+        parameters of the variance process and correlation
+    z_v : array
+        standard normals driving the variance
+    z : array
+        standard normals driving the log price, independent of z_v
+    psi_c : float
+        switching level between the quadratic and exponential branch
+
+    Returns
+    =======
+    v_new : array
+        variance values at the end of the step
+    increment : array
+        log price increment without the drift r * dt
+    '''
+    ekt = math.exp(-kappa * dt)
+    m = theta + (v - theta) * ekt
+    s2 = (v * vol_vol ** 2 * ekt / kappa * (1 - ekt)
+          + theta * vol_vol ** 2 / (2 * kappa) * (1 - ekt) ** 2)
+    psi = s2 / m ** 2
+    quad = psi <= psi_c
+    # quadratic branch: v_new = a * (b + z_v) ** 2
+    psi_q = np.minimum(psi, psi_c)
+    b2 = 2 / psi_q - 1 + np.sqrt(2 / psi_q) * np.sqrt(2 / psi_q - 1)
+    a = m / (1 + b2)
+    # exponential branch: mass p at zero, exponential tail
+    psi_e = np.maximum(psi, psi_c)
+    p = (psi_e - 1) / (psi_e + 1)
+    beta = (1 - p) / m
+    u = ndtr(z_v)
+    v_exp = np.where(u <= p, 0.,
+                     np.log((1 - p) / np.maximum(1 - u, 1e-300)) / beta)
+    v_new = np.where(quad, a * (np.sqrt(b2) + z_v) ** 2, v_exp)
+
+    k1 = 0.5 * dt * (kappa * rho / vol_vol - 0.5) - rho / vol_vol
+    k2 = 0.5 * dt * (kappa * rho / vol_vol - 0.5) + rho / vol_vol
+    k3 = 0.5 * dt * (1 - rho ** 2)
+    k4 = k3
+    # martingale correction: K0 such that E[exp(increment)] = 1
+    A = k2 + 0.5 * k4
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k0_quad = (-A * b2 * a / (1 - 2 * A * a)
+                   + 0.5 * np.log(1 - 2 * A * a))
+        k0_exp = -np.log(p + beta * (1 - p) / (beta - A))
+        k0_exp = np.where(beta > A, k0_exp, np.nan)
+    k0 = np.where(quad, k0_quad, k0_exp) - (k1 + 0.5 * k3) * v
+    # plain K0 where the moment generating function does not exist
+    k0 = np.where(np.isfinite(k0), k0, -rho * kappa * theta / vol_vol * dt)
+    increment = (k0 + k1 * v + k2 * v_new
+                 + np.sqrt(k3 * v + k4 * v_new) * z)
+    return v_new, increment
+
+
 class stochastic_volatility(simulation_class):
     ''' Class to generate simulated paths based on
     the Heston (1993) stochastic volatility model.
@@ -321,8 +667,13 @@ class stochastic_volatility(simulation_class):
         returns Monte Carlo paths given the market environment
     get_volatility_values :
         returns array with simulated volatility paths
+    qe_step :
+        quadratic-exponential step for variance and log price,
+        used if 'scheme' is 'qe' (no moment matching then)
     '''
 
+    scale_invariant = True
+
     def __init__(self, name, mar_env, corr=False):
         super(stochastic_volatility, self).__init__(name, mar_env, corr)
         try:
@@ -372,26 +723,32 @@ class stochastic_volatility(simulation_class):
         va[0] = self.volatility ** 2
         va_[0] = self.volatility ** 2
         if self.correlated is False:
-            sn1 = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            sn1 = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             sn1 = self.random_numbers
 
         # Pseudo-random numbers for the stochastic volatility
-        sn2 = sn_random_numbers((1, M, I), fixed_seed=fixed_seed)
+        sn2 = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=1)
 
         forward_rates = self.discount_curve.get_forward_rates(
-            self.time_grid, self.paths, dtobjects=True)[1]
+            self.get_grid(), self.paths, dtobjects=True)[1]
+
+        delta_t = self.get_time_deltas(day_count)
 
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             if self.correlated is False:
                 ran = sn1[t]
             else:
-                ran = np.dot(self.cholesky_matrix, sn1[:, t, :])
-                ran = ran[self.rn_set]
+                ran = self.get_correlated_random_numbers(sn1, t)
             rat = np.array([ran, sn2[t]])
             rat = np.dot(self.leverage, rat)
+            rt = (forward_rates[t - 1] + forward_rates[t]) / 2
+
+            if self.scheme == 'qe':
+                va[t], increment = self.qe_step(va[t - 1], dt, rat, sn2[t])
+                paths[t] = paths[t - 1] * np.exp(rt * dt + increment)
+                continue
 
             va_[t] = (va_[t - 1] + self.kappa
                          * (self.theta - np.maximum(0, va_[t - 1])) * dt
@@ -399,7 +756,6 @@ class stochastic_volatility(simulation_class):
                          * self.vol_vol * np.sqrt(dt) * rat[1])
             va[t] = np.maximum(0, va_[t])
 
-            rt = (forward_rates[t - 1] + forward_rates[t]) / 2
             paths[t] = paths[t - 1] * (np.exp((rt - 0.5 * va[t]) * dt
                                     + np.sqrt(va[t]) * np.sqrt(dt) * rat[0]))
 
@@ -410,6 +766,16 @@ class stochastic_volatility(simulation_class):
         self.instrument_values = paths
         self.volatility_values = np.sqrt(va)
 
+    def qe_step(self, v, dt, rat, sn):
+        ''' Andersen QE step (see heston_qe_step) for the correlated
+        normals rat = (price shock, variance shock); sn are the
+        uncorrelated normals behind the variance shock.
+        '''
+        # price shock without its projection on the variance shock
+        z = self.leverage[1, 1] * rat[0] - self.leverage[1, 0] * sn
+        return heston_qe_step(v, dt, self.kappa, self.theta, self.vol_vol,
+                              self.rho, rat[1], z)
+
     def get_volatility_values(self):
         if self.volatility_values is None:
             self.generate_paths(self)
@@ -437,8 +803,13 @@ class stoch_vol_jump_diffusion(simulation_class):
         returns Monte Carlo paths for the market environment
     get_volatility_values :
         returns array with simulated volatility paths
+    qe_step :
+        quadratic-exponential step for variance and log price,
+        used if 'scheme' is 'qe' (no moment matching then)
     '''
 
+    scale_invariant = True
+
     def __init__(self, name, mar_env, corr=False):
         super(stoch_vol_jump_diffusion, self).__init__(name, mar_env, corr)
         try:
@@ -501,32 +872,39 @@ class stoch_vol_jump_diffusion(simulation_class):
         va[0] = self.volatility ** 2
         va_[0] = self.volatility ** 2
         if self.correlated is False:
-            sn1 = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            sn1 = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             sn1 = self.random_numbers
 
         # Pseudo-random numbers for the jump component
-        sn2 = sn_random_numbers((1, M, I),
-                                 fixed_seed=fixed_seed)
+        sn2 = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=1)
         # Pseudo-random numbers for the stochastic volatility
-        sn3 = sn_random_numbers((1, M, I),
-                                 fixed_seed=fixed_seed)
+        sn3 = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=2)
 
         forward_rates = self.discount_curve.get_forward_rates(
-            self.time_grid, self.paths, dtobjects=True)[1]
+            self.get_grid(), self.paths, dtobjects=True)[1]
 
         rj = self.lamb * (np.exp(self.mu + 0.5 * self.delt ** 2) - 1)
 
+        delta_t = self.get_time_deltas(day_count)
+
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             if self.correlated is False:
                 ran = sn1[t]
             else:
-                ran = np.dot(self.cholesky_matrix, sn1[:, t, :])
-                ran = ran[self.rn_set]
+                ran = self.get_correlated_random_numbers(sn1, t)
             rat = np.array([ran, sn3[t]])
             rat = np.dot(self.leverage, rat)
+            rt = (forward_rates[t - 1] + forward_rates[t]) / 2
+
+            if self.scheme == 'qe':
+                poi = self.get_random_state().poisson(self.lamb * dt, I)
+                va[t], increment = self.qe_step(va[t - 1], dt, rat, sn3[t])
+                paths[t] = paths[t - 1] * (np.exp((rt - rj) * dt + increment)
+                                    + (np.exp(self.mu + self.delt *
+                                        sn2[t]) - 1) * poi)
+                continue
 
             va_[t] = (va_[t - 1] + self.kappa
                          * (self.theta - np.maximum(0, va_[t - 1])) * dt
@@ -534,9 +912,8 @@ class stoch_vol_jump_diffusion(simulation_class):
                          * self.vol_vol * np.sqrt(dt) * rat[1])
             va[t] = np.maximum(0, va_[t])
 
-            poi = np.random.poisson(self.lamb * dt, I)
+            poi = self.get_random_state().poisson(self.lamb * dt, I)
 
-            rt = (forward_rates[t - 1] + forward_rates[t]) / 2
             paths[t] = paths[t - 1] * (np.exp((rt - rj - 0.5 * va[t]) * dt
                                     + np.sqrt(va[t]) * np.sqrt(dt) * rat[0])
                                     + (np.exp(self.mu + self.delt *
@@ -549,6 +926,16 @@ class stoch_vol_jump_diffusion(simulation_class):
         self.instrument_values = paths
         self.volatility_values = np.sqrt(va)
 
+    def qe_step(self, v, dt, rat, sn):
+        ''' Andersen QE step (see heston_qe_step) for the correlated
+        normals rat = (price shock, variance shock); sn are the
+        uncorrelated normals behind the variance shock.
+        '''
+        # price shock without its projection on the variance shock
+        z = self.leverage[1, 1] * rat[0] - self.leverage[1, 0] * sn
+        return heston_qe_step(v, dt, self.kappa, self.theta, self.vol_vol,
+                              self.rho, rat[1], z)
+
     def get_volatility_values(self):
         if self.volatility_values is None:
             self.generate_paths(self)
@@ -574,6 +961,8 @@ class square_root_diffusion(simulation_class):
         updates parameters
     generate_paths :
         returns Monte Carlo paths given the market environment
+    exact_step :
+        samples the exact transition over one time interval
     '''
 
     def __init__(self, name, mar_env, corr=False):
@@ -584,6 +973,26 @@ class square_root_diffusion(simulation_class):
         except:
             print "Error parsing market environment."
 
+    def exact_step(self, x, dt, ran):
+        ''' Samples the value after dt given the values x from the
+        noncentral chi-square transition density. With d > 1 degrees of
+        freedom a noncentral chi-square variable equals
+        (Z + sqrt(nc)) ** 2 + chi-square(d - 1), such that the (possibly
+        correlated or quasi-random) standard normals ran drive the step;
+        otherwise the Poisson mixture of central chi-squares is used.
+        '''
+        ekt = np.exp(-self.kappa * dt)
+        c = self.volatility ** 2 * (1 - ekt) / (4 * self.kappa)
+        df = 4 * self.kappa * self.theta / self.volatility ** 2
+        nc = x * ekt / c
+        random_state = self.get_random_state()
+        if df > 1:
+            chi = ((ran + np.sqrt(nc)) ** 2
+                   + random_state.chisquare(df - 1, size=x.shape))
+        else:
+            chi = random_state.chisquare(df + 2 * random_state.poisson(nc / 2))
+        return c * chi
+
     def update(self, pricing_date=None, initial_value=None, volatility=None,        kappa=None, theta=None, final_date=None):
         if pricing_date is not None:
             self.pricing_date = pricing_date
@@ -611,19 +1020,22 @@ class square_root_diffusion(simulation_class):
         paths[0] = self.initial_value
         paths_[0] = self.initial_value
         if self.correlated is False:
-            rand = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            rand = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             rand = self.random_numbers
 
+        delta_t = self.get_time_deltas(day_count)
+
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             if self.correlated is False:
                 ran = rand[t]
             else:
-                ran = np.dot(self.cholesky_matrix, rand[:, t, :])
-                ran = ran[self.rn_set]
+                ran = self.get_correlated_random_numbers(rand, t)
 
+            if self.scheme == 'exact':
+                paths[t] = self.exact_step(paths[t - 1], dt, ran)
+                continue
             # full truncation Euler discretization
             paths_[t] = (paths_[t - 1] + self.kappa
                          * (self.theta - np.maximum(0, paths_[t - 1])) * dt
@@ -650,9 +1062,16 @@ class stochastic_short_rate(object):
         return forward rates given a time list/array
     get_discount_factors :
         return discount factors given a time list/array
+        (cached per time list for the current short rate paths only)
+
+    The short rate paths follow the 'scheme' of the market environment
+    ('euler' or 'exact', see square_root_diffusion).
     '''
     def __init__(self, name, mar_env):
         self.name = name
+        self.discount_factors = {}
+        # short rate paths the cached discount factors belong to
+        self.cached_rates = None
         try:
             try:
                 mar_env.get_curve('discount_curve')
@@ -671,25 +1090,42 @@ class stochastic_short_rate(object):
         if len(self.process.time_grid) != len(time_list) \
                 or self.process.paths != paths:
             self.process.paths = paths
-            self.process.time_grid = time_list
+            self.process.time_grid = get_dates(time_list)
+            if isinstance(time_list, date_grid):
+                self.process.grid = time_list
             self.process.instrument_values = None
         rates = self.process.get_instrument_values()
         return time_list, rates
 
     def get_discount_factors(self, time_list, paths, dtobjects=True):
-        discount_factors = []
-        if dtobjects is True:
-            dlist = get_year_deltas(time_list)
-        else:
-            dlist = time_list
         forward_rate = self.get_forward_rates(time_list, paths, dtobjects)[1]
-        for no in range(len(dlist)):
-            factor = np.zeros_like(forward_rate[0, :])
-            for d in range(no, len(dlist) - 1):
-                factor += ((dlist[d + 1] - dlist[d])
-                        * (0.5 * (forward_rate[d + 1] + forward_rate[d])))
-            discount_factors.append(np.exp(-factor))
-        return time_list, np.array(discount_factors)
+        if forward_rate is not self.cached_rates:
+            # short rates re-simulated: factors of old paths are stale
+            self.discount_factors = {}
+            self.cached_rates = forward_rate
+        if isinstance(time_list, date_grid):
+            grid_key = time_list.key
+        else:
+            grid_key = tuple(time_list)
+        key = (grid_key, dtobjects)
+        if key not in self.discount_factors:
+            if dtobjects is True:
+                dlist = get_year_deltas(time_list)
+            else:
+                dlist = np.array(time_list)
+            if len(self.discount_factors) >= 8:
+                # bounded cache
+                self.discount_factors.clear()
+            # trapezoidal integral of the short rate per time interval
+            integral = (np.diff(dlist)[:, np.newaxis] * 0.5
+                        * (forward_rate[1:] + forward_rate[:-1]))
+            # reverse cumulative sum: integral from each date to the end
+            factors = np.zeros_like(forward_rate)
+            factors[:-1] = np.cumsum(integral[::-1], axis=0)[::-1]
+            discount_factors = np.exp(-factors)
+            discount_factors.flags.writeable = False
+            self.discount_factors[key] = discount_factors
+        return time_list, self.discount_factors[key]
 
 def srd_forwards(initial_value, (kappa, theta, sigma), time_grid):
     ''' Function for forward vols/rates in SRD model.
@@ -741,12 +1177,22 @@ class mean_reverting_diffusion(square_root_diffusion):
         updates parameters
     generate_paths :
         returns Monte Carlo paths given the market environment
+    exact_step :
+        samples the exact transition over one time interval
     '''
     def __init__(self, name, mar_env, corr=False, truncation=False):
         super(mean_reverting_diffusion,
                self).__init__(name, mar_env, corr)
         self.truncation = truncation
 
+    def exact_step(self, x, dt, ran):
+        ''' Samples the value after dt given the values x from the
+        Gaussian transition density of the Ornstein-Uhlenbeck process.
+        '''
+        ekt = np.exp(-self.kappa * dt)
+        std = self.volatility * np.sqrt((1 - ekt ** 2) / (2 * self.kappa))
+        return self.theta + (x - self.theta) * ekt + std * ran
+
     def generate_paths(self, fixed_seed=True, day_count=365.):
         if self.time_grid is None:
             self.generate_time_grid()
@@ -757,19 +1203,28 @@ class mean_reverting_diffusion(square_root_diffusion):
         paths[0] = self.initial_value
         paths_[0] = self.initial_value
         if self.correlated is False:
-            rand = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            rand = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             rand = self.random_numbers
 
+        delta_t = self.get_time_deltas(day_count)
+
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             if self.correlated is False:
                 ran = rand[t]
             else:
-                ran = np.dot(self.cholesky_matrix, rand[:, t, :])
-                ran = ran[self.rn_set]
-
+                ran = self.get_correlated_random_numbers(rand, t)
+
+            if self.scheme == 'exact':
+                # exact transition of the untruncated process,
+                # truncation (if any) only applied to the output
+                paths_[t] = self.exact_step(paths_[t - 1], dt, ran)
+                if self.truncation is True:
+                    paths[t] = np.maximum(0, paths_[t])
+                else:
+                    paths[t] = paths_[t]
+                continue
             # full truncation Euler discretization
             if self.truncation is True:
                 paths_[t] = (paths_[t - 1] + self.kappa
@@ -850,22 +1305,21 @@ class square_root_jump_diffusion(simulation_class):
         paths[0] = self.initial_value
         paths_[0] = self.initial_value
         if self.correlated is False:
-            rand = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            rand = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             rand = self.random_numbers
-        snr = sn_random_numbers((1, M, I),
-                                 fixed_seed=fixed_seed)
+        snr = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=1)
         rj = self.lamb * (np.exp(self.mu + 0.5 * self.delt ** 2) - 1)
 
+        delta_t = self.get_time_deltas(day_count)
+
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             if self.correlated is False:
                 ran = rand[t]
             else:
-                ran = np.dot(self.cholesky_matrix, rand[:, t, :])
-                ran = ran[self.rn_set]
-            poi = np.random.poisson(self.lamb * dt, I)
+                ran = self.get_correlated_random_numbers(rand, t)
+            poi = self.get_random_state().poisson(self.lamb * dt, I)
             # full truncation Euler discretization
             paths_[t, :] = (paths_[t - 1, :] + self.kappa
                          * (self.theta - np.maximum(0, paths_[t - 1, :])) * dt
@@ -942,7 +1396,7 @@ class square_root_jump_diffusion_plus(square_root_jump_diffusion):
             t = get_year_deltas(self.shift_base[:, 0])
             tck = sci.splrep(t, self.shift_base[:, 1], k=k)
             self.generate_time_grid()
-            st = get_year_deltas(self.time_grid)
+            st = get_year_deltas(self.get_grid())
             self.shift_values = np.array(zip(self.time_grid,
                                          sci.splev(st, tck, der=0)))
         else:
@@ -960,23 +1414,21 @@ class square_root_jump_diffusion_plus(square_root_jump_diffusion):
         paths[0] = self.initial_value
         paths_[0] = self.initial_value
         if self.correlated is False:
-            rand = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            rand = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             rand = self.random_numbers
-        snr = sn_random_numbers((1, M, I),
-                                fixed_seed=fixed_seed)
+        snr = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=1)
         forward_rates = self.discount_curve.get_forward_rates(
-                        self.time_grid, dtobjects=True)
+                        self.get_grid(), dtobjects=True)
         rj = self.lamb * (np.exp(self.mu + 0.5 * self.delt ** 2) - 1)
+        delta_t = self.get_time_deltas(day_count)
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             if self.correlated is False:
                 ran = rand[t]
             else:
-                ran = np.dot(self.cholesky_matrix, rand[:, t, :])
-                ran = ran[self.rn_set]
-            poi = np.random.poisson(self.lamb * dt, I)
+                ran = self.get_correlated_random_numbers(rand, t)
+            poi = self.get_random_state().poisson(self.lamb * dt, I)
             # full truncation Euler discretization
             paths_[t] = (paths_[t - 1] + self.kappa
                          * (self.theta - np.maximum(0, paths_[t - 1])) * dt
@@ -1068,40 +1520,13 @@ class sabr_stochastic_volatility(simulation_class):
         self.volatility_values = None
 
     def get_log_normal_implied_vol(self, strike, expiry):
-        ''' Returns the implied volatility for fixed strike and expiry.
+        ''' Returns the implied volatility for fixed strike and expiry
+        (strike and expiry may also be arrays).
         '''
         self.check_parameter_set()
-        one_beta = 1. - self.beta
-        one_beta_square = one_beta ** 2
-        if self.initial_value != strike:
-            fk =  self.initial_value * strike
-            fk_beta = fk ** (one_beta / 2.)
-            log_fk = math.log(self.initial_value / strike)
-            z = self.vol_vol / self.alpha * fk_beta * log_fk
-            x = math.log((math.sqrt(1. - 2 * self.rho *z + z ** 2) + z - self.rho)
-                          / (1 - self.rho) )
-
-            sigma_1 = (self.alpha / fk_beta / (1 +
-                                    (one_beta_square * log_fk ** 2 / 24) +
-                                    (one_beta_square ** 2 *log_fk ** 4 / 1920.))
-                                     * z / x )
-
-            sigma_ex = (one_beta_square / 24. * self.alpha ** 2 / fk_beta ** 2 +
-                                    0.25 * self.rho * self.beta * self.vol_vol *
-                                    self.alpha / fk_beta +
-                                    (2. - 3. * self.rho ** 2) /
-                                    24. * self.vol_vol ** 2)
-
-            sigma = sigma_1 * (1. + sigma_ex * expiry)
-        else:
-            f_beta = self.initial_value ** one_beta
-            f_two_beta = self.initial_value ** (2. -2 * self.beta)
-            sigma = (self.alpha / f_beta) * ( 1 +
-                            expiry * ((one_beta_square / 24. * self.alpha ** 2
-                            / f_two_beta) + (0.25 * self.rho * self.beta *
-                            self.vol_vol * self.alpha / f_beta) +
-                            ((2. - 3 * self.rho ** 2) / 24. * self.vol_vol ** 2)))
-        return sigma
+        return haganLogNormalApproxVec(strike, expiry, self.initial_value,
+                                       self.alpha, self.beta, self.vol_vol,
+                                       self.rho)
 
     def calibrate_to_impl_vol(self, implied_vols, maturity, para = list()):
         ''' Calibrates the parameters alpha, beta, initial_value and vol_vol
@@ -1109,15 +1534,15 @@ class sabr_stochastic_volatility(simulation_class):
         '''
         if len(para) != 4:
             para = (self.alpha, self.beta, self.initial_value, self.vol_vol)
+        strikes = np.array(implied_vols.columns, dtype=float)
+        market_vols = np.array(implied_vols, dtype=float).ravel() / 100.
         def error_function(para):
             self.alpha, self.beta, self.initial_value, self.vol_vol = para
             if (self.beta < 0 or self.beta > 1 or self.initial_value <= 0 or
                  self.vol_vol <= 0):
                 return 10000
-            e = 0
-            for strike in implied_vols.columns:
-                e += (self.get_log_normal_implied_vol(float(strike), maturity)
-                      - float(implied_vols[strike]) / 100.) ** 2
+            e = np.sum((self.get_log_normal_implied_vol(strikes, maturity)
+                        - market_vols) ** 2)
             return e
         para = fmin(error_function, para, xtol=0.0000001,
                    ftol=0.0000001, maxiter=550, maxfun=850)
@@ -1149,22 +1574,22 @@ class sabr_stochastic_volatility(simulation_class):
         va[0] = self.alpha
         va_[0] = self.alpha
         if self.correlated is False:
-            sn1 = sn_random_numbers((1, M, I),
-                                     fixed_seed=fixed_seed)
+            sn1 = self.get_random_numbers(M, I, fixed_seed=fixed_seed)
         else:
             sn1 = self.random_numbers
 
         # pseudo-random numbers for the stochastic volatility
-        sn2 = sn_random_numbers((1, M, I), fixed_seed=fixed_seed)
+        sn2 = self.get_random_numbers(M, I, fixed_seed=fixed_seed, stream=1)
+
+        delta_t = self.get_time_deltas(day_count)
 
         for t in range(1, len(self.time_grid)):
-            dt = (self.time_grid[t] - self.time_grid[t - 1]).days / day_count
+            dt = delta_t[t - 1]
             square_root_dt = np.sqrt(dt)
             if self.correlated is False:
                 ran = sn1[t]
             else:
-                ran = np.dot(self.cholesky_matrix, sn1[:, t, :])
-                ran = ran[self.rn_set]
+                ran = self.get_correlated_random_numbers(sn1, t)
             rat = np.array([ran, sn2[t]])
             rat = np.dot(self.leverage, rat)
 
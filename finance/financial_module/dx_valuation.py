@@ -24,7 +24,187 @@
 #
 
 from dx_models import *
-import statsmodels.api as sm
+from dx_fourier import BSM_european_option
+
+
+# models whose discounted values are martingales (control variates)
+martingale_models = (geometric_brownian_motion, jump_diffusion,
+                     stochastic_volatility, stoch_vol_jump_diffusion)
+
+
+# Compiled payoff functions
+
+# payoff names referring to the whole path (not the maturity value only)
+path_names = set(['paths', 'instrument_values', 'time_grid', 'time_index',
+                  'mean_value', 'max_value', 'min_value'])
+
+class payoff_function(object):
+    ''' Payoff string in Python syntax compiled to a code object.
+
+    Attributes
+    ==========
+    payoff_func : string
+        derivatives payoff in Python syntax
+    names : set
+        names referenced by the payoff (e.g. 'maturity_value', 'mean_value')
+
+    Methods
+    =======
+    requires :
+        checks if the payoff references a name (e.g. a path statistic)
+    evaluate :
+        evaluates the payoff given a namespace
+
+    Code objects cannot be pickled; only the payoff string is pickled
+    and compiled again when unpickled (e.g. in pool workers).
+    '''
+
+    def __init__(self, payoff_func):
+        self.payoff_func = payoff_func
+        self.code = compile(payoff_func, '<payoff>', 'eval')
+        self.names = set(self.code.co_names)
+
+    def __getstate__(self):
+        return {'payoff_func': self.payoff_func}
+
+    def __setstate__(self, state):
+        self.__init__(state['payoff_func'])
+
+    def requires(self, name):
+        return name in self.names
+
+    def evaluate(self, namespace):
+        return eval(self.code, globals(), namespace)
+
+compiled_payoffs = {}
+
+
+def compile_payoff(payoff_func):
+    ''' Returns the (cached) payoff_function object for a payoff string. '''
+    if payoff_func not in compiled_payoffs:
+        compiled_payoffs[payoff_func] = payoff_function(payoff_func)
+    return compiled_payoffs[payoff_func]
+
+
+# Least-squares regression for the Longstaff-Schwartz algorithm
+
+class lsm_regression(object):
+    ''' Regression of continuation values on basis functions of the
+    instrument values for the Longstaff-Schwartz (2001) algorithm. Only
+    in-the-money paths enter the regression; the design matrix is built
+    into a preallocated buffer which is reused over all time steps.
+
+    Attributes
+    ==========
+    basis : string
+        basis family: 'monomial', 'laguerre' or 'hermite'
+    degree : int
+        highest degree of the basis functions per risk factor
+    cross_terms : boolean
+        add pairwise products of the risk factors (multi risk factor case)
+
+    Methods
+    =======
+    get_number_of_functions :
+        returns the number of basis functions (columns of design matrix)
+    design_matrix :
+        fills the design matrix for (normalized) instrument values
+    continuation_values :
+        returns the regressed continuation values for all paths
+    '''
+
+    def __init__(self, basis='monomial', degree=5, cross_terms=True):
+        if basis not in ('monomial', 'laguerre', 'hermite'):
+            raise ValueError('Unknown basis %s.' % basis)
+        self.basis = basis
+        self.degree = degree
+        self.cross_terms = cross_terms
+        self.buffer = None
+
+    def get_number_of_functions(self, d):
+        k = 1 + d * self.degree
+        if self.cross_terms is True:
+            k += d * (d - 1) // 2
+        return k
+
+    def normalize(self, X, itm):
+        ''' Scales the regressors (based on the in-the-money paths)
+        to keep the regression well conditioned. '''
+        if self.basis == 'hermite':
+            mean = np.mean(X[itm], axis=0)
+            std = np.std(X[itm], axis=0)
+            std[std == 0] = 1.0
+            return (X - mean) / std
+        scale = np.mean(np.abs(X[itm]), axis=0)
+        scale[scale == 0] = 1.0
+        return X / scale
+
+    def design_matrix(self, X):
+        n, d = X.shape
+        k = self.get_number_of_functions(d)
+        if self.buffer is None or self.buffer.shape != (n, k):
+            self.buffer = np.empty((n, k))
+        A = self.buffer
+        A[:, 0] = 1.0
+        col = 1
+        for j in range(d):
+            x = X[:, j]
+            if self.basis == 'monomial':
+                A[:, col] = x
+                for p in range(1, self.degree):
+                    A[:, col + p] = A[:, col + p - 1] * x
+            elif self.basis == 'hermite':
+                # probabilists' Hermite polynomials by recursion
+                A[:, col] = x
+                previous = A[:, 0]
+                for p in range(1, self.degree):
+                    A[:, col + p] = (x * A[:, col + p - 1] - p * previous)
+                    previous = A[:, col + p - 1]
+            else:
+                # weighted Laguerre polynomials exp(-x/2) L_p(x)
+                weight = np.exp(-x / 2)
+                previous = np.ones(n)
+                current = 1 - x
+                A[:, col] = weight * current
+                for p in range(1, self.degree):
+                    previous, current = current, (((2 * p + 1 - x) * current
+                                                 - p * previous) / (p + 1))
+                    A[:, col + p] = weight * current
+            col += self.degree
+        if self.cross_terms is True:
+            for i in range(d):
+                for j in range(i + 1, d):
+                    A[:, col] = X[:, i] * X[:, j]
+                    col += 1
+        return A
+
+    def continuation_values(self, X, y, itm):
+        ''' Returns the continuation values for all paths regressed on
+        the in-the-money paths only; None if there are too few of them.
+
+        Parameters
+        ==========
+        X : (I, d) array
+            instrument values of the d risk factors
+        y : (I,) array
+            discounted values of the following time step
+        itm : (I,) boolean array
+            in-the-money paths
+        '''
+        if X.ndim == 1:
+            X = X[:, np.newaxis]
+        k = self.get_number_of_functions(X.shape[1])
+        if np.sum(itm) <= k:
+            return None
+        A = self.design_matrix(self.normalize(X, itm))
+        A_itm = A[itm]
+        # normal equations (k x k); least squares (QR/SVD) if singular
+        try:
+            rg = np.linalg.solve(np.dot(A_itm.T, A_itm),
+                                 np.dot(A_itm.T, y[itm]))
+        except np.linalg.LinAlgError:
+            rg = np.linalg.lstsq(A_itm, y[itm], rcond=-1)[0]
+        return np.dot(A, rg)
 
 
 # Classes for single risk factor instrument valuation
@@ -63,6 +243,13 @@ class valuation_class_single(object):
         returns the theta of the derivative
     rho :
         returns the rho of the derivative
+    greeks :
+        returns dictionary of Greeks estimated from a single simulation
+        (theta re-simulated)
+    pathwise_samples :
+        returns pathwise delta/vega samples (maturity value payoffs)
+    get_payoff :
+        returns the compiled payoff function
     '''
 
     def __init__(self, name, underlying, mar_env, payoff_func=''):
@@ -87,6 +274,28 @@ class valuation_class_single(object):
                                                   self.maturity])
         except:
             print "Error parsing market environment."
+        self.payoff = None
+        try:
+            # payoff string parsed once
+            self.payoff = compile_payoff(payoff_func)
+        except:
+            print "Error compiling payoff function."
+
+    def get_payoff(self):
+        ''' Returns the payoff compiled in __init__; compiles again only
+        if payoff_func was changed after construction. '''
+        if self.payoff is None or \
+                self.payoff.payoff_func != self.payoff_func:
+            self.payoff = compile_payoff(self.payoff_func)
+        return self.payoff
+
+    def get_maturity_discount_factor(self, paths):
+        ''' Returns the discount factor from the maturity date (not the
+        last date of the time grid) to the start of the time grid. '''
+        time_index = self.underlying.get_time_index(self.maturity)
+        return self.discount_curve.get_discount_factors(
+            self.underlying.get_grid().get_sub_grid(0, time_index + 1),
+            paths.shape[1])[1][0]
 
     def update(self, initial_value=None, volatility=None,
                strike=None, maturity=None):
@@ -100,7 +309,7 @@ class valuation_class_single(object):
         if maturity is not None:
             self.maturity = maturity
             # add new maturity date if not in time_grid
-            if not maturity in self.underlying.time_grid:
+            if maturity not in self.underlying.get_grid().index:
                 self.underlying.special_dates.append(maturity)
                 self.underlying.instrument_values = None
 
@@ -212,6 +421,198 @@ class valuation_class_single(object):
                     * self.underlying_objects[key].initial_value ** 2)
         return round(dollar_gamma, accuracy)
 
+    def value_paths(self, paths, full=False):
+        ''' Returns the present value for given instrument values of the
+        underlying (no simulation). '''
+        stored_values = self.underlying.instrument_values
+        block_size = getattr(self.underlying, 'block_size', None)
+        self.underlying.instrument_values = paths
+        self.underlying.block_size = None
+        try:
+            return self.present_value(fixed_seed=True, accuracy=12, full=full)
+        finally:
+            self.underlying.instrument_values = stored_values
+            self.underlying.block_size = block_size
+
+    def bumped_value(self, **kwargs):
+        ''' Returns the present value after updating the underlying with
+        kwargs; re-simulates with the fixed seed (common random numbers)
+        and resets the underlying afterwards. '''
+        stored_values = self.underlying.get_instrument_values(fixed_seed=True)
+        orig = {}
+        for key in kwargs:
+            orig[key] = getattr(self.underlying, key)
+        self.underlying.update(**kwargs)
+        value = self.present_value(fixed_seed=True, accuracy=12)
+        self.underlying.update(**orig)
+        self.underlying.instrument_values = stored_values
+        return value
+
+    def likelihood_ratio_weights(self):
+        ''' Returns the likelihood ratio weights for delta, gamma and vega
+        (geometric Brownian motion with deterministic rates; valid for
+        payoffs depending on the maturity value only). '''
+        if not isinstance(self.underlying, geometric_brownian_motion):
+            raise NotImplementedError(
+                'Likelihood ratio only implemented for geometric '
+                'Brownian motion.')
+        if self.get_payoff().names & path_names:
+            raise ValueError('Likelihood ratio Greeks require a payoff '
+                             'depending on the maturity value only.')
+        brownian_values = self.underlying.get_brownian_values()
+        if brownian_values is None:
+            raise NotImplementedError(
+                'Likelihood ratio not implemented for stochastic rates.')
+        t, R, W = brownian_values
+        time_index = self.underlying.get_time_index(self.maturity)
+        T = t[time_index, 0]
+        Z = W[time_index] / math.sqrt(T)
+        S0 = self.underlying.initial_value
+        sigma = self.underlying.volatility
+        weights = {'delta': Z / (S0 * sigma * math.sqrt(T)),
+                   'gamma': ((Z ** 2 - 1) / (S0 ** 2 * sigma ** 2 * T)
+                             - Z / (S0 ** 2 * sigma * math.sqrt(T))),
+                   'vega': (Z ** 2 - 1) / sigma - Z * math.sqrt(T)}
+        return weights
+
+    def pathwise_samples(self, paths):
+        ''' Returns a dictionary with the pathwise derivative samples
+        df * dpayoff/dS_T * dS_T/dx for payoffs depending on the maturity
+        value S_T only: 'delta' with dS_T/dS_0 = S_T / S_0 (models
+        proportional to the initial value) and, for geometric Brownian
+        motion with deterministic rates, 'vega' with
+        dS_T/dsigma = S_T (W_T - sigma T). dpayoff/dS_T is evaluated per
+        path by a central difference with relative step 1e-6 (exact for
+        piecewise linear payoffs away from the kinks).
+        '''
+        payoff = self.get_payoff()
+        if payoff.names & path_names:
+            raise ValueError('Pathwise Greeks require a payoff depending '
+                             'on the maturity value only.')
+        if self.underlying.scale_invariant is False:
+            raise ValueError('Pathwise delta requires a model proportional '
+                             'to the initial value.')
+        time_index = self.underlying.get_time_index(self.maturity)
+        maturity_value = paths[time_index]
+        discount_factor = self.get_maturity_discount_factor(paths)
+        namespace = {}
+        if hasattr(self, 'strike'):
+            namespace['strike'] = self.strike
+        h = 1e-6 * maturity_value
+        namespace['maturity_value'] = maturity_value + h
+        payoff_up = payoff.evaluate(namespace)
+        namespace['maturity_value'] = maturity_value - h
+        payoff_down = payoff.evaluate(namespace)
+        dpayoff = discount_factor * (payoff_up - payoff_down) / (2 * h)
+        samples = {'delta': dpayoff * maturity_value
+                            / self.underlying.initial_value}
+        if isinstance(self.underlying, geometric_brownian_motion):
+            brownian_values = self.underlying.get_brownian_values()
+            if brownian_values is not None:
+                t, R, W = brownian_values
+                T = t[time_index, 0]
+                samples['vega'] = (dpayoff * maturity_value
+                                   * (W[time_index]
+                                      - self.underlying.volatility * T))
+        return samples
+
+    def greeks(self, greeks=('delta', 'gamma', 'vega', 'theta', 'rho'),
+               method=None, accuracy=4):
+        ''' Returns a dictionary with the requested Greeks estimated
+        from one simulation of the underlying; theta always re-simulates
+        with a shifted pricing date (see theta).
+
+        Parameters
+        ==========
+        greeks : list/tuple
+            Greeks to estimate ('delta', 'gamma', 'vega', 'theta', 'rho')
+        method : string
+            'pathwise': pathwise derivative estimators for delta and
+                (GBM) vega, payoffs depending on the maturity value only;
+                the other Greeks as for 'crn_rescaled';
+            'crn_rescaled': central differences on bumped paths rebuilt
+                from the stored paths (common random numbers; GBM, jump
+                and Heston-type models);
+            'likelihood_ratio': score function weights for delta, gamma and
+                vega (GBM; e.g. for discontinuous payoffs);
+            'finite_difference': central differences with common random
+                numbers (re-simulation with fixed seed);
+            default: 'crn_rescaled' where the model allows it,
+            'finite_difference' otherwise
+        accuracy : int
+            number of decimals in returned results
+        '''
+        underlying = self.underlying
+        if method is None:
+            if underlying.scale_invariant is True:
+                method = 'crn_rescaled'
+            else:
+                method = 'finite_difference'
+        # bumped paths rebuilt from the stored paths
+        rescaled = method in ('crn_rescaled', 'pathwise')
+        paths = underlying.get_instrument_values(fixed_seed=True)
+        value, present_values = self.value_paths(paths, full=True)
+        if method == 'likelihood_ratio':
+            weights = self.likelihood_ratio_weights()
+        if method == 'pathwise':
+            samples = self.pathwise_samples(paths)
+        S0 = underlying.initial_value
+        sigma = underlying.volatility
+        h = S0 / 50.
+        v = max(0.01, sigma / 50.)
+        results = {}
+        for greek in greeks:
+            if method == 'likelihood_ratio' and greek in weights:
+                results[greek] = np.mean(present_values * weights[greek])
+            elif method == 'pathwise' and greek in samples:
+                results[greek] = np.mean(samples[greek])
+            elif greek in ('delta', 'gamma'):
+                if 'delta' in results and 'gamma' in results:
+                    continue
+                paths_up = underlying.get_bumped_values(initial_value=S0 + h)
+                if rescaled and paths_up is not None:
+                    value_up = self.value_paths(paths_up)
+                    value_down = self.value_paths(
+                        underlying.get_bumped_values(initial_value=S0 - h))
+                else:
+                    value_up = self.bumped_value(initial_value=S0 + h)
+                    value_down = self.bumped_value(initial_value=S0 - h)
+                if 'delta' not in results:
+                    results['delta'] = (value_up - value_down) / (2 * h)
+                results['gamma'] = (value_up - 2 * value
+                                    + value_down) / h ** 2
+            elif greek == 'vega':
+                paths_up = underlying.get_bumped_values(volatility=sigma + v)
+                if rescaled and paths_up is not None:
+                    value_up = self.value_paths(paths_up)
+                    value_down = self.value_paths(
+                        underlying.get_bumped_values(volatility=sigma - v))
+                else:
+                    value_up = self.bumped_value(volatility=sigma + v)
+                    value_down = self.bumped_value(volatility=sigma - v)
+                results['vega'] = (value_up - value_down) / (2 * v)
+            elif greek == 'theta':
+                # re-simulation (pricing date shifted)
+                results['theta'] = self.theta(accuracy=12)
+            elif greek == 'rho':
+                d = 0.005
+                paths_up = underlying.get_bumped_values(short_rate_shift=d)
+                if (rescaled and paths_up is not None and
+                        type(self.discount_curve) == constant_short_rate):
+                    paths_down = underlying.get_bumped_values(
+                                                short_rate_shift=-d)
+                    self.discount_curve.short_rate += d
+                    value_up = self.value_paths(paths_up)
+                    self.discount_curve.short_rate -= 2 * d
+                    value_down = self.value_paths(paths_down)
+                    self.discount_curve.short_rate += d
+                    results['rho'] = (value_up - value_down) / (2 * d)
+                else:
+                    results['rho'] = self.rho(accuracy=12)
+            else:
+                raise ValueError('Unknown Greek %s.' % greek)
+        return {greek: round(results[greek], accuracy) for greek in greeks}
+
 
 class valuation_mcs_european_single(valuation_class_single):
     ''' Class to value European options with arbitrary payoff
@@ -223,41 +624,60 @@ class valuation_mcs_european_single(valuation_class_single):
         returns payoffs given the paths and the payoff function
     present_value :
         returns present value (Monte Carlo estimator)
+    present_value_blocks :
+        returns present value accumulated over blocks of paths
+    get_maturity_discount_factor :
+        returns the discount factor from maturity to the grid start
+    control_variate_values :
+        returns present values adjusted by control variates
+    importance_sampling_values :
+        returns likelihood ratio weighted present values for
+        drift-shifted paths
     '''
 
-    def generate_payoff(self, fixed_seed=False):
+    def generate_payoff(self, fixed_seed=False, paths=None):
         '''
         Attributes
         ==========
         fixed_seed : boolean
             used same/fixed seed for valued
+        paths : array
+            instrument values to use (e.g. a block of paths);
+            taken from the underlying if None
         '''
         try:
             # strike defined?
             strike = self.strike
         except:
             pass
-        paths = self.underlying.get_instrument_values(fixed_seed=fixed_seed)
+        if paths is None:
+            paths = self.underlying.get_instrument_values(
+                                    fixed_seed=fixed_seed)
         time_grid = self.underlying.time_grid
         try:
-            time_index = np.where(time_grid == self.maturity)[0]
-            time_index = int(time_index)
+            time_index = self.underlying.get_time_index(self.maturity)
         except:
             print "Maturity date not in time grid of underlying."
         maturity_value = paths[time_index]
-        # average value over whole path
-        mean_value = np.mean(paths[:time_index], axis=1)
-        # maximum value over whole path
-        max_value = np.amax(paths[:time_index], axis=1)[-1]
-        # minimum value over whole path
-        min_value = np.amin(paths[:time_index], axis=1)[-1]
         try:
-            payoff = eval(self.payoff_func)
+            payoff_func = self.get_payoff()
+            # path statistics only if referenced by the payoff
+            if payoff_func.requires('mean_value'):
+                # average value over whole path
+                mean_value = np.mean(paths[:time_index], axis=1)
+            if payoff_func.requires('max_value'):
+                # maximum value over whole path
+                max_value = np.amax(paths[:time_index], axis=1)[-1]
+            if payoff_func.requires('min_value'):
+                # minimum value over whole path
+                min_value = np.amin(paths[:time_index], axis=1)[-1]
+            payoff = payoff_func.evaluate(locals())
             return payoff
         except:
             print "Error evaluating payoff function."
 
-    def present_value(self, accuracy=6, fixed_seed=False, full=False):
+    def present_value(self, accuracy=6, fixed_seed=False, full=False,
+                      block_size=None, estimator='plain'):
         '''
         Attributes
         ==========
@@ -265,11 +685,48 @@ class valuation_mcs_european_single(valuation_class_single):
             number of decimals in returned result
         fixed_seed :
             used same/fixed seed for valuation
+        block_size : int
+            number of paths per block for streaming valuation;
+            defaults to the block_size of the underlying (if any)
+        estimator : string
+            'plain': sample mean of the discounted payoffs (default);
+            'control_variate': regression adjusted by the discounted
+                maturity value (martingale models, deterministic rates)
+                and, for geometric Brownian motion with constant short
+                rate, the BSM call at the strike;
+            'importance_sampling': Brownian drift shifted towards the
+                strike, weighted by the likelihood ratio (geometric
+                Brownian motion with deterministic rates);
+            the variance reduction factor against the plain estimator on
+            the same paths is stored in self.variance_reduction
+            (the variance reduced estimators work on all paths at once)
         '''
+        if estimator != 'plain':
+            paths = self.underlying.get_instrument_values(
+                                    fixed_seed=fixed_seed)
+            if estimator == 'control_variate':
+                present_values = self.control_variate_values(paths)
+            elif estimator == 'importance_sampling':
+                present_values = self.importance_sampling_values(paths)
+            else:
+                raise ValueError('Unknown estimator %s.' % estimator)
+            result = np.mean(present_values)
+            if full:
+                return round(result, accuracy), present_values
+            else:
+                return round(result, accuracy)
+
+        self.variance_reduction = 1.0
+        if block_size is None:
+            block_size = getattr(self.underlying, 'block_size', None)
+        if block_size is not None and block_size < self.paths:
+            return self.present_value_blocks(block_size, accuracy=accuracy,
+                                             fixed_seed=fixed_seed, full=full)
+
         cash_flow = self.generate_payoff(fixed_seed=fixed_seed)
 
         discount_factor = self.discount_curve.get_discount_factors(
-            self.underlying.time_grid, self.paths)[1][0]
+            self.underlying.get_grid(), self.paths)[1][0]
 
         result = np.sum(discount_factor * cash_flow) / len(cash_flow)
 
@@ -278,6 +735,133 @@ class valuation_mcs_european_single(valuation_class_single):
         else:
             return round(result, accuracy)
 
+    def present_value_blocks(self, block_size, accuracy=6, fixed_seed=False,
+                             full=False):
+        ''' Present value with the Monte Carlo estimator accumulated
+        block by block; peak memory is O(M * block_size) instead of O(M * I).
+
+        Attributes
+        ==========
+        block_size : int
+            number of paths per block
+        accuracy : int
+            number of decimals in returned result
+        fixed_seed :
+            used same/fixed seed for valuation
+        '''
+        total = 0.0
+        n = 0
+        present_values = []
+        for paths in self.underlying.get_instrument_value_blocks(
+                                block_size, fixed_seed=fixed_seed):
+            cash_flow = self.generate_payoff(paths=paths)
+            discount_factor = self.discount_curve.get_discount_factors(
+                self.underlying.get_grid(), paths.shape[1])[1][0]
+            pv = discount_factor * cash_flow
+            total += np.sum(pv)
+            n += len(cash_flow)
+            if full:
+                present_values.append(pv)
+        result = total / n
+        if full:
+            return round(result, accuracy), np.concatenate(present_values)
+        else:
+            return round(result, accuracy)
+
+    def control_variate_values(self, paths):
+        ''' Returns the discounted payoffs adjusted by control variates
+        with known expectation: the discounted maturity value (expectation
+        initial_value; martingale models with deterministic discounting
+        only) and, for geometric Brownian motion with constant short rate
+        and a strike, the discounted call payoff (expectation
+        BSM_european_option.call_value). The coefficients are estimated
+        by least squares on the same paths.
+
+        Attributes
+        ==========
+        paths : array
+            instrument values of the underlying
+        '''
+        if not isinstance(self.underlying, martingale_models):
+            raise NotImplementedError(
+                'Control variates not implemented for %s.'
+                % type(self.underlying).__name__)
+        if type(self.discount_curve) not in (constant_short_rate,
+                                             deterministic_short_rate):
+            raise NotImplementedError(
+                'Control variates not implemented for stochastic rates.')
+        time_index = self.underlying.get_time_index(self.maturity)
+        discount_factor = self.get_maturity_discount_factor(paths)
+        present_values = discount_factor * self.generate_payoff(paths=paths)
+        maturity_value = paths[time_index]
+        controls = [discount_factor * maturity_value
+                    - self.underlying.initial_value]
+        if (isinstance(self.underlying, geometric_brownian_motion) and
+                type(self.discount_curve) == constant_short_rate and
+                hasattr(self, 'strike')):
+            bsm_env = market_environment('bsm_env', self.pricing_date)
+            bsm_env.add_constant('initial_value',
+                                 self.underlying.initial_value)
+            bsm_env.add_constant('strike', self.strike)
+            bsm_env.add_constant('maturity', self.maturity)
+            bsm_env.add_constant('volatility', self.underlying.volatility)
+            bsm_env.add_curve('discount_curve', self.discount_curve)
+            call_value = BSM_european_option('bsm', bsm_env).call_value()
+            controls.append(discount_factor
+                            * np.maximum(maturity_value - self.strike, 0)
+                            - call_value)
+        X = np.array(controls).T
+        Xc = X - np.mean(X, axis=0)
+        beta = np.linalg.lstsq(Xc, present_values - np.mean(present_values),
+                               rcond=-1)[0]
+        adjusted_values = present_values - np.dot(X, beta)
+        self.variance_reduction = (np.var(present_values)
+                                   / max(np.var(adjusted_values), 1e-300))
+        return adjusted_values
+
+    def importance_sampling_values(self, paths, shift=None):
+        ''' Returns likelihood ratio weighted discounted payoffs for
+        paths whose Brownian motion W is shifted to W + shift * t, i.e.
+        S_t exp(sigma shift t). By default the shift centers the
+        maturity value at the strike (OTM payoffs).
+
+        Attributes
+        ==========
+        paths : array
+            instrument values of the underlying
+        shift : float
+            drift of the Brownian motion under the sampling measure;
+            required if the derivative has no strike
+        '''
+        if not isinstance(self.underlying, geometric_brownian_motion):
+            raise NotImplementedError(
+                'Importance sampling only implemented for geometric '
+                'Brownian motion.')
+        brownian_values = self.underlying.get_brownian_values()
+        if brownian_values is None:
+            raise NotImplementedError(
+                'Importance sampling not implemented for stochastic rates.')
+        t, R, W = brownian_values
+        time_index = self.underlying.get_time_index(self.maturity)
+        T = t[time_index, 0]
+        sigma = self.underlying.volatility
+        if shift is None:
+            if not hasattr(self, 'strike'):
+                raise ValueError('No strike to derive the importance '
+                                 'sampling shift from; provide shift.')
+            shift = (math.log(self.strike / self.underlying.initial_value)
+                     - R[time_index, 0] + 0.5 * sigma ** 2 * T) / (sigma * T)
+        discount_factor = self.get_maturity_discount_factor(paths)
+        present_values = discount_factor * self.generate_payoff(paths=paths)
+        shifted_paths = paths * np.exp(sigma * shift * t)
+        likelihood_ratio = np.exp(-shift * W[time_index]
+                                  - 0.5 * shift ** 2 * T)
+        weighted_values = (discount_factor * likelihood_ratio
+                           * self.generate_payoff(paths=shifted_paths))
+        self.variance_reduction = (np.var(present_values)
+                                   / max(np.var(weighted_values), 1e-300))
+        return weighted_values
+
 
 class valuation_mcs_american_single(valuation_class_single):
     ''' Class to value American options with arbitrary payoff
@@ -305,18 +889,20 @@ class valuation_mcs_american_single(valuation_class_single):
         paths = self.underlying.get_instrument_values(fixed_seed=fixed_seed)
         time_grid = self.underlying.time_grid
         try:
-            time_index_start = int(np.where(time_grid == self.pricing_date)[0])
-            time_index_end = int(np.where(time_grid == self.maturity)[0])
+            time_index_start = self.underlying.get_time_index(
+                                                    self.pricing_date)
+            time_index_end = self.underlying.get_time_index(self.maturity)
         except:
             print "Maturity date not in time grid of underlying."
         instrument_values = paths[time_index_start:time_index_end + 1]
         try:
-            payoff = eval(self.payoff_func)
+            payoff = self.get_payoff().evaluate(locals())
             return instrument_values, payoff, time_index_start, time_index_end
         except:
             print "Error evaluating payoff function."
 
-    def present_value(self, accuracy=3, fixed_seed=False, bf=5, full=False):
+    def present_value(self, accuracy=3, fixed_seed=False, bf=5, full=False,
+                      basis='monomial'):
         '''
         Attributes
         ==========
@@ -325,28 +911,33 @@ class valuation_mcs_american_single(valuation_class_single):
         fixed_seed :
             used same/fixed seed for valuation
         bf : int
-            number of basis functions for regression
+            degree of the basis functions for regression
+        basis : string
+            basis family ('monomial', 'laguerre', 'hermite')
         '''
         instrument_values, inner_values, time_index_start, time_index_end = \
             self.generate_payoff(fixed_seed=fixed_seed)
-        time_list = \
-            self.underlying.time_grid[time_index_start:time_index_end + 1]
+        time_list = self.underlying.get_grid().get_sub_grid(
+                                time_index_start, time_index_end + 1)
 
         discount_factors = self.discount_curve.get_discount_factors(
                             time_list, self.paths, dtobjects=True)[1]
 
+        regression = lsm_regression(basis=basis, degree=bf)
         V = inner_values[-1]
         for t in range(len(time_list) - 2, 0, -1):
             # derive relevant discount factor for given time interval
             df = discount_factors[t] / discount_factors[t + 1]
-            # regression step
-            rg = np.polyfit(instrument_values[t], V * df, bf)
-            # calculation of continuation values per path
-            C = np.polyval(rg, instrument_values[t])
+            V = V * df
+            # regression step (in-the-money paths only)
+            itm = inner_values[t] > 0
+            C = regression.continuation_values(instrument_values[t], V, itm)
+            if C is None:
+                continue
             # optimal decision step:
             # if condition is satisfied (inner value > regressed cont. value)
             # then take inner value; take actual cont. value otherwise
-            V = np.where(inner_values[t] > C, inner_values[t], V * df)
+            V = np.where(itm & (inner_values[t] > C), inner_values[t], V)
         df = discount_factors[0] / discount_factors[1]
         result = np.sum(df * V) / len(V)
         if full:
@@ -385,6 +976,8 @@ class valuation_class_multi(object):
         returns the delta of the derivative
     vega :
         returns the vega of the derivative
+    get_payoff :
+        returns the compiled payoff function
     '''
     def __init__(self, name, val_env, risk_factors=None, correlations=None,
                  payoff_func='', fixed_seed=False, portfolio=False):
@@ -416,9 +1009,19 @@ class valuation_class_multi(object):
                 self.time_grid = self.val_env.get_curve('time_grid')
             except:
                 self.time_grid = None
+            try:
+                self.grid = self.val_env.get_curve('date_grid')
+            except:
+                self.grid = None
             self.correlation_matrix = None
         except:
             print "Error parsing market environment."
+        self.payoff = None
+        try:
+            # payoff string parsed once
+            self.payoff = compile_payoff(payoff_func)
+        except:
+            print "Error compiling payoff function."
 
         # Generating general time grid
         if self.time_grid is None:
@@ -451,40 +1054,51 @@ class valuation_class_multi(object):
                     rn_set[asset] = ul_list.index(asset)
 
                 # random numbers array
+                # pseudo-random (default) or quasi-random source
+                constants = self.val_env.constants
                 random_numbers = sn_random_numbers((len(rn_set),
                                           len(self.time_grid),
-                                          self.val_env.constants['paths']),
-                                          fixed_seed=self.fixed_seed)
+                                          constants['paths']),
+                                          fixed_seed=self.fixed_seed,
+                                          method=constants.get(
+                                              'random_source', 'pseudo'),
+                                          brownian_bridge=constants.get(
+                                              'brownian_bridge', True))
+                # correlated once for all underlyings
+                random_numbers = correlate_random_numbers(cholesky_matrix,
+                                                          random_numbers)
 
                 # adding all to valuation environment
                 self.val_env.add_list('cholesky_matrix', cholesky_matrix)
                 self.val_env.add_list('rn_set', rn_set)
                 self.val_env.add_list('random_numbers', random_numbers)
+                self.val_env.add_constant('random_numbers_correlated', True)
             self.generate_underlying_objects()
 
+    def get_payoff(self):
+        ''' Returns the payoff compiled in __init__; compiles again only
+        if payoff_func was changed after construction. '''
+        if self.payoff is None or \
+                self.payoff.payoff_func != self.payoff_func:
+            self.payoff = compile_payoff(self.payoff_func)
+        return self.payoff
 
     def generate_time_grid(self):
         ''' Generats time grid for all relevant objects. '''
         start = self.val_env.get_constant('starting_date')
         end = self.val_env.get_constant('final_date')
-        maturity = self.maturity
-        time_grid = pd.date_range(start=start, end=end,
-                            freq=self.val_env.get_constant('frequency')
-                                  ).to_pydatetime()
-        if start in time_grid and end in time_grid and \
-                maturity in time_grid:
-            self.time_grid = time_grid
-        else:
-            time_grid = list(time_grid)
-            if maturity not in time_grid:
-                time_grid.insert(0, maturity)
-            if start not in time_grid:
-                time_grid.insert(0, start)
-            if end not in time_grid:
-                time_grid.append(end)
-            time_grid.sort()
-            self.time_grid = np.array(time_grid)
+        self.grid = generate_date_grid(start, end,
+                            self.val_env.get_constant('frequency'),
+                            [self.maturity])
+        self.time_grid = self.grid.dates
         self.val_env.add_curve('time_grid', self.time_grid)
+        self.val_env.add_curve('date_grid', self.grid)
+
+    def get_grid(self):
+        ''' Returns the date_grid object of the time grid. '''
+        if self.grid is None or self.grid.dates is not self.time_grid:
+            self.grid = date_grid(self.time_grid)
+        return self.grid
 
     def generate_underlying_objects(self):
         for asset in self.risk_factors:
@@ -657,21 +1271,25 @@ class valuation_mcs_european_multi(valuation_class_multi):
                        in self.underlying_objects.items()}
         time_grid = self.time_grid
         try:
-            time_index = np.where(time_grid == self.maturity)[0]
-            time_index = int(time_index)
+            time_index = self.get_grid().get_index(self.maturity)
         except:
             print "Maturity date not in time grid of underlying."
         maturity_value = {}
         mean_value = {}
         max_value = {}
         min_value = {}
-        for key in paths:
-            maturity_value[key] = paths[key][time_index]
-            mean_value[key] = np.mean(paths[key][:time_index], axis=1)
-            max_value[key] = np.amax(paths[key][:time_index], axis=1)
-            min_value[key] = np.amin(paths[key][:time_index], axis=1)
         try:
-            payoff = eval(self.payoff_func)
+            payoff_func = self.get_payoff()
+            # path statistics only if referenced by the payoff
+            for key in paths:
+                maturity_value[key] = paths[key][time_index]
+                if payoff_func.requires('mean_value'):
+                    mean_value[key] = np.mean(paths[key][:time_index], axis=1)
+                if payoff_func.requires('max_value'):
+                    max_value[key] = np.amax(paths[key][:time_index], axis=1)
+                if payoff_func.requires('min_value'):
+                    min_value[key] = np.amin(paths[key][:time_index], axis=1)
+            payoff = payoff_func.evaluate(locals())
             return payoff
         except:
             print "Error evaluating payoff function."
@@ -680,7 +1298,7 @@ class valuation_mcs_european_multi(valuation_class_multi):
         cash_flow = self.generate_payoff(fixed_seed)
 
         discount_factor = self.discount_curve.get_discount_factors(
-                          self.time_grid, self.paths)[1][0]
+                          self.get_grid(), self.paths)[1][0]
 
         result = np.sum(discount_factor * cash_flow) / len(cash_flow)
         if full:
@@ -705,8 +1323,8 @@ class valuation_mcs_american_multi(valuation_class_multi):
         self.instrument_values = {key: name.instrument_values for key, name
                        in self.underlying_objects.items()}
         try:
-            time_index_start = int(np.where(self.time_grid == self.pricing_date)[0])
-            time_index_end = int(np.where(self.time_grid == self.maturity)[0])
+            time_index_start = self.get_grid().get_index(self.pricing_date)
+            time_index_end = self.get_grid().get_index(self.maturity)
         except:
             print "Pricing date or maturity date not in time grid of underlying."
         instrument_values = {}
@@ -715,30 +1333,50 @@ class valuation_mcs_american_multi(valuation_class_multi):
                 self.instrument_values[key][time_index_start:time_index_end
                                             + 1]
         try:
-            payoff = eval(self.payoff_func)
+            payoff = self.get_payoff().evaluate(locals())
             return instrument_values, payoff, time_index_start, time_index_end
         except:
             print "Error evaluating payoff function."
-    def present_value(self, accuracy=3, fixed_seed=True, full=False):
+    def present_value(self, accuracy=3, fixed_seed=True, full=False,
+                      bf=2, basis='monomial', cross_terms=True):
+        '''
+        Attributes
+        ==========
+        accuracy : int
+            number of decimals in returned result
+        fixed_seed :
+            used same/fixed seed for valuation
+        bf : int
+            degree of the basis functions per risk factor
+        basis : string
+            basis family ('monomial', 'laguerre', 'hermite')
+        cross_terms : boolean
+            include products of the risk factors in the regression
+        '''
         instrument_values, inner_values, time_index_start, time_index_end = \
                     self.generate_payoff(fixed_seed=fixed_seed)
-        time_list = self.time_grid[time_index_start:time_index_end + 1]
+        time_list = self.get_grid().get_sub_grid(time_index_start,
+                                                 time_index_end + 1)
 
         discount_factors = self.discount_curve.get_discount_factors(
                             time_list, self.paths, dtobjects=True)[1]
 
+        regression = lsm_regression(basis=basis, degree=bf,
+                                    cross_terms=cross_terms)
+        keys = sorted(instrument_values)
+        # regressors of all risk factors, filled per time step
+        X = np.empty((len(inner_values[-1]), len(keys)))
         V = inner_values[-1]
         for t in range(len(time_list) - 2, 0, -1):
             df = discount_factors[t] / discount_factors[t + 1]
-            matrix = {}
-            for asset_1 in instrument_values.keys():
-                matrix[asset_1] = instrument_values[asset_1][t]
-                for asset_2 in instrument_values.keys():
-                    matrix[asset_1 + asset_2] = instrument_values[asset_1][t] \
-                        * instrument_values[asset_2][t]
-            rg = sm.OLS(V * df, np.array(matrix.values()).T).fit()
-            C = np.sum(rg.params * np.array(matrix.values()).T, axis=1)
-            V = np.where(inner_values[t] > C, inner_values[t], V * df)
+            V = V * df
+            for j, key in enumerate(keys):
+                X[:, j] = instrument_values[key][t]
+            itm = inner_values[t] > 0
+            C = regression.continuation_values(X, V, itm)
+            if C is None:
+                continue
+            V = np.where(itm & (inner_values[t] > C), inner_values[t], V)
         df = discount_factors[0] / discount_factors[1]
         result = np.sum(df * V) / len(V)
         if full:
@@ -849,6 +1487,8 @@ class derivatives_portfolio(object):
         returns a pandas DataFrame object with portfolio statistics
     get_port_risk :
         estimates sensitivities for point-wise parameter shocks
+    close :
+        shuts down the worker pool (parallel=True only)
     '''
 
     def __init__(self, name, positions, val_env, risk_factors,
@@ -867,6 +1507,11 @@ class derivatives_portfolio(object):
         self.valuation_objects = {}
         self.fixed_seed = fixed_seed
         self.parallel = parallel
+        if parallel is True:
+            # worker pool kept alive for all parallel calls
+            self.executor = parallel_executor()
+        else:
+            self.executor = None
         self.special_dates = []
         for pos in self.positions:
             # determine earliest starting_date
@@ -883,27 +1528,21 @@ class derivatives_portfolio(object):
                 self.underlyings.add(ul)
 
         # generating general time grid
+        # (enhanced by the maturity dates of all positions)
         start = self.val_env.constants['starting_date']
         end = self.val_env.constants['final_date']
-        time_grid = pd.date_range(start=start, end=end,
-                                  freq=self.val_env.constants['frequency']
-                                  ).to_pydatetime()
-        time_grid = list(time_grid)
         for pos in self.positions:
             maturity_date = positions[pos].mar_env.constants['maturity']
-            if maturity_date not in time_grid:
-                time_grid.insert(0, maturity_date)
+            if maturity_date not in self.special_dates:
                 self.special_dates.append(maturity_date)
-        if start not in time_grid:
-            time_grid.insert(0, start)
-        if end not in time_grid:
-            time_grid.append(end)
-        # delete duplicate entries
-        # & sort dates in time_grid
-        time_grid = sorted(set(time_grid))
-
-        self.time_grid = np.array(time_grid)
+        self.grid = generate_date_grid(start, end,
+                                       self.val_env.constants['frequency'],
+                                       self.special_dates)
+
+        # one date_grid shared by all underlyings
+        self.time_grid = self.grid.dates
         self.val_env.add_list('time_grid', self.time_grid)
+        self.val_env.add_list('date_grid', self.grid)
 
         # taking care of correlations
         ul_list = sorted(self.underlyings)
@@ -947,7 +1586,15 @@ class derivatives_portfolio(object):
             (len(rn_set),
              len(self.time_grid),
              self.val_env.constants['paths']),
-             fixed_seed=self.fixed_seed)
+             fixed_seed=self.fixed_seed,
+             method=self.val_env.constants.get('random_source', 'pseudo'),
+             brownian_bridge=self.val_env.constants.get('brownian_bridge',
+                                                        True))
+        # correlate the whole cube once (single matrix product) instead of
+        # once per underlying and time step; the read-only result is
+        # indexed by every underlying via its rn_set entry
+        random_numbers = correlate_random_numbers(cholesky_matrix,
+                                                  random_numbers)
 
         # adding all to valuation environment which is
         # to be shared with every underlying
@@ -955,6 +1602,7 @@ class derivatives_portfolio(object):
         self.val_env.add_list('cholesky_matrix', cholesky_matrix)
         self.val_env.add_list('random_numbers', random_numbers)
         self.val_env.add_list('rn_set', rn_set)
+        self.val_env.add_constant('random_numbers_correlated', True)
 
         for asset in self.underlyings:
             # select market environment of asset
@@ -1010,8 +1658,10 @@ class derivatives_portfolio(object):
         res_list = []
         if self.parallel is True:
             self.underlying_objects = \
-                simulate_parallel(self.underlying_objects.values())
-            results = value_parallel(self.valuation_objects.values())
+                simulate_parallel(self.underlying_objects.values(),
+                                  executor=self.executor)
+            results = value_parallel(self.valuation_objects.values(),
+                                     executor=self.executor)
         # iterate over all positions in portfolio
         for pos in self.valuation_objects:
             pos_list = []
@@ -1041,9 +1691,10 @@ class derivatives_portfolio(object):
         present_values = np.zeros(self.val_env.get_constant('paths'))
         if self.parallel is True:
             self.underlying_objects = \
-                simulate_parallel(self.underlying_objects.values())
+                simulate_parallel(self.underlying_objects.values(),
+                                  executor=self.executor)
             results = value_parallel(self.valuation_objects.values(),
-                                     full=True)
+                                     full=True, executor=self.executor)
             for pos in self.valuation_objects:
                 present_values += results[self.valuation_objects[pos].name] \
                                     * self.positions[pos].quantity
@@ -1062,13 +1713,17 @@ class derivatives_portfolio(object):
             fixed_seed = self.fixed_seed
         if self.parallel is True:
             self.underlying_objects = \
-                simulate_parallel(self.underlying_objects.values())
+                simulate_parallel(self.underlying_objects.values(),
+                                  executor=self.executor)
             results = value_parallel(self.valuation_objects.values(),
-                                    fixed_seed=fixed_seed)
+                                    fixed_seed=fixed_seed,
+                                    executor=self.executor)
             delta_list = greeks_parallel(self.valuation_objects.values(),
-                                        Greek='Delta')
+                                        Greek='Delta',
+                                        executor=self.executor)
             vega_list = greeks_parallel(self.valuation_objects.values(),
-                                        Greek='Vega')
+                                        Greek='Vega',
+                                        executor=self.executor)
         # iterate over all positions in portfolio
         for pos in self.valuation_objects:
             pos_list = []
@@ -1134,7 +1789,8 @@ class derivatives_portfolio(object):
         levels = np.arange(low, high + 0.01, step)
         if self.parallel is True:
             values = value_parallel(self.valuation_objects.values(),
-                                    fixed_seed=fixed_seed)
+                                    fixed_seed=fixed_seed,
+                                    executor=self.executor)
             for key in self.valuation_objects:
                 values[key] *= self.positions[key].quantity
         else:
@@ -1200,6 +1856,12 @@ class derivatives_portfolio(object):
         print 2 * '\n'
         return pd.Panel(sensitivities), sum(values.values())
 
+    def close(self):
+        ''' Shuts down the worker pool used for parallel valuation. '''
+        if self.executor is not None:
+            self.executor.close()
+            self.executor = None
+
     def get_deltas(self, net=True, low=0.9, high=1.1, step=0.05):
         ''' Returns the deltas of the portfolio. Convenience function.'''
         deltas, benchvalue = self.dx_port.get_port_risk(Greek='Delta',
@@ -1226,70 +1888,255 @@ def risk_report(sensitivities, digits=2, gross=True):
 
 
 import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import uuid
 
+# attributes of model/valuation objects holding (large) arrays which are
+# exchanged through shared memory instead of being pickled
+shared_attributes = ['instrument_values', 'volatility_values',
+                     'random_numbers']
 
-def simulate_parallel(objs, fixed_seed=True):
-    procs = []
-    man = mp.Manager()
-    output = man.Queue()
-
-    def worker(o, output):
-        o.generate_paths(fixed_seed=fixed_seed)
-        output.put((o.name, o))
-    for o in objs:
-        procs.append(mp.Process(target=worker, args=(o, output)))
-    [pr.start() for pr in procs]
-    [pr.join() for pr in procs]
-    results = [output.get() for o in objs]
-    underlying_objects = {}
-    for o in results:
-        underlying_objects[o[0]] = o[1]
-    return underlying_objects
-
-
-def value_parallel(objs, fixed_seed=True, full=False):
-    procs = []
-    man = mp.Manager()
-    output = man.Queue()
-
-    def worker(o, output):
-        if full is True:
-            pvs = o.present_value(fixed_seed=fixed_seed, full=True)[1]
-            output.put((o.name, pvs))
-        else:
-            pv = o.present_value(fixed_seed=fixed_seed)
-            output.put((o.name, pv))
-
-    for o in objs:
-        procs.append(mp.Process(target=worker, args=(o, output)))
-    [pr.start() for pr in procs]
-    [pr.join() for pr in procs]
-    res_list = [output.get() for o in objs]
-    results = {}
-    for o in res_list:
-        results[o[0]] = o[1]
-    return results
-
-def greeks_parallel(objs, Greek='Delta'):
-    procs = []
-    man = mp.Manager()
-    output = man.Queue()
-
-    def worker(o, output):
-        if Greek == 'Delta':
-            output.put((o.name, o.delta()))
-        elif Greek == 'Vega':
-            output.put((o.name, o.vega()))
-
-    for o in objs:
-        procs.append(mp.Process(target=worker, args=(o, output)))
-    [pr.start() for pr in procs]
-    [pr.join() for pr in procs]
-    res_list = [output.get() for o in objs]
+
+class shared_array(object):
+    ''' Reference to a NumPy array stored as memory-mapped .npy file
+    (on /dev/shm where available); only the file name is pickled when
+    the reference is sent to another process.
+
+    Attributes
+    ==========
+    filename : string
+        path of the .npy file
+
+    Methods
+    =======
+    from_array :
+        writes an array to a new file in a directory (class method)
+    get_array :
+        returns the array as (copy-on-write) memory map
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    @classmethod
+    def from_array(cls, array, directory):
+        filename = os.path.join(directory, uuid.uuid4().hex + '.npy')
+        np.save(filename, array)
+        return cls(filename)
+
+    def get_array(self):
+        return np.load(self.filename, mmap_mode='c')
+
+
+def get_model_objects(o):
+    ''' Returns the list of objects (o itself, underlyings, stochastic
+    discount processes, valuation environment lists) whose arrays
+    are exchanged through shared memory. '''
+    objs = [o]
+    if hasattr(o, 'underlying'):
+        objs.append(o.underlying)
+    if hasattr(o, 'underlying_objects'):
+        objs.extend(o.underlying_objects.values())
+    for obj in list(objs):
+        process = getattr(getattr(obj, 'discount_curve', None),
+                          'process', None)
+        if process is not None:
+            objs.append(process)
+    return objs
+
+
+def attach_shared_arrays(o):
+    ''' Replaces all shared_array references held by o (and the
+    objects it references) by the memory-mapped arrays. '''
+    for obj in get_model_objects(o):
+        containers = [obj.__dict__]
+        if hasattr(obj, 'val_env'):
+            containers.append(obj.val_env.lists)
+        for container in containers:
+            for attr in shared_attributes:
+                value = container.get(attr)
+                if isinstance(value, shared_array):
+                    container[attr] = value.get_array()
+                elif isinstance(value, dict):
+                    for key in value:
+                        if isinstance(value[key], shared_array):
+                            value[key] = value[key].get_array()
+
+
+def _simulate_worker(args):
+    o, fixed_seed, directory = args
+    attach_shared_arrays(o)
+    o.generate_paths(fixed_seed=fixed_seed)
     results = {}
-    for o in res_list:
-        results[o[0]] = o[1]
-    return results
+    for attr in ['instrument_values', 'volatility_values']:
+        value = getattr(o, attr, None)
+        if isinstance(value, np.ndarray):
+            results[attr] = shared_array.from_array(value, directory)
+    return o.name, results
+
+
+def _value_worker(args):
+    o, fixed_seed, full = args
+    attach_shared_arrays(o)
+    if full is True:
+        return o.name, o.present_value(fixed_seed=fixed_seed, full=True)[1]
+    else:
+        return o.name, o.present_value(fixed_seed=fixed_seed)
+
+
+def _greeks_worker(args):
+    o, Greek = args
+    attach_shared_arrays(o)
+    if Greek == 'Delta':
+        return o.name, o.delta()
+    elif Greek == 'Vega':
+        return o.name, o.vega()
+
+
+class parallel_executor(object):
+    ''' Long-lived pool of worker processes for the parallel simulation
+    and valuation of model and valuation objects. Path and random number
+    arrays are exchanged through memory-mapped files in a temporary
+    directory (on /dev/shm where available) instead of being pickled.
+
+    Attributes
+    ==========
+    processes : int
+        number of worker processes (default: number of cores)
+
+    Methods
+    =======
+    simulate :
+        generates the paths of simulation objects in parallel
+    value :
+        values valuation objects in parallel
+    greeks :
+        estimates Greeks of valuation objects in parallel
+    close :
+        shuts down the worker pool and removes the shared files
+    '''
+
+    def __init__(self, processes=None):
+        if processes is None:
+            processes = mp.cpu_count()
+        self.processes = processes
+        if os.path.isdir('/dev/shm'):
+            self.directory = tempfile.mkdtemp(prefix='dx_', dir='/dev/shm')
+        else:
+            self.directory = tempfile.mkdtemp(prefix='dx_')
+        self.pool = mp.Pool(processes)
+
+    def share(self, array, cache):
+        ''' Returns shared_array reference to array; arrays already
+        backed by a shared file are not written again. '''
+        if isinstance(array, np.memmap) and array.filename is not None \
+                and os.path.dirname(array.filename) == self.directory:
+            return shared_array(array.filename)
+        if id(array) not in cache:
+            cache[id(array)] = shared_array.from_array(array,
+                                                       self.directory)
+        return cache[id(array)]
+
+    def detach(self, objs):
+        ''' Replaces the float arrays held by objs by shared_array
+        references (for pickling); returns the list of replacements
+        (with the original arrays) to be undone by restore. '''
+        cache = {}
+        replaced = []
+        for o in objs:
+            for obj in get_model_objects(o):
+                containers = [obj.__dict__]
+                if hasattr(obj, 'val_env'):
+                    containers.append(obj.val_env.lists)
+                for container in containers:
+                    for attr in shared_attributes:
+                        value = container.get(attr)
+                        if isinstance(value, dict):
+                            holders = [(value, key) for key in value]
+                        else:
+                            holders = [(container, attr)]
+                        for holder, key in holders:
+                            array = holder.get(key)
+                            if isinstance(array, np.ndarray) and \
+                                    array.dtype.kind == 'f':
+                                holder[key] = self.share(array, cache)
+                                replaced.append((holder, key, array))
+        return replaced
+
+    def restore(self, replaced):
+        ''' Puts the original arrays (not the memory maps) back. '''
+        for holder, key, array in replaced:
+            holder[key] = array
+
+    def map(self, worker, objs, args):
+        replaced = self.detach(objs)
+        try:
+            return self.pool.map(worker, [(o,) + args for o in objs])
+        finally:
+            self.restore(replaced)
+
+    def simulate(self, objs, fixed_seed=True):
+        ''' Generates paths for the simulation objects objs in parallel;
+        the objects are updated in place with memory-mapped paths. '''
+        objs = list(objs)
+        results = self.map(_simulate_worker, objs,
+                           (fixed_seed, self.directory))
+        underlying_objects = {}
+        for o, (name, arrays) in zip(objs, results):
+            for attr, ref in arrays.items():
+                old = getattr(o, attr, None)
+                setattr(o, attr, ref.get_array())
+                if isinstance(old, np.memmap) and old.filename is not None \
+                        and os.path.dirname(old.filename) == self.directory:
+                    # existing memory maps stay valid after unlinking
+                    os.remove(old.filename)
+            underlying_objects[name] = o
+        return underlying_objects
+
+    def value(self, objs, fixed_seed=True, full=False):
+        ''' Returns dictionary with present values of valuation objects. '''
+        return dict(self.map(_value_worker, list(objs), (fixed_seed, full)))
+
+    def greeks(self, objs, Greek='Delta'):
+        ''' Returns dictionary with Greeks of valuation objects. '''
+        return dict(self.map(_greeks_worker, list(objs), (Greek,)))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def simulate_parallel(objs, fixed_seed=True, executor=None):
+    if executor is not None:
+        return executor.simulate(objs, fixed_seed=fixed_seed)
+    executor = parallel_executor()
+    try:
+        return executor.simulate(objs, fixed_seed=fixed_seed)
+    finally:
+        executor.close()
+
+
+def value_parallel(objs, fixed_seed=True, full=False, executor=None):
+    if executor is not None:
+        return executor.value(objs, fixed_seed=fixed_seed, full=full)
+    executor = parallel_executor()
+    try:
+        return executor.value(objs, fixed_seed=fixed_seed, full=full)
+    finally:
+        executor.close()
+
+
+def greeks_parallel(objs, Greek='Delta', executor=None):
+    if executor is not None:
+        return executor.greeks(objs, Greek=Greek)
+    executor = parallel_executor()
+    try:
+        return executor.greeks(objs, Greek=Greek)
+    finally:
+        executor.close()
 
 
 class var_derivatives_portfolio(derivatives_portfolio):
@@ -1349,20 +2196,11 @@ class var_derivatives_portfolio(derivatives_portfolio):
         # generating general time grid
         start = self.val_env.constants['starting_date']
         end = self.val_env.constants['final_date']
-        time_grid = pd.date_range(start=start, end=end,
-                                  freq='B' # allow business day only
-                                  ).to_pydatetime()
-        time_grid = list(time_grid)
-
-        if start not in time_grid:
-            time_grid.insert(0, start)
-        if end not in time_grid:
-            time_grid.append(end)
-        # delete duplicate entries & sort dates in time_grid
-        time_grid = sorted(set(time_grid))
-
-        self.time_grid = np.array(time_grid)
+        # allow business day only
+        self.grid = generate_date_grid(start, end, 'B')
+        self.time_grid = self.grid.dates
         self.val_env.add_list('time_grid', self.time_grid)
+        self.val_env.add_list('date_grid', self.grid)
 
         #
         # generate simulated paths
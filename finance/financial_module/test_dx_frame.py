@@ -0,0 +1,32 @@
+#
+# DX Analytics
+# Tests for the Frame Classes
+# test_dx_frame.py
+#
+import unittest
+import datetime as dt
+from dx_frame import *
+
+
+class DateGridTest(unittest.TestCase):
+
+    def test_special_date_with_time_of_day(self):
+        maturity = dt.datetime(2015, 6, 30, 12)
+        grid = generate_date_grid(dt.datetime(2015, 1, 1),
+                                  dt.datetime(2015, 12, 31), 'M',
+                                  special_dates=[maturity])
+        day_end = dt.datetime(2015, 6, 30)
+        self.assertEqual(grid.get_index(maturity),
+                         grid.get_index(day_end) + 1)
+        self.assertEqual(len(set(grid.dates)), len(grid))
+        self.assertEqual(list(grid.dates), sorted(grid.dates))
+
+    def test_key_distinguishes_time_of_day(self):
+        start = dt.datetime(2015, 1, 1)
+        grid_1 = date_grid([start, dt.datetime(2015, 6, 30, 12)])
+        grid_2 = date_grid([start, dt.datetime(2015, 6, 30, 18)])
+        self.assertNotEqual(grid_1.key, grid_2.key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#
+# DX Analytics
+# Tests for the Valuation Classes
+# test_dx_valuation.py
+#
+import unittest
+import pickle
+import datetime as dt
+from dx_valuation import *
+
+
+def european_call(paths=1000):
+    ''' Returns a European call valuation object on a GBM underlying. '''
+    me = market_environment('me', dt.datetime(2015, 1, 1))
+    me.add_constant('initial_value', 36.)
+    me.add_constant('volatility', 0.2)
+    me.add_constant('final_date', dt.datetime(2015, 12, 31))
+    me.add_constant('currency', 'EUR')
+    me.add_constant('frequency', 'M')
+    me.add_constant('paths', paths)
+    me.add_curve('discount_curve', constant_short_rate('r', 0.06))
+    gbm = geometric_brownian_motion('gbm', me)
+    me.add_constant('maturity', dt.datetime(2015, 12, 31))
+    me.add_constant('strike', 40.)
+    return valuation_mcs_european_single(
+        'call', gbm, me, 'np.maximum(maturity_value - strike, 0)')
+
+
+class PayoffPickleTest(unittest.TestCase):
+
+    def test_payoff_function(self):
+        payoff = pickle.loads(pickle.dumps(
+            compile_payoff('np.maximum(maturity_value - strike, 0)')))
+        self.assertTrue(payoff.requires('maturity_value'))
+        self.assertFalse(payoff.requires('mean_value'))
+
+    def test_valuation_object(self):
+        call = european_call()
+        value = call.present_value(fixed_seed=True)
+        copy = pickle.loads(pickle.dumps(call))
+        self.assertEqual(copy.payoff.payoff_func, call.payoff_func)
+        self.assertAlmostEqual(copy.present_value(fixed_seed=True), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
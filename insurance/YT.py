@@ -6,6 +6,52 @@ import numpy as np
 import pandas as pd
 
 
+#   order statistics of one year table by selection ( np.partition ) instead of a full np.sort
+#   self-contained subset of InsuranceTools.RiskMetric, so that YT only needs numpy/pandas
+#   yt : year table ( list or array )
+class YTMetric(object):
+    def __init__(self, yt):
+        self.yt = np.asarray(yt, dtype=float)
+        self.n = self.yt.shape[0]
+        self.mean_value = None
+        self.order_cache = {}  # k -> k-th smallest value
+        self.band_cache = {}  # (a, b) -> mean of the a-th ... (b-1)-th smallest values
+
+    def index(self, alpha):
+        # e.g. alpha = 0.99, n = 10000 -> 9900
+        return int(np.floor(self.n * alpha))
+
+    def mean(self):
+        if self.mean_value is None:
+            self.mean_value = np.mean(self.yt)
+        return self.mean_value
+
+    def order_statistic(self, k):
+        k = int(k)
+        if k not in self.order_cache:
+            self.order_cache[k] = np.partition(self.yt, k)[k]
+        return self.order_cache[k]
+
+    def band_mean(self, a, b):
+        b = min(b, self.n)
+        if (a, b) not in self.band_cache:
+            if a >= b:
+                self.band_cache[(a, b)] = np.nan
+            else:
+                # a-th and (b-1)-th in place -> the values in between are the band
+                self.band_cache[(a, b)] = np.mean(np.partition(self.yt, [a, b - 1])[a:b])
+        return self.band_cache[(a, b)]
+
+    def tvar(self, alpha):
+        return self.band_mean(self.index(alpha), self.n)
+
+    def xtvar(self, alpha):
+        return self.tvar(alpha) - self.mean()
+
+    def truntvar(self, alpha, beta):
+        return self.band_mean(self.index(alpha), self.index(beta))
+
+
 class YT(object):
     """
     Dec.2015 developed by Hirayu
@@ -48,6 +94,7 @@ class YT(object):
         self.noncat_dict = {}
         self.all_peril_dict = {}
         self.peril_list = ['USWS', 'USEQ', 'EUWS', 'EUEQ', 'JPWS', 'JPEQ', 'RoW']
+        self.engine_dict = {}  # year table name -> YTMetric ( partial selection cache )
 
     def __add__(self, another):
         global new_yt_dic
@@ -71,44 +118,47 @@ class YT(object):
         else:
             pass
 
+    def engine(self, k):
+        if k not in self.engine_dict:
+            self.engine_dict[k] = YTMetric(self.YT_dic[k])
+        return self.engine_dict[k]
+
     def stat(self):
         df = pd.DataFrame(self.YT_dic)
         return df.describe()
 
     def mean(self):
-        return {k: np.mean(v) for k, v in zip(self.YT_name, self.YT_table)}
+        return {k: self.engine(k).mean() for k in self.YT_name}
 
     def var(self, alpha):
+        # same point as np.percentile(v, q=alpha * 100, interpolation='higher')
         self.alpha_check(alpha)
-        return {k: np.percentile(v, q=alpha * 100, interpolation='higher') for k, v in
+        return {k: self.engine(k).order_statistic(np.ceil(alpha * (len(v) - 1))) for k, v in
                 zip(self.YT_name, self.YT_table)}
 
     def xvar(self, alpha):
-        self.alpha_check(alpha)
-        return {k: np.percentile(v, q=alpha * 100, interpolation='higher') - np.mean(v) for k, v in
-                zip(self.YT_name, self.YT_table)}
+        return {k: v - self.engine(k).mean() for k, v in self.var(alpha).items()}
 
     def tvar(self, alpha):
         self.alpha_check(alpha)
-        return {k: np.mean(np.sort(v)[self.alpha_n:]) for k, v in zip(self.YT_name, self.YT_table)}
+        return {k: self.engine(k).tvar(alpha) for k in self.YT_name}
 
     def xtvar(self, alpha):
         self.alpha_check(alpha)
-        return {k: np.mean(np.sort(v)[self.alpha_n:]) - np.mean(v) for k, v in
-                zip(self.YT_name, self.YT_table)}
+        return {k: self.engine(k).xtvar(alpha) for k in self.YT_name}
 
     def truntvar(self, alpha, beta):
         self.alpha_check(alpha)
         self.alpha_check(beta)
-        self.alpha_n = alpha * self.n
-        self.beta_n = beta * self.n
-        if self.alpha > self.beta or (self.beta_n - self.alpha_n) < 1:
+        self.alpha_n = np.int(np.floor(alpha * self.n))
+        self.beta_n = np.int(np.floor(beta * self.n))
+        if alpha > beta or (self.beta_n - self.alpha_n) < 1:
             print('-' * 100 + '\n')
             print('Alpha must be smaller than beta  or  Between alpha percentile point and beta percentile point, there is no data.')
             print('-' * 100 + '\n')
             exit(1)
         else:
-            return {k: np.mean(np.sort(v)[self.alpha_n:self.beta_n]) for k, v in zip(self.YT_name, self.YT_table)}
+            return {k: self.engine(k).truntvar(alpha, beta) for k in self.YT_name}
 
     def premium(self):
         self.premium_dict = {'empty': [0.] * self.n}
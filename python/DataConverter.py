@@ -1,6 +1,6 @@
 #
 #   Comments :      Containts
-#                   pickle_write, pickle_read, datacontainer, datacleaner
+#                   pickle_write, pickle_read, datacontainer, datacleaner, ColumnStore
 #
 #   Arguments :
 #
@@ -21,7 +21,7 @@ from colorama import Fore, Back, Style
 
 # pickle writer
 def pickle_write(data, filename):
-    print('pickle write :', data)
+    print('pickle write :', filename)
     with open(filename, 'w+') as fw:
         pickle.dump(data, fw)
 
@@ -33,13 +33,91 @@ def pickle_read(filename):
     return data
 
 
+# columnar year table store : one binary file per work directory
+#   <directory><name>.col : all year tables, column after column ( Fortran order ),
+#                           so every column is one contiguous block of the file
+#   <directory><name>.idx : text index, first line 'number_of_year dtype', then one column name per line
+# columns are read lazily through np.memmap, nothing is loaded until it is touched
+# dtype : 'float64' or 'float32'
+class ColumnStore(object):
+    def __init__(self, directory, dtype='float64', name='yeartable'):
+        self.data_file = directory + name + '.col'
+        self.index_file = directory + name + '.idx'
+        self.n = None  # number of year
+        self.dtype = np.dtype(dtype)
+        self.columns = []
+        self.mm = None
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as fr:
+                lines = fr.read().splitlines()
+            n, dtype = lines[0].split()
+            self.n = int(n)
+            self.dtype = np.dtype(dtype)
+            self.columns = lines[1:]
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def write_index(self):
+        with open(self.index_file, 'w') as fw:
+            fw.write('%d %s\n' % (self.n, self.dtype.name))
+            for i in self.columns:
+                fw.write(i + '\n')
+
+    # write one year table as a column ( appended, or overwritten in place if the name exists )
+    def write(self, column, values):
+        values = np.ascontiguousarray(np.ravel(values), dtype=self.dtype)
+        if self.n is None:
+            self.n = values.shape[0]
+        if values.shape[0] != self.n:
+            print('-' * 100 + '\n')
+            print(' number of year of %s does not match the store ( %d ) \n' % (column, self.n))
+            print('-' * 100 + '\n')
+            exit(1)
+        if column in self.columns:
+            with open(self.data_file, 'r+b') as fw:
+                fw.seek(self.columns.index(column) * self.n * self.dtype.itemsize)
+                fw.write(values.tobytes())
+        else:
+            with open(self.data_file, 'ab') as fw:
+                fw.write(values.tobytes())
+            self.columns.append(column)
+            self.write_index()
+        self.mm = None  # re-map on next read
+
+    def memmap(self):
+        if self.mm is None:
+            self.mm = np.memmap(self.data_file, dtype=self.dtype, mode='r', shape=(self.n, len(self.columns)),
+                                order='F')
+        return self.mm
+
+    # lazy column ( read-only view on the mapped file )
+    def read(self, column):
+        return self.memmap()[:, self.columns.index(column)]
+
+    def yeartable(self, column):
+        return Ityt.YearTable(self.read(column), column)
+
+
+# one-off migration of pickled YearTable classes ( 'YearTable_class' directory ) into a ColumnStore
+def pickle_to_store(yt_class_dir, store):
+    for i in sorted(os.listdir(yt_class_dir)):
+        if i.endswith('.pkl'):
+            store.write(i.split('.')[0], pickle_read(yt_class_dir + i).yt)
+    return store
+
+
 # separator checker of txt file
 # ' \t ' -> 1
 #  ', ' -> 0
+# only the first line is read, so multi-GB exports are not loaded to find the separator
 def sep_checker(filename):
-    output = open(filename)
-    s = output.readlines()
-    if '\t' in s[len(s) - 1]:
+    with open(filename) as output:
+        s = output.readline()
+    if '\t' in s:
         return 1
     else:
         return 0
@@ -126,23 +204,61 @@ def flag_maker(cleaned_data_dir, pd_pkl_list):
 # accumulator : accumulator of YearTable data
 # output is DataFrame that has 1 column sumed by muti columns.
 # write DataFrame into current directory
-def accumulator(cycle, flag_list, cleaned_data_dir, pd_pkl_list, df_name):
-    df = pd.DataFrame(np.zeros(cycle))
+# every cleaned pickle is read once and its selected columns are added into one running vector
+# store : ColumnStore, if given the result is written as column df_name instead of a pickle
+def accumulator(cycle, flag_list, cleaned_data_dir, pd_pkl_list, df_name, store=None):
+    total = np.zeros(cycle)
     for i in range(len(flag_list)):
         print('%d / %d   processing ...' % (i, len(flag_list)))
         if len(flag_list[i]) == 0:
             pass
         else:
-            for j in flag_list[i]:
-                j = int(j)
-                df = pd.concat([df, pickle_read(cleaned_data_dir + pd_pkl_list[i]).ix[:, j]], axis=1)
-    pickle_write(df.sum(axis=1), df_name)
+            target_column = [int(j) for j in flag_list[i]]
+            values = pickle_read(cleaned_data_dir + pd_pkl_list[i]).iloc[:cycle, target_column].values
+            total[:values.shape[0]] += np.nan_to_num(values).sum(axis=1)
+    yt_writer(total, df_name, store)
+
+
+# streaming version of datacleaner + accumulator for raw CSV / TSV exports
+# raw files are read chunk by chunk ( only the selected columns ), never fully in memory
+# rows after cycle are ignored and missing values count as 0. ( same as datacleaner )
+# raw_list : raw file names in the same order as flag_list
+# chunksize : number of rows per chunk
+def accumulator_raw(cycle, flag_list, data_loc_raw, raw_list, df_name, store=None, chunksize=100000):
+    total = np.zeros(cycle)
+    for i in range(len(flag_list)):
+        print('%d / %d   processing ...' % (i, len(flag_list)))
+        if len(flag_list[i]) == 0:
+            pass
+        else:
+            target_column = [int(j) for j in flag_list[i]]
+            if sep_checker(data_loc_raw + raw_list[i]):
+                reader = pd.read_table(data_loc_raw + raw_list[i], usecols=target_column, chunksize=chunksize)
+            else:
+                reader = pd.read_csv(data_loc_raw + raw_list[i], usecols=target_column, chunksize=chunksize)
+            row = 0
+            for chunk in reader:
+                if row >= cycle:
+                    break
+                values = chunk.values[:cycle - row]
+                total[row:row + values.shape[0]] += np.nan_to_num(values).sum(axis=1)
+                row += values.shape[0]
+    yt_writer(total, df_name, store)
+
+
+# accumulated year table writer : pickled Series ( default ) or column of ColumnStore
+def yt_writer(total, df_name, store=None):
+    if store is None:
+        pickle_write(pd.Series(total), df_name)
+    else:
+        store.write(df_name, total)
 
 
 # Making YearTable class
 # pickle YearTable class into YearTable_class directry 'YearTable_class'
 # making CSV DataFrame from pickled DataFrame 'YearTable_csv/raw_csv'
-def yt_class_maker(accumulated_dir, df_name):
+# store : ColumnStore, if given the year table is written as column df_name instead of a YearTable pickle
+def yt_class_maker(accumulated_dir, df_name, store=None):
     pd_pkl_list = os.listdir(accumulated_dir)
 
     if 'YearTable_class' in pd_pkl_list:
@@ -162,8 +278,12 @@ def yt_class_maker(accumulated_dir, df_name):
 
     if df_name + '.pkl' in pd_pkl_list:
         temp = pickle_read(accumulated_dir + df_name + '.pkl')
-        # making pickle object of YearTable class
-        pickle_write(Ityt.YearTable(np.array(temp), df_name), accumulated_dir + 'YearTable_class/' + df_name + '.pkl')
+        if store is None:
+            # making pickle object of YearTable class
+            pickle_write(Ityt.YearTable(np.array(temp), df_name),
+                         accumulated_dir + 'YearTable_class/' + df_name + '.pkl')
+        else:
+            store.write(df_name, np.array(temp))
         # making CSV data from pandas DataFrame
         temp.to_csv(accumulated_dir + 'YearTable_csv/raw_csv/' + df_name + '.csv', sep='\t', index=False)
     else:
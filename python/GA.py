@@ -56,8 +56,34 @@ def mutOpt(individual, weight_list, indpb):
     return individual,
 
 
+# fitness of a list of individuals
+# identical individuals ( e.g. cloned by selection ) are evaluated once through cache
+# batch_func : vectorized fitness, batch_func(population matrix, ngen_count) -> array
+# pool : process pool used as map when batch_func is not given
+def evaluate_population(individuals, evaluate, ngen_count, cache, batch_func=None, pool=None):
+    keys = [tuple(ind) for ind in individuals]
+    todo = []
+    for k in keys:
+        if k not in cache:
+            cache[k] = None  # placeholder, filled below
+            todo.append(k)
+    if todo:
+        if batch_func is not None:
+            fits = [(float(v),) for v in batch_func(np.array(todo), ngen_count)]
+        elif pool is not None:
+            fits = pool.map(evaluate, [list(k) for k in todo])
+        else:
+            fits = map(evaluate, [list(k) for k in todo])
+        cache.update(zip(todo, fits))
+    for ind, k in zip(individuals, keys):
+        ind.fitness.values = cache[k]
+
+
 # GA main routine
-def ga_main(bnds, n_pop, obj_func_ga, obj_func_ga_initial, cxpb, indpb, mutpb, ngen):
+# batch_func, pool : see evaluate_population
+# plot : live plot of the elites ( set False for headless runs )
+def ga_main(bnds, n_pop, obj_func_ga, obj_func_ga_initial, cxpb, indpb, mutpb, ngen, batch_func=None, pool=None,
+            plot=True):
     global fits_g
     toolbox = base.Toolbox()
     pop = init_pop(n_pop, bnds.T, toolbox)
@@ -66,13 +92,15 @@ def ga_main(bnds, n_pop, obj_func_ga, obj_func_ga_initial, cxpb, indpb, mutpb, n
     toolbox.register('mutate', mutOpt, weight_list=bnds, indpb=indpb)
     toolbox.register('evaluate', obj_func_ga_initial)
 
-    plt.ion()
-    fig, ax = plt.subplots(1, 1)
-    fits = map(toolbox.evaluate, pop)
+    if plot:
+        plt.ion()
+        fig, ax = plt.subplots(1, 1)
+    evaluate_population(pop, toolbox.evaluate, 0, {}, batch_func, pool)
     fits_0 = tools.selBest(pop, 5)
-    for i in fits_0:
-        plt.plot(obj_func_ga_initial(i), 'ro', ms=4)
-    plt.draw()
+    if plot:
+        for i in fits_0:
+            plt.plot(i.fitness.values[0], 'ro', ms=4)
+        plt.draw()
 
     for g in range(ngen):
 
@@ -101,21 +129,21 @@ def ga_main(bnds, n_pop, obj_func_ga, obj_func_ga_initial, cxpb, indpb, mutpb, n
                 toolbox.mutate(mutant)
                 del mutant.fitness.values
 
+        # penalty depends on the generation, so the cache lives for one generation
         invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fits = map(toolbox.evaluate, invalid_ind)
-        for ind, fit in zip(invalid_ind, fits):
-            ind.fitness.values = fit
+        evaluate_population(invalid_ind, toolbox.evaluate, g + 1, {}, batch_func, pool)
 
         pop[:] = offspring
-        fits_g = tools.selBest(pop, 5)
-        for i in fits_g:
-            plt.plot(g + 1, obj_func_ga_initial(i), 'ro', ms=4)
-        plt.grid(True)
-        plt.title('GA optimization : 5 elites plotted ')
-        plt.xlabel('Generation')
-        plt.ylabel('non-constrained \n objective function')
-        plt.draw()
+        fits_g = tools.selBest(pop, 5)  # elites keep their fitness, no re-evaluation
+        if plot:
+            for i in fits_g:
+                plt.plot(g + 1, i.fitness.values[0], 'ro', ms=4)
+            plt.grid(True)
+            plt.title('GA optimization : 5 elites plotted ')
+            plt.xlabel('Generation')
+            plt.ylabel('objective function')
+            plt.draw()
         print('%d th generation evolved' % g),
-        print(' : obj func = %f' % obj_func_ga_initial(fits_g[4]))
+        print(' : obj func = %f' % fits_g[4].fitness.values[0])
 
     return fits_g
@@ -22,10 +22,12 @@ from pandas import DataFrame
 from scipy.optimize import minimize
 import sys
 import pickle
+from collections import OrderedDict
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import scale
 from InsuranceTools.YearTable import peril_allocation, perillist_to_perilclass, peril_accumulator
 from InsuranceTools.DataConverter import pickle_write, pickle_read
+from InsuranceTools.RiskMetric import RiskMetric
 
 
 #   [ w_1, w_2, ... , w_n ]*[ Peril_class_1, Peril_class_2, ... , Peril_class_n ] -> MCbase_class [cycle row * 1 col]
@@ -36,14 +38,22 @@ from InsuranceTools.DataConverter import pickle_write, pickle_read
 #   return : MCbase object summed up to one Peril
 class MCbase(object):
     def __init__(self, peril_class_list, w, cycle):
-        self.yt = peril_allocation(peril_class_list, w, cycle).yt
-        self.name = peril_allocation(peril_class_list, w, cycle).name
-        self.temp = np.sort(self.yt, axis=0)  # sorted YearTable
+        allocated = peril_allocation(peril_class_list, w, cycle)
+        self.yt = allocated.yt
+        self.name = allocated.name
+        self.engine = RiskMetric(self.yt)  # partial selection, cached per object
         self.alpha = 0.99  # default = 0.99 (100yr)
         self.var_n = 0  # VaR number
         self.var_m = 0  # for number of trunTVaR
         self.indexer = 0  # event index of each peril's YLQT number after sorted
 
+    # sorted YearTable, only built when explicitly asked for
+    @property
+    def temp(self):
+        if not hasattr(self, '_temp'):
+            self._temp = np.sort(self.yt, axis=0)
+        return self._temp
+
     def alpha_check(self, alpha):
 
         if alpha >= 1.:
@@ -55,31 +65,136 @@ class MCbase(object):
             self.alpha = alpha
 
     def mean(self):
-        return np.mean(self.yt, axis=0)
+        return self.engine.mean()
 
     def var(self, alpha):
         self.alpha_check(alpha)
-        self.var_n = np.int(np.floor(self.yt.shape[0] * alpha))
-        return self.temp[self.var_n]
+        self.var_n = self.engine.index(alpha)
+        return self.engine.var(alpha)
 
     def xvar(self, alpha):
         return self.var(alpha) - self.mean()
 
     def tvar(self, alpha):
         self.alpha_check(alpha)
-        self.var_n = np.int(np.floor(self.yt.shape[0] * alpha))
-        return np.mean(self.temp[self.var_n:self.yt.shape[0]], axis=0)
+        self.var_n = self.engine.index(alpha)
+        return self.engine.tvar(alpha)
 
     def xtvar(self, alpha):
         self.alpha_check(alpha)
-        return self.tvar(alpha) - np.mean(self.yt, axis=0)
+        return self.tvar(alpha) - self.mean()
 
     def truntvar(self, alpha, beta):
         self.alpha_check(alpha)
         self.alpha_check(beta)
-        self.var_n = np.int(np.floor(self.yt.shape[0] * alpha))
-        self.var_m = np.int(np.floor(self.yt.shape[0] * beta))
-        return np.mean(self.temp[self.var_n:self.var_m], axis=0)
+        self.var_n = self.engine.index(alpha)
+        self.var_m = self.engine.index(beta)
+        return self.engine.truntvar(alpha, beta)
+
+    # every metric for a list of alpha in one selection pass
+    def metrics(self, alphas, beta=None):
+        for a in alphas:
+            self.alpha_check(a)
+        if beta is not None:
+            self.alpha_check(beta)
+        return self.engine.metrics(alphas, beta)
+
+
+#   all lines of business stacked once into a (cycle x lines) matrix
+#   aggregate year table for an allocation w is a single mat-vec : yt.dot(w)
+#   peril_class_list : list of class Peril ( one per line of business )
+#   cycle : realization number
+#   cache_size : number of recent (w, alpha) kept ( optimizers rarely repeat a float w )
+class MCstack(object):
+    def __init__(self, peril_class_list, cycle, cache_size=4):
+        self.name = [i.name for i in peril_class_list]
+        self.yt = np.column_stack([np.ravel(i.yt)[:cycle] for i in peril_class_list])
+        self.col_mean = np.mean(self.yt, axis=0)  # mean is linear in w
+        self.cache = OrderedDict()  # (tuple(w), alpha) -> tvar, least recently used first
+        self.cache_size = cache_size
+
+    def aggregate(self, w):
+        return self.yt.dot(np.asarray(w, dtype=float))
+
+    def mean(self, w):
+        return self.col_mean.dot(np.asarray(w, dtype=float))
+
+    def tvar(self, w, alpha):
+        key = (tuple(w), alpha)
+        if key in self.cache:
+            value = self.cache.pop(key)
+        else:
+            value = RiskMetric(self.aggregate(w)).tvar(alpha)
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+    def xtvar(self, w, alpha):
+        return self.tvar(w, alpha) - self.mean(w)
+
+    # W : population of allocations [ n_pop row * lines col ]
+    # chunk : number of allocations aggregated per matrix product
+    def tvar_batch(self, W, alpha, chunk=64):
+        W = np.atleast_2d(np.asarray(W, dtype=float))
+        ret = np.empty(W.shape[0])
+        for i in range(0, W.shape[0], chunk):
+            # one (cycle x chunk) product, partitioned column-wise in one call
+            ret[i:i + chunk] = RiskMetric(self.yt.dot(W[i:i + chunk].T)).tvar(alpha)
+        return ret
+
+    def mean_batch(self, W):
+        return np.atleast_2d(np.asarray(W, dtype=float)).dot(self.col_mean)
+
+    def xtvar_batch(self, W, alpha, chunk=64):
+        return self.tvar_batch(W, alpha, chunk) - self.mean_batch(W)
+
+
+#   incremental evaluator of an allocation : replaces
+#   Uwg(MCbase(Premium_list, w, cycle), MCbase(Loss_list, w, cycle), MCbase(Expense_list, w, cycle))
+#   uwg = premium - loss - expense ,  xtvar is taken on the aggregated loss
+#   rorac = uwg_mean / xtvar
+class MCallocation(object):
+    def __init__(self, premium_list, loss_list, expense_list, cycle, alpha=0.99):
+        self.premium = MCstack(premium_list, cycle)
+        self.loss = MCstack(loss_list, cycle)
+        self.expense = MCstack(expense_list, cycle)
+        self.alpha = alpha
+        self.uwg_col_mean = self.premium.col_mean - self.loss.col_mean - self.expense.col_mean
+        self.baseline_dict = {}  # (tuple(w), alpha) -> evaluate(w)
+
+    def uwg(self, w):
+        return self.premium.aggregate(w) - self.loss.aggregate(w) - self.expense.aggregate(w)
+
+    def uwg_mean(self, w):
+        return self.uwg_col_mean.dot(np.asarray(w, dtype=float))
+
+    def xtvar(self, w, alpha=None):
+        return self.loss.xtvar(w, alpha or self.alpha)
+
+    def rorac(self, w, alpha=None):
+        return self.uwg_mean(w) / self.xtvar(w, alpha)
+
+    def evaluate(self, w, alpha=None):
+        xtvar = self.xtvar(w, alpha)
+        uwg_mean = self.uwg_mean(w)
+        return {'uwg_mean': uwg_mean, 'xtvar': xtvar, 'rorac': uwg_mean / xtvar}
+
+    # metrics of a fixed allocation ( e.g. w_initial ) computed once
+    def baseline(self, w, alpha=None):
+        key = (tuple(w), alpha or self.alpha)
+        if key not in self.baseline_dict:
+            self.baseline_dict[key] = self.evaluate(w, alpha)
+        return self.baseline_dict[key]
+
+    # whole swarm / population in one matrix product per chunk
+    # W : [ n_pop row * lines col ]
+    # return : dict of arrays [ n_pop ]
+    def evaluate_batch(self, W, alpha=None, chunk=64):
+        W = np.atleast_2d(np.asarray(W, dtype=float))
+        xtvar = self.loss.xtvar_batch(W, alpha or self.alpha, chunk)
+        uwg_mean = W.dot(self.uwg_col_mean)
+        return {'uwg_mean': uwg_mean, 'xtvar': xtvar, 'rorac': uwg_mean / xtvar}
 
 
 def constraints(const, w):
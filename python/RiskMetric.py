@@ -0,0 +1,103 @@
+"""
+   Comments :   Risk metric engine for year tables
+
+   Arguments : year table ( numpy array, realizations along axis 0 )
+
+   Return : mean, VaR, TVaR, truncated TVaR
+
+ ---------------------------------------------------------------------------------
+   Date        Developer       Action
+
+
+"""
+
+import bisect
+import numpy as np
+
+
+#   order statistics by selection ( np.partition ) instead of a full np.sort
+#   yt : year table, rows are realizations ( any number of columns )
+#   every requested order statistic is 'pinned' : after pinning k, self.part[k] is the
+#   k-th smallest value and every element before ( after ) it is smaller ( larger ),
+#   so tail and band means are plain means over slices of self.part.
+#   pinning a new k only re-partitions the segment between its pinned neighbours.
+class RiskMetric(object):
+    def __init__(self, yt):
+        self.yt = np.asarray(yt)
+        self.n = self.yt.shape[0]
+        self.part = None  # partially ordered copy of yt
+        self.pinned = []  # sorted list of order statistics already in place
+        self.cache = {}  # (a, b) -> mean of part[a:b]
+        self.mean_value = None
+
+    def index(self, alpha):
+        # e.g. alpha = 0.99, n = 10000 -> 9900 ( same rule as MCbase )
+        return int(np.floor(self.n * alpha))
+
+    def pin(self, ks):
+        ks = sorted(set(int(k) for k in ks if 0 <= k < self.n) - set(self.pinned))
+        if not ks:
+            return
+        if self.part is None:
+            # one selection pass for all requested quantiles
+            self.part = np.partition(self.yt, ks, axis=0)
+        else:
+            # group new indices by the pinned segment they fall into
+            segments = {}
+            for k in ks:
+                i = bisect.bisect_left(self.pinned, k)
+                lo = self.pinned[i - 1] + 1 if i > 0 else 0
+                hi = self.pinned[i] if i < len(self.pinned) else self.n
+                segments.setdefault((lo, hi), []).append(k - lo)
+            for (lo, hi), kth in segments.items():
+                self.part[lo:hi].partition(kth, axis=0)
+        self.pinned = sorted(self.pinned + ks)
+
+    def mean(self):
+        if self.mean_value is None:
+            self.mean_value = np.mean(self.yt, axis=0)
+        return self.mean_value
+
+    def order_statistic(self, k):
+        self.pin([k])
+        return self.part[int(k)]
+
+    def band_mean(self, a, b):
+        # mean of the a-th ... (b-1)-th smallest values
+        b = min(b, self.n)
+        if (a, b) not in self.cache:
+            self.pin([a, b])
+            self.cache[(a, b)] = np.mean(self.part[a:b], axis=0)
+        return self.cache[(a, b)]
+
+    def var(self, alpha):
+        return self.order_statistic(self.index(alpha))
+
+    def xvar(self, alpha):
+        return self.var(alpha) - self.mean()
+
+    def tvar(self, alpha):
+        return self.band_mean(self.index(alpha), self.n)
+
+    def xtvar(self, alpha):
+        return self.tvar(alpha) - self.mean()
+
+    def truntvar(self, alpha, beta):
+        return self.band_mean(self.index(alpha), self.index(beta))
+
+    # all metrics for several levels with a single selection pass
+    # alphas : list of alpha
+    # return : dict of metric name -> list ( one entry per alpha )
+    def metrics(self, alphas, beta=None):
+        ks = [self.index(a) for a in alphas]
+        if beta is not None:
+            ks.append(self.index(beta))
+        self.pin(ks)
+        ret = {'mean': self.mean(),
+               'VaR': [self.var(a) for a in alphas],
+               'xVaR': [self.xvar(a) for a in alphas],
+               'TVaR': [self.tvar(a) for a in alphas],
+               'xTVaR': [self.xtvar(a) for a in alphas]}
+        if beta is not None:
+            ret['trun_TVaR'] = [self.truntvar(a, beta) for a in alphas]
+        return ret
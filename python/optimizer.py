@@ -16,7 +16,7 @@ from pyOpt import ALPSO, ALHSO
 import InsuranceTools.MC as ITMC
 import InsuranceTools.YearTable as Ityt
 from InsuranceTools.YearTable import YearTable
-from InsuranceTools.DataConverter import pickle_read, pickle_write
+from InsuranceTools.DataConverter import pickle_read, pickle_write, ColumnStore, pickle_to_store
 import InsuranceTools.GA as ITGA
 from multiprocessing import Process, Pool, cpu_count, current_process, Lock, Pipe
 
@@ -37,16 +37,17 @@ accumulated_dir_risk_metric = './risk_metrics/' + work_dir_name
 global_opt_result = './global_opt_result/' + work_dir_name
 local_opt_result = './local_opt_result/' + work_dir_name
 cycle = 100000
+yt_dtype = 'float64'  # 'float32' halves the year table store
 alpha = 0.995  # 200yr --> 0.995      100yr --> 0.99
 beta = 0.998
 MC_cycle = 2000
 num_clusters = 5
-global_const = [lambda w: ITMC.MCbase(USEQ_list, w, cycle).tvar(alpha) / SGO_USEQ_limit < 1.1,
-                lambda w: ITMC.MCbase(USWS_list, w, cycle).tvar(alpha) / SGO_USWS_limit < 1.1,
-                lambda w: ITMC.MCbase(EUWS_list, w, cycle).tvar(alpha) / SGO_EUWS_limit < 1.1,
-                lambda w: ITMC.MCbase(JPWS_list, w, cycle).tvar(alpha) / SGO_JPWS_limit < 1.1,
-                lambda w: ITMC.MCbase(JPEQ_list, w, cycle).tvar(alpha) / SGO_JPEQ_limit < 1.1,
-                lambda w: ITMC.MCbase(RoW_list, w, cycle).tvar(alpha) / SGO_RoW_limit < 1.1
+global_const = [lambda w: USEQ_stack.tvar(w, alpha) / SGO_USEQ_limit < 1.1,
+                lambda w: USWS_stack.tvar(w, alpha) / SGO_USWS_limit < 1.1,
+                lambda w: EUWS_stack.tvar(w, alpha) / SGO_EUWS_limit < 1.1,
+                lambda w: JPWS_stack.tvar(w, alpha) / SGO_JPWS_limit < 1.1,
+                lambda w: JPEQ_stack.tvar(w, alpha) / SGO_JPEQ_limit < 1.1,
+                lambda w: RoW_stack.tvar(w, alpha) / SGO_RoW_limit < 1.1
                 ]
 weight_list = list(pd.read_table('weight.txt').columns)  # setting of Optimized Variable's name
 w_initial = [1.] * len(weight_list)
@@ -54,13 +55,19 @@ w_lower = list(pd.read_table('weight.txt').ix[0, :])
 w_upper = list(pd.read_table('weight.txt').ix[1, :])
 bnds = np.array([w_lower, w_upper])
 
+# columnar store of all year tables ( mmap, columns are loaded lazily )
+# the first run converts the pickled YearTable classes into the store
+yt_store = ColumnStore(accumulated_dir, dtype=yt_dtype)
+if len(yt_store) == 0:
+    pickle_to_store(accumulated_dir + 'YearTable_class/', yt_store)
+
 Premium_list = []
 Loss_list = []
 Expense_list = []
 for i in weight_list:
-    Premium_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_P.pkl'))
-    Loss_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_L.pkl'))
-    Expense_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_E.pkl'))
+    Premium_list.append(yt_store.yeartable(i + '_P'))
+    Loss_list.append(yt_store.yeartable(i + '_L'))
+    Expense_list.append(yt_store.yeartable(i + '_E'))
 
 USEQ_list = []
 USWS_list = []
@@ -69,19 +76,31 @@ JPWS_list = []
 JPEQ_list = []
 RoW_list = []
 for i in weight_list:
-    USEQ_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_USEQ.pkl'))
-    USWS_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_USWS.pkl'))
-    EUWS_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_EUWS.pkl'))
-    JPWS_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_JPWS.pkl'))
-    JPEQ_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_JPEQ.pkl'))
-    RoW_list.append(pickle_read(accumulated_dir + 'YearTable_class/' + i + '_RoW.pkl'))
-
-SGO_USEQ_limit = ITMC.MCbase(USEQ_list, w_initial, cycle).tvar(alpha)
-SGO_USWS_limit = ITMC.MCbase(USWS_list, w_initial, cycle).tvar(alpha)
-SGO_EUWS_limit = ITMC.MCbase(EUWS_list, w_initial, cycle).tvar(alpha)
-SGO_JPWS_limit = ITMC.MCbase(JPWS_list, w_initial, cycle).tvar(alpha)
-SGO_JPEQ_limit = ITMC.MCbase(JPEQ_list, w_initial, cycle).tvar(alpha)
-SGO_RoW_limit = ITMC.MCbase(RoW_list, w_initial, cycle).tvar(alpha)
+    USEQ_list.append(yt_store.yeartable(i + '_USEQ'))
+    USWS_list.append(yt_store.yeartable(i + '_USWS'))
+    EUWS_list.append(yt_store.yeartable(i + '_EUWS'))
+    JPWS_list.append(yt_store.yeartable(i + '_JPWS'))
+    JPEQ_list.append(yt_store.yeartable(i + '_JPEQ'))
+    RoW_list.append(yt_store.yeartable(i + '_RoW'))
+
+# year tables stacked once [ cycle row * lines col ] , every allocation is a mat-vec
+evaluator = ITMC.MCallocation(Premium_list, Loss_list, Expense_list, cycle, alpha)
+USEQ_stack = ITMC.MCstack(USEQ_list, cycle)
+USWS_stack = ITMC.MCstack(USWS_list, cycle)
+EUWS_stack = ITMC.MCstack(EUWS_list, cycle)
+JPWS_stack = ITMC.MCstack(JPWS_list, cycle)
+JPEQ_stack = ITMC.MCstack(JPEQ_list, cycle)
+RoW_stack = ITMC.MCstack(RoW_list, cycle)
+peril_stacks = [USEQ_stack, USWS_stack, EUWS_stack, JPWS_stack, JPEQ_stack, RoW_stack]
+
+SGO_USEQ_limit = USEQ_stack.tvar(w_initial, alpha)
+SGO_USWS_limit = USWS_stack.tvar(w_initial, alpha)
+SGO_EUWS_limit = EUWS_stack.tvar(w_initial, alpha)
+SGO_JPWS_limit = JPWS_stack.tvar(w_initial, alpha)
+SGO_JPEQ_limit = JPEQ_stack.tvar(w_initial, alpha)
+SGO_RoW_limit = RoW_stack.tvar(w_initial, alpha)
+SGO_limits = np.array([SGO_USEQ_limit, SGO_USWS_limit, SGO_EUWS_limit, SGO_JPWS_limit, SGO_JPEQ_limit,
+                       SGO_RoW_limit])
 
 ### tuple format
 ### cons = ({'type': 'ineq', 'fun': lambda x:  x[0] - 2 * x[1] + 2},
@@ -93,12 +112,12 @@ SGO_RoW_limit = ITMC.MCbase(RoW_list, w_initial, cycle).tvar(alpha)
                {'type': 'ineq', 'fun': lambda w: -ITMC.MCbase(JPWS_list, w, cycle).tvar(alpha) + SGO_JPWS_limit},
                {'type': 'ineq', 'fun': lambda w: -ITMC.MCbase(JPEQ_list, w, cycle).tvar(alpha) + SGO_JPEQ_limit},
                {'type': 'ineq', 'fun': lambda w: -ITMC.MCbase(RoW_list, w, cycle).tvar(alpha) + SGO_RoW_limit})"""
-local_const = ({'type': 'eq', 'fun': lambda w: -ITMC.MCbase(USEQ_list, w, cycle).tvar(alpha) + SGO_USEQ_limit},
-               {'type': 'eq', 'fun': lambda w: -ITMC.MCbase(USWS_list, w, cycle).tvar(alpha) + SGO_USWS_limit},
-               {'type': 'eq', 'fun': lambda w: -ITMC.MCbase(EUWS_list, w, cycle).tvar(alpha) + SGO_EUWS_limit},
-               {'type': 'eq', 'fun': lambda w: -ITMC.MCbase(JPWS_list, w, cycle).tvar(alpha) + SGO_JPWS_limit},
-               {'type': 'eq', 'fun': lambda w: -ITMC.MCbase(JPEQ_list, w, cycle).tvar(alpha) + SGO_JPEQ_limit},
-               {'type': 'eq', 'fun': lambda w: -ITMC.MCbase(RoW_list, w, cycle).tvar(alpha) + SGO_RoW_limit})
+local_const = ({'type': 'eq', 'fun': lambda w: -USEQ_stack.tvar(w, alpha) + SGO_USEQ_limit},
+               {'type': 'eq', 'fun': lambda w: -USWS_stack.tvar(w, alpha) + SGO_USWS_limit},
+               {'type': 'eq', 'fun': lambda w: -EUWS_stack.tvar(w, alpha) + SGO_EUWS_limit},
+               {'type': 'eq', 'fun': lambda w: -JPWS_stack.tvar(w, alpha) + SGO_JPWS_limit},
+               {'type': 'eq', 'fun': lambda w: -JPEQ_stack.tvar(w, alpha) + SGO_JPEQ_limit},
+               {'type': 'eq', 'fun': lambda w: -RoW_stack.tvar(w, alpha) + SGO_RoW_limit})
 
 
 # CUS, DF, NAF, TPEx, SINGA, TPR, UKS, GS, TPQS, SCRE, SJNKA_LP, SJNKE, SompoOO
@@ -112,8 +131,7 @@ NetPremium_coeff = 1.0470630
 
 
 def obj_func(w1):
-    return (Ityt.Uwg(ITMC.MCbase(Premium_list, w1, cycle), ITMC.MCbase(Loss_list, w1, cycle),
-                     ITMC.MCbase(Expense_list, w1, cycle)).uwg_mean() - (Risk_charge * np.array(w1)).sum()) * -1. / total_capital
+    return (evaluator.uwg_mean(w1) - (Risk_charge * np.array(w1)).sum()) * -1. / total_capital
 
 
 i_SLSQP = 1
@@ -154,17 +172,12 @@ alpso_weight = [0.] * 7 + [0.2] * 110
 
 def obj_func_PSO(w1):
     w1 = list(np.array(w1) * np.array(alpso_weight) + 1.)
-    f = Ityt.Uwg(ITMC.MCbase(Premium_list, w1, cycle), ITMC.MCbase(Loss_list, w1, cycle),
-                 ITMC.MCbase(Expense_list, w1, cycle)).rorac(alpha) * -1.
+    ret = evaluator.evaluate(w1)  # one mat-vec and one partial selection
+    xtvar_initial = evaluator.baseline(w_initial)['xtvar']  # computed only once
+    f = ret['rorac'] * -1.
     g = [0.] * 2
-    g[0] = Ityt.Uwg(ITMC.MCbase(Premium_list, w1, cycle), ITMC.MCbase(Loss_list, w1, cycle),
-                    ITMC.MCbase(Expense_list, w1, cycle)).xtvar(alpha) - Ityt.Uwg(
-        ITMC.MCbase(Premium_list, w_initial, cycle), ITMC.MCbase(Loss_list, w_initial, cycle),
-        ITMC.MCbase(Expense_list, w_initial, cycle)).xtvar(alpha)
-    g[1] = 0.9 * Ityt.Uwg(ITMC.MCbase(Premium_list, w_initial, cycle), ITMC.MCbase(Loss_list, w_initial, cycle),
-                          ITMC.MCbase(Expense_list, w_initial, cycle)).xtvar(alpha) - Ityt.Uwg(
-        ITMC.MCbase(Premium_list, w1, cycle), ITMC.MCbase(Loss_list, w1, cycle),
-        ITMC.MCbase(Expense_list, w1, cycle)).xtvar(alpha)
+    g[0] = ret['xtvar'] - xtvar_initial
+    g[1] = 0.9 * xtvar_initial - ret['xtvar']
     fail = 0
     print 'obj_value : ', f, ' variable : ', w1
     print 'penalty(negative value is valid) : ', g[0], g[1]
@@ -236,10 +249,7 @@ beta_JandH = 1.
 # In GA algo, applying maximazation method
 # todo NOTE : DO NOT FORGET ' , ' mark
 def GA_const_JandH(w, C_JandH, alpha_JandH, ngen_count, feasible, adjuster):
-    xtvar_check = Ityt.Uwg(ITMC.MCbase(Premium_list, w_initial, cycle), ITMC.MCbase(Loss_list, w_initial, cycle),
-                           ITMC.MCbase(Expense_list, w_initial, cycle)).xtvar(alpha) - Ityt.Uwg(
-        ITMC.MCbase(Premium_list, w, cycle), ITMC.MCbase(Loss_list, w, cycle),
-        ITMC.MCbase(Expense_list, w, cycle)).xtvar(alpha)
+    xtvar_check = evaluator.baseline(w_initial)['xtvar'] - evaluator.xtvar(w)
     if abs(xtvar_check) < feasible:
         feasible_ret = 0
     else:
@@ -249,17 +259,22 @@ def GA_const_JandH(w, C_JandH, alpha_JandH, ngen_count, feasible, adjuster):
 
 
 def obj_func_ga(w1, ngen_count):
-    return Ityt.Uwg(ITMC.MCbase(Premium_list, w1, cycle), ITMC.MCbase(Loss_list, w1, cycle),
-                    ITMC.MCbase(Expense_list, w1, cycle)).rorac(alpha) - GA_const_JandH(w1, C_JandH,
-                                                                                        alpha_JandH,
-                                                                                        ngen_count, feasible,
-                                                                                        adjuster),
+    return evaluator.rorac(w1) - GA_const_JandH(w1, C_JandH, alpha_JandH, ngen_count, feasible, adjuster),
 
 
 # no constraint for initial generation
 def obj_func_ga_initial(w1):
-    return Ityt.Uwg(ITMC.MCbase(Premium_list, w1, cycle), ITMC.MCbase(Loss_list, w1, cycle),
-                    ITMC.MCbase(Expense_list, w1, cycle)).rorac(alpha),
+    return evaluator.rorac(w1),
+
+
+# whole population at once : W [ n_pop row * lines col ], ngen_count = 0 -> no constraint
+def obj_func_ga_batch(W, ngen_count):
+    ret = evaluator.evaluate_batch(W)
+    if ngen_count == 0:
+        return ret['rorac']
+    xtvar_check = np.abs(evaluator.baseline(w_initial)['xtvar'] - ret['xtvar'])
+    penalty = np.where(xtvar_check < feasible, 0., (C_JandH * ngen_count) ** alpha_JandH * xtvar_check)
+    return ret['rorac'] - penalty * adjuster
 
 
 #
@@ -299,22 +314,24 @@ if __name__ == '__main__':
             axes[1].ticklabel_format(style='sci', axis='y', scilimits=(0, 0))
             axes[1].tick_params(labelsize=9)
             result_w = []  # result of allocation
-            result_uwg = []  # Uwg class list
             result_uwg_mean = []
             result_xtvar = []
 
+            # the whole sample is checked and evaluated in batches of matrix products
+            w_sample = np.array([ITMC.weight_gen(w_lower, w_upper) for i in range(MC_cycle)])
+            feasible_mask = np.ones(MC_cycle, dtype=bool)
+            for stack, limit in zip(peril_stacks, SGO_limits):
+                feasible_mask &= stack.tvar_batch(w_sample, alpha) / limit < 1.1
+            batch_ret = evaluator.evaluate_batch(w_sample[feasible_mask])
+
+            j = 0
             for i in range(MC_cycle):
-                w = ITMC.weight_gen(w_lower, w_upper)
-                if ITMC.constraints(global_const, w):
+                if feasible_mask[i]:
+                    w = list(w_sample[i])
                     result_w.append(w)
-
-                    result_uwg.append(
-                        Ityt.Uwg(ITMC.MCbase(Premium_list, w, cycle), ITMC.MCbase(Loss_list, w, cycle),
-                                 ITMC.MCbase(Expense_list, w, cycle)))
-                    uwg_mean_temp = Ityt.Uwg(ITMC.MCbase(Premium_list, w, cycle), ITMC.MCbase(Loss_list, w, cycle), ITMC.MCbase(Expense_list, w, cycle)).uwg_mean()
-                    xtvar_temp = Ityt.peril_allocation(Loss_list, w, cycle).xtvar(alpha)
-
-                    xtvar_temp = Ityt.peril_allocation(Loss_list, w, cycle).xtvar(alpha)
+                    uwg_mean_temp = batch_ret['uwg_mean'][j]
+                    xtvar_temp = batch_ret['xtvar'][j]
+                    j += 1
                     result_uwg_mean.append(uwg_mean_temp)
                     result_xtvar.append(xtvar_temp)
                     print('%d th \t uwg_mean : %d \t\t XTVaR \t : %d' % (i + 1, int(uwg_mean_temp), int(xtvar_temp)))
@@ -336,15 +353,15 @@ if __name__ == '__main__':
             """
             print('-' * 100)
             print('Global Optimization by Genetic Algorithm')
-            ret_weight = ITGA.ga_main(bnds, n_pop, obj_func_ga, obj_func_ga_initial, cxpb, indpb, mutpb, ngen)
+            ret_weight = ITGA.ga_main(bnds, n_pop, obj_func_ga, obj_func_ga_initial, cxpb, indpb, mutpb, ngen,
+                                     batch_func=obj_func_ga_batch)
             print('-' * 100)
             print('Genetic Algorithm has ended. ')
             for i in ret_weight:
                 print i
                 print ('RORAC : %f' % obj_func_ga_initial(i))
                 print('xTVaR : '),
-                print Ityt.Uwg(ITMC.MCbase(Premium_list, i, cycle), ITMC.MCbase(Loss_list, i, cycle),
-                               ITMC.MCbase(Expense_list, i, cycle)).xtvar(alpha)
+                print evaluator.xtvar(i)
             pickle_write(ret_weight, global_opt_result + 'evolved_result.pkl')
 
         elif selector2 == '3':
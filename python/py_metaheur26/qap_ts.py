@@ -1,5 +1,6 @@
 import random
 from sys import maxint
+import numpy as np
 from graphtools import *
 Infinity = 1.e10000
 LOG = False	# whether or not to print intermediate solutions
@@ -9,12 +10,9 @@ LOG = False	# whether or not to print intermediate solutions
 #
 def mk_rnd_data(n, scale=10):
     """Make data for a random problem of size 'n'."""
-    f = {}      # for holding n x n flow matrix
-    d = {}      # for holding n x n distance matrix
-    
-    for i in range(n):
-        f[i,i] = 0
-        d[i,i] = 0
+    f = np.zeros((n,n), dtype=int)      # for holding n x n flow matrix
+    d = np.zeros((n,n), dtype=int)      # for holding n x n distance matrix
+
     for i in range(n-1):
         for j in range(i+1,n):
             f[i,j] = int(random.random() * scale)
@@ -41,17 +39,13 @@ def read_qap(filename):
     f.close()
 
     try:
-        pass
         data = data.split()
-        n = int(data.pop(0))
-        f = {}  # for n times n flow matrix
-        d = {}  # for n times n distance matrix
-        for i in range(n):
-            for j in range(n):
-                f[i,j] = int(data.pop(0))
-        for i in range(n):
-            for j in range(n):
-                d[i,j] = int(data.pop(0))
+        n = int(data[0])
+        if len(data) < 1 + 2*n*n:
+            raise IndexError
+        data = np.array(data[1:1 + 2*n*n], dtype=int)
+        f = data[:n*n].reshape(n,n)  # n times n flow matrix
+        d = data[n*n:].reshape(n,n)  # n times n distance matrix
     except IndexError:
         print "inconsistent data on QAP file", filename
         exit(-1)
@@ -61,25 +55,31 @@ def read_qap(filename):
 #
 # solution evaluation
 #
+def as_matrix(n,m):
+    """Return flow/distance data 'm' (n x n array or dict keyed by (i,j)) as a NumPy array."""
+    if isinstance(m, dict):
+        a = np.zeros((n,n), dtype=type(m[0,0]))
+        for (i,j) in m:
+            a[i,j] = m[i,j]
+        return a
+    return np.asarray(m)
+
+
 def evaluate__(n,f,d,pi):
     """Evaluate solution 'pi' from scratch."""
-    cost = 0
-    for i in range(n-1):
-        for j in range(i+1,n):
-            cost += f[i,j] * d[pi[i],pi[j]]
-    return cost*2
+    f, d = as_matrix(n,f), as_matrix(n,d)
+    pi = np.asarray(pi)
+    return np.triu(f * d[np.ix_(pi,pi)], 1).sum() * 2
 
 def evaluate(n,f,d,pi):
-    """Evaluate solution 'pi' and create additional cost information for incremental evaluation."""
-    delta = {}
-    for i in range(n):
-        for j in range(n):
-            delta[i,j] = 0
-            for k in range(n):
-                delta[i,j] += f[i,k] * d[j,pi[k]]
-    cost = 0
-    for i in range(n):
-        cost += delta[i,pi[i]]
+    """Evaluate solution 'pi' and create additional cost information for incremental evaluation.
+
+    delta[i,j] = sum_k f[i,k] * d[j,pi[k]], i.e., the cost of facility 'i' at location 'j'.
+    """
+    f, d = as_matrix(n,f), as_matrix(n,d)
+    pi = np.asarray(pi)
+    delta = np.dot(f, d[:,pi].T)
+    cost = delta[np.arange(n),pi].sum()
     return cost,delta
 
 
@@ -113,58 +113,51 @@ def diversify(pi):
     return pi
 
    
-def find_move(n,f,d,pi,delta,tabu,iteration):
-    """Find and return best non-tabu move."""
-    minmove = Infinity
-    istar,jstar = None,None
-    for i in range(n-1):
-        for j in range(i+1,n):
-            if tabu[i,pi[j]] > iteration or\
-               tabu[j,pi[i]] > iteration:
-                continue
+def move_values(n,f,d,pi,delta):
+    """Value of all swaps (i,j) as an n x n matrix (only i < j is meaningful).
 
-            move = delta[j, pi[i]] - delta[j, pi[j]] \
-                     + delta[i, pi[j]] - delta[i, pi[i]] \
-                     + 2 * f[i, j] * d[pi[i], pi[j]]
+    With P[a,b] = delta[a,pi[b]] and p its diagonal, swapping 'i' and 'j' changes half the cost by
+    P[j,i] - p[j] + P[i,j] - p[i] + 2 f[i,j] d[pi[i],pi[j]].
+    """
+    P = delta[:,pi]
+    p = P.diagonal()
+    return P + P.T - p[:,None] - p[None,:] + 2 * f * d[np.ix_(pi,pi)]
 
-            if move < minmove:
-                minmove = move
-                istar = i
-                jstar = j
-                # print "\t\t%d,%d\t%d:%f" % (i,j,mindelta,minmove)
 
-    if istar != None:
-        return istar, jstar, minmove*2
+def find_move(n,f,d,pi,delta,tabu,iteration):
+    """Find and return best non-tabu move."""
+    T = tabu[:,pi] > iteration      # T[i,j]: assigning location pi[j] to i is tabu
+    allowed = np.triu(~(T | T.T), 1)
+    if allowed.any():
+        M = move_values(n,f,d,pi,delta)
+        M = np.where(allowed, M, M.max() + 1)
+        istar, jstar = np.unravel_index(np.argmin(M), M.shape)  # first best, row-major as before
+        return istar, jstar, M[istar,jstar]*2
 
     print "blocked, no non-tabu move"
     # clean tabu list
-    for i in range(n):
-        for j in range(n):
-            tabu[i,j] = 0
+    tabu[:,:] = 0
     return find_move(n,f,d,pi,delta,tabu,iteration)
 
 
 def tabu_search(n,f,d,max_iter,length,report=None):
     """Construct a random solution, and do 'max_iter' tabu search iterations on it."""
+    f, d = as_matrix(n,f), as_matrix(n,d)
     tabulen = length
-    tabu = {}
-    for i in range(n):
-        for j in range(n):
-            tabu[i,j] = 0
-    pi = construct(n,f,d)
+    tabu = np.zeros((n,n))
+    pi = np.array(construct(n,f,d))
     cost,delta = evaluate(n,f,d,pi)
     bestcost = cost
+    bestsol = list(pi)
 
     if LOG: print "iteration", 0, "\tcost =", cost, ", best =", bestcost # , "\t", bestsol
     for it in range(max_iter):
         # search neighborhood
         istar, jstar, mindelta = find_move(n,f,d,pi,delta,tabu,it)
 
-        # update cost info
+        # update cost info: rank-1 update of the delta matrix
         cost += mindelta
-        for i in range(n):
-            for j in range(n):
-                delta[i,j] += (f[i,jstar] - f[i,istar]) * (d[j,pi[istar]] - d[j,pi[jstar]])
+        delta += np.outer(f[:,jstar] - f[:,istar], d[:,pi[istar]] - d[:,pi[jstar]])
 
         # update tabu info
         tabu[istar, pi[istar]] = it + tabulen
@@ -216,11 +209,8 @@ if __name__ == "__main__":
 
     # check if the instance is symmetric, otherwise exit
     try:
-        for i in range(n):
-            assert f[i,i] == 0 and d[i,i] == 0
-        for i in range(n-1):
-            for j in range(i+1,n):
-                assert f[i,j] == f[j,i] and d[i,j] == d[j,i]
+        assert (f.diagonal() == 0).all() and (d.diagonal() == 0).all()
+        assert (f == f.T).all() and (d == d.T).all()
     except AssertionError:
         print "instance is not symmetric, cannot use this program"
         exit(-1)
@@ -243,10 +233,10 @@ if __name__ == "__main__":
     print "n=", n
     print "flow:"
     for i in range(n):
-        print [f[i,j] for j in range(n)]
+        print list(f[i])
     print "distance:"
     for i in range(n):
-        print [d[i,j] for j in range(n)]
+        print list(d[i])
     print
 
     print "starting tabu search"
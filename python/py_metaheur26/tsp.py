@@ -14,8 +14,24 @@ This file contains a set of functions to illustrate:
 Copyright (c) by Joao Pedro PEDROSO and Mikio KUBO, 2007
 """
 
+import sys
 import math
 import random
+import time
+import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from collections import deque
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+DENSE_MAX = 5000  # above this number of cities, distances are evaluated on the fly
+K_NEAREST = 10    # length of the neighbor lists for large instances
 
 
 def distL2((x1, y1), (x2, y2)):
@@ -42,22 +58,81 @@ def distL1((x1, y1), (x2, y2)):
     return int(abs(x2 - x1) + abs(y2 - y1) + .5)
 
 
-def mk_matrix(coord, dist):
+def distL2_array(xy1, xy2):
+    """Vectorized 'distL2' between two broadcastable arrays of points (last axis is x,y)."""
+    diff = xy2 - xy1
+    return (np.sqrt((diff * diff).sum(axis=-1)) + .5).astype(int)
+
+
+def distL1_array(xy1, xy2):
+    """Vectorized 'distL1' between two broadcastable arrays of points (last axis is x,y)."""
+    return (np.abs(xy2 - xy1).sum(axis=-1) + .5).astype(int)
+
+
+vectorized = {distL2: distL2_array, distL1: distL1_array}
+
+
+class DistanceFunction(object):
+    """Distance 'matrix' evaluated on the fly, for instances too large for n x n storage.
+
+    Indexed as the full matrix, D[i,j]; also keeps the coordinates for
+    building neighbor lists.
+    """
+
+    def __init__(self, coord, dist):
+        self.coord = [tuple(c) for c in coord]
+        self.xy = np.array(coord, dtype=float)
+        self.dist = dist
+
+    def __getitem__(self, ij):
+        i, j = ij
+        return self.dist(self.coord[i], self.coord[j])
+
+    def row(self, i):
+        """Distances from city 'i' to all cities, as an array."""
+        if self.dist in vectorized:
+            return vectorized[self.dist](self.xy[i], self.xy)
+        return np.array([self.dist(self.coord[i], c) for c in self.coord])
+
+    def nearest(self, k):
+        """Indices of the (at most) k nearest cities of each city, itself excluded."""
+        n = len(self.coord)
+        k = min(k, n - 1)
+        if cKDTree is not None and self.dist in (distL2, distL1):
+            p = 2 if self.dist == distL2 else 1
+            _, idx = cKDTree(self.xy).query(self.xy, k + 1, p=p)
+            return [[j for j in idx[i] if j != i][:k] for i in range(n)]
+        ret = []
+        for i in range(n):
+            row = self.row(i)
+            row[i] = row.max() + 1
+            ret.append(list(np.argpartition(row, k - 1)[:k]))
+        return ret
+
+
+def mk_matrix(coord, dist, dense=None):
     """Compute a distance matrix for a set of points.
 
     Uses function 'dist' to calculate distance between
     any two points.  Parameters:
     -coord -- list of tuples with coordinates of all points, [(x1,y1),...,(xn,yn)]
     -dist -- distance function
+    -dense -- if True, build the n times n array; if False, evaluate
+              distances on the fly; by default, dense up to DENSE_MAX cities
     """
     n = len(coord)
-    D = {}  # dictionary to hold n times n matrix
-    for i in range(n - 1):
-        for j in range(i + 1, n):
-            (x1, y1) = coord[i]
-            (x2, y2) = coord[j]
-            D[i, j] = dist((x1, y1), (x2, y2))
-            D[j, i] = D[i, j]
+    if dense is None:
+        dense = n <= DENSE_MAX
+    if not dense:
+        return n, DistanceFunction(coord, dist)
+    if dist in vectorized:
+        xy = np.array(coord, dtype=float)
+        D = vectorized[dist](xy[:, None, :], xy[None, :, :])  # n times n array
+    else:
+        D = np.zeros((n, n), dtype=int)
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                D[i, j] = D[j, i] = dist(coord[i], coord[j])
     return n, D
 
 
@@ -84,7 +159,7 @@ def read_tsplib(filename):
     xy_positions = []
     while 1:
         line = f.readline()
-        if line.find("EOF") != -1: break
+        if line.find("EOF") != -1 or line.strip() == "": break
         (i, x, y) = line.split()
         x = float(x)
         y = float(y)
@@ -94,17 +169,39 @@ def read_tsplib(filename):
     return n, xy_positions, D
 
 
-def mk_closest(D, n):
+def mk_closest(D, n, k=None):
     """Compute a sorted list of the distances for each of the nodes.
 
     For each node, the entry is in the form [(d1,i1), (d2,i2), ...]
     where each tuple is a pair (distance,node).
+
+    If 'k' is given, only the k closest nodes are kept; for distances
+    evaluated on the fly, lists are always truncated (K_NEAREST by
+    default) and found with a KD-tree when possible.
     """
     C = []
+    if isinstance(D, DistanceFunction):
+        for i, near in enumerate(D.nearest(k or K_NEAREST)):
+            dlist = [(D[i, j], j) for j in near]
+            dlist.sort()
+            C.append(dlist)
+        return C
+    if isinstance(D, dict):
+        for i in range(n):
+            dlist = [(D[i, j], j) for j in range(n) if j != i]
+            dlist.sort()
+            C.append(dlist[:k])
+        return C
+    D = np.asarray(D)
+    if k is None or k >= n - 1:
+        order = np.argsort(D, axis=1, kind='mergesort')  # stable: ties by node index
+    else:
+        order = np.argpartition(D, k, axis=1)[:, :k + 1]
     for i in range(n):
-        dlist = [(D[i, j], j) for j in range(n) if j != i]
+        row = D[i].tolist()
+        dlist = [(row[j], j) for j in order[i].tolist() if j != i]
         dlist.sort()
-        C.append(dlist)
+        C.append(dlist[:k])
     return C
 
 
@@ -238,17 +335,147 @@ def improve(tour, z, D, C):
     return z
 
 
-def localsearch(tour, z, D, C=None):
+def reverse(tour, tinv, i, j):
+    """Reverse the path of 'tour' from position i to position j (cyclic).
+
+    The complementary path is reversed instead when it is shorter; both
+    give the same set of arcs, only the orientation of the tour differs.
+    """
+    n = len(tour)
+    inner = (j - i) % n + 1
+    if 2 * inner > n:
+        i, j = (j + 1) % n, (i - 1) % n
+        inner = n - inner
+    for k in range(inner // 2):
+        a, b = tour[i], tour[j]
+        tour[i], tinv[b] = b, i
+        tour[j], tinv[a] = a, j
+        i = (i + 1) % n
+        j = (j - 1) % n
+
+
+def two_opt_move(tour, tinv, a, b, c, d):
+    """Replace arcs (a,b) and (c,d) by (a,c) and (b,d).
+
+    Requires either b and d to follow a and c in the tour, or b and d
+    to precede a and c.
+    """
+    n = len(tour)
+    if tour[(tinv[a] + 1) % n] == b:
+        reverse(tour, tinv, tinv[b], tinv[c])
+    else:
+        reverse(tour, tinv, tinv[a], tinv[d])
+
+
+def try_2opt(tour, tinv, a, D, C):
+    """Find and apply an improving 2-opt move removing an arc incident to 'a'.
+
+    Returns (delta, touched cities), or (0, None) if there is none.
+    """
+    n = len(tour)
+    for step in (1, -1):  # arc to the successor, then to the predecessor of 'a'
+        b = tour[(tinv[a] + step) % n]
+        dist_ab = D[a, b]
+        for dist_ac, c in C[a]:
+            if dist_ac >= dist_ab:
+                break
+            d = tour[(tinv[c] + step) % n]
+            if c == b or d == a:
+                continue
+            delta = (dist_ac + D[b, d]) - (dist_ab + D[c, d])
+            if delta < 0:
+                two_opt_move(tour, tinv, a, b, c, d)
+                return delta, (a, b, c, d)
+    return 0, None
+
+
+def try_oropt(tour, tinv, a, D, C, max_len=3):
+    """Find and apply an improving Or-opt move of a segment with 'a' at one end.
+
+    Segments of 1 to 'max_len' cities are moved between two neighbors
+    of one of their ends, in either orientation.  The move is done as
+    two or three 2-opt moves, so it costs reversals only.
+
+    Returns (delta, touched cities), or (0, None) if there is none.
+    """
+    n = len(tour)
+    if n < 8:
+        return 0, None
+    for length in range(1, max_len + 1):
+        for first in (tinv[a], tinv[a] - length + 1):  # segment starting or ending at 'a'
+            u, v = tour[first % n], tour[(first + length - 1) % n]  # segment u..v, forward
+            p, nx = tour[(first - 1) % n], tour[(first + length) % n]
+            seg = set(tour[(first + k) % n] for k in range(length))
+            removal = D[p, u] + D[v, nx] - D[p, nx]
+            for end in (u, v):
+                for dist_ce, c in C[end]:
+                    if dist_ce >= removal:
+                        break
+                    if c in seg:
+                        continue
+                    for x in (c, tour[(tinv[c] - 1) % n]):  # insert in arc (x, next of x)
+                        y = tour[(tinv[x] + 1) % n]
+                        if x == p or x in seg:
+                            continue
+                        fwd = D[x, u] + D[v, y] - D[x, y] - removal
+                        rev = D[x, v] + D[u, y] - D[x, y] - removal
+                        if min(fwd, rev) < 0:
+                            # p u..v nx .. x y  ->  p nx .. x v..u y  ->  (forward) p nx .. x u..v y
+                            two_opt_move(tour, tinv, p, u, x, y)
+                            if x != nx:
+                                two_opt_move(tour, tinv, p, x, nx, v)
+                            if fwd < rev and u != v:
+                                two_opt_move(tour, tinv, x, v, u, y)
+                            return min(fwd, rev), (p, u, v, nx, x, y)
+    return 0, None
+
+
+def improve_dlb(tour, z, D, C, oropt=True):
+    """Local search with don't-look bits; return the length of the local optimum.
+
+    Only cities whose neighborhood changed are examined again: a queue
+    holds the cities with their don't-look bit off, and every move puts
+    the endpoints of the arcs it touched back in the queue.  Moves are
+    2-opt and, if 'oropt' is set, Or-opt.  'tour' is changed in place.
+    """
+    n = len(tour)
+    tinv = [0] * n
+    for k in range(n):
+        tinv[tour[k]] = k  # position of each city in 'tour'
+    queue = deque(tour)
+    active = [True] * n
+    while queue:
+        a = queue.popleft()
+        active[a] = False
+        delta, touched = try_2opt(tour, tinv, a, D, C)
+        if touched is None and oropt:
+            delta, touched = try_oropt(tour, tinv, a, D, C)
+        if touched is None:
+            continue
+        z += delta
+        for i in touched:
+            if not active[i]:
+                active[i] = True
+                queue.append(i)
+    return z
+
+
+def localsearch(tour, z, D, C=None, method="2opt"):
     """Obtain a local optimum starting from solution t; return solution length.
 
     Parameters:
       tour -- initial tour
       z -- length of the initial tour
       D -- distance matrix
+      method -- "2opt": passes of 'improve' over all cities;
+                "or2opt": 2-opt and Or-opt with don't-look bits ('improve_dlb'),
+                for large instances
     """
     n = len(tour)
     if C == None:
         C = mk_closest(D, n)  # create a sorted list of distances to each node
+    if method == "or2opt":
+        return improve_dlb(tour, z, D, C)
     while 1:
         newz = improve(tour, z, D, C)
         if newz < z:
@@ -258,13 +485,14 @@ def localsearch(tour, z, D, C=None):
     return z
 
 
-def multistart_localsearch(k, n, D, report=None):
+def multistart_localsearch(k, n, D, report=None, method="2opt"):
     """Do k iterations of local search, starting from random solutions.
 
     Parameters:
     -k -- number of iterations
     -D -- distance matrix
     -report -- if not None, call it to print verbose output
+    -method -- local search method, see 'localsearch'
 
     Returns best solution and its cost.
     """
@@ -274,7 +502,7 @@ def multistart_localsearch(k, n, D, report=None):
     for i in range(0, k):
         tour = randtour(n)
         z = length(tour, D)
-        z = localsearch(tour, z, D, C)
+        z = localsearch(tour, z, D, C, method)
         if z < bestz or bestz is None:
             bestz = z
             bestt = list(tour)
@@ -284,6 +512,100 @@ def multistart_localsearch(k, n, D, report=None):
     return bestt, bestz
 
 
+# read-only data for the worker processes of 'parallel_multistart_localsearch';
+# set before the pool is created, so workers inherit it through fork
+# instead of receiving a pickled copy of the distance matrix with each task
+shared = {}
+
+
+def fork_available():
+    """True if pool workers are forked, i.e. inherit 'shared' from the parent."""
+    try:
+        return multiprocessing.get_start_method() == "fork"
+    except AttributeError:  # Python 2: fork everywhere but on Windows
+        return sys.platform != "win32"
+
+
+def multistart_worker(seed):
+    """One random restart of local search in a worker process; return (length, tour)."""
+    random.seed(seed)
+    n, D = shared["n"], shared["D"]
+    tour = randtour(n)
+    z = length(tour, D)
+    z = shared["localsearch"](tour, z)
+    return z, tour
+
+
+def parallel_multistart_localsearch(n, D, k=None, budget=None, report=None, method="2opt", nproc=None, ls=None):
+    """Do random-start local search on a pool of processes.
+
+    Parameters:
+    -n -- number of cities
+    -D -- distance matrix
+    -k -- number of restarts (unlimited if None)
+    -budget -- wall-clock time, in seconds, for starting new restarts (unlimited if None)
+    -report -- if not None, called in this process with each improving (length, tour), as they arrive
+    -method -- local search method, see 'localsearch'
+    -nproc -- number of processes (default: number of CPUs)
+    -ls -- alternative local search function ls(tour, z), returning the new length
+
+    At least one of 'k' and 'budget' must be given; restarts running
+    when the budget is over are completed.  Returns best solution and its cost.
+
+    Workers see the instance (and 'ls', which may be a lambda) only through
+    the module-level 'shared' dict inherited by fork; on platforms where
+    processes are spawned (Windows, macOS default) a RuntimeError is raised.
+    """
+    assert k is not None or budget is not None
+    if not fork_available():
+        raise RuntimeError("parallel_multistart_localsearch requires the 'fork' start method")
+    if ls is None:
+        C = mk_closest(D, n)  # computed once, shared by all workers
+        ls = lambda tour, z: localsearch(tour, z, D, C, method)
+    shared.update(n=n, D=D, localsearch=ls)
+    nproc = nproc or multiprocessing.cpu_count()
+    deadline = None if budget is None else time.time() + budget
+    pool = multiprocessing.Pool(nproc)
+    results = queue.Queue()  # filled by the pool's callback as restarts finish
+    bestt = None
+    bestz = None
+    started = 0
+    running = 0
+    pending = []
+    try:
+        while 1:
+            # keep one restart queued per worker, while the budget allows
+            while running < nproc and (k is None or started < k) and \
+                    (deadline is None or time.time() < deadline):
+                pending.append(pool.apply_async(multistart_worker, (random.random(),),
+                                                callback=results.put))
+                started += 1
+                running += 1
+            if not running:
+                break
+            try:
+                z, tour = results.get(timeout=1.)
+            except queue.Empty:
+                # no callback for failed restarts: re-raise their exception
+                for r in pending:
+                    if r.ready() and not r.successful():
+                        r.get()
+                pending = [r for r in pending if not r.ready()]
+                continue
+            running -= 1
+            if bestz is None or z < bestz:
+                bestz = z
+                bestt = list(tour)
+                if report:
+                    report(z, tour)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        shared.clear()
+    return bestt, bestz
+
+
 if __name__ == "__main__":
     """Local search for the Travelling Saleman Problem: sample usage."""
 
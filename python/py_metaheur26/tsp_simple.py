@@ -112,6 +112,16 @@ def multistart_localsearch(k, n, D, report=None):
     return bestt, bestz
 
 
+def parallel_multistart_localsearch(n, D, k=None, budget=None, report=None, nproc=None):
+    """Do random-start local search with this file's 'localsearch' on a pool of processes.
+
+    See 'tsp.parallel_multistart_localsearch' for the parameters.
+    """
+    import tsp
+    return tsp.parallel_multistart_localsearch(n, D, k, budget, report, nproc=nproc,
+                                               ls=lambda tour, z: localsearch(tour, z, D))
+
+
 
 if __name__ == "__main__":
     """Simple local search for the Travelling Saleman Problem: sample usage."""